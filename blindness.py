@@ -3,19 +3,33 @@
 # Professional Clinical UI | 9 Pages | Background Image
 # ============================================================
 
+import argparse
+import os
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 from PIL import Image, ImageTk
 import sqlite3
 import hashlib
-import random
-from datetime import datetime
+import threading
+import json
+import uuid
+from datetime import datetime, timedelta
+
+import notifications
+import patient_search
+import quality_gate
+import scan_queue
+from ui_assets import LOGO_SIZES, BackgroundRenditions, pick
+from ui_diagnostics import MemoryDiagnostics, PhotoCache
+from patient_grading import RECOMMENDATIONS, REFERRAL_GRADE
 
 # ============================================================
 # DATABASE INITIALIZATION
 # ============================================================
 
 DB_NAME = "retinal_ai.db"
+APP_WORKER_ID = "app:" + scan_queue.worker_id()
+EYES = ("Right", "Left")
 conn = sqlite3.connect(DB_NAME)
 cur = conn.cursor()
 
@@ -38,16 +52,11 @@ CREATE TABLE IF NOT EXISTS patients (
 )
 """)
 
-cur.execute("""
-CREATE TABLE IF NOT EXISTS scans (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    patient_id TEXT,
-    eye TEXT,
-    diagnosis TEXT,
-    confidence REAL,
-    scan_date TEXT
-)
-""")
+# Scans table, its column migrations and the durable job queue live in
+# scan_queue.py, so headless workers can run against any retinal_ai.db
+scan_queue.ensure_schema(conn)
+# Trigger-synced FTS5 index behind the patient search box (see patient_search.py)
+patient_search.ensure_index(conn, DB_NAME)
 
 cur.execute("""
 INSERT OR IGNORE INTO users (username, password, role)
@@ -60,14 +69,28 @@ conn.commit()
 # MAIN APPLICATION
 # ============================================================
 
+RESIZE_DEBOUNCE_MS = 200
+
+
 class RetinalAIApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, diagnostics=False, diag_interval_ms=60000):
         super().__init__()
         self.title("RetinalAI – Clinical DR Screening")
-        self.geometry("1400x800")
-        self.resizable(False, False)
+        # 1400x800 where the screen allows it (1366x768 laptops get less)
+        width = min(1400, self.winfo_screenwidth())
+        height = min(800, self.winfo_screenheight() - 60)
+        self.geometry(f"{width}x{height}")
+        self.minsize(1024, 640)
+        self.resizable(True, True)
+        self.set_icon()
+
+        self.backgrounds = BackgroundRenditions()
+        self.bg_photo = self.backgrounds.photo(width, height)
+        self._resize_pending = None
 
         self.current_patient = None
+        self.current_image = None
+        self.current_eyes = {}      # "Right"/"Left" -> {"path", "hash", "quality"}
         self.current_result = None
 
         self.container = tk.Frame(self)
@@ -92,9 +115,131 @@ class RetinalAIApp(tk.Tk):
 
         self.show_page(SplashPage)
 
+        # Memory diagnostics mode: periodic snapshots, report on exit
+        self.diagnostics = None
+        if diagnostics:
+            self.diagnostics = MemoryDiagnostics(self, diag_interval_ms, cache=preview_cache)
+            self.diagnostics.start()
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.bind("<Configure>", self.on_configure)
+
     def show_page(self, page):
         self.frames[page].tkraise()
 
+    def set_icon(self):
+        """Window icon from the pre-drawn logo renditions (the WM picks a size)."""
+        paths = {pick("logo", n, n, [(s, s) for s in LOGO_SIZES], ext="png")
+                 for n in (16, 32, 64)} - {None}
+        if paths:
+            self._icons = [tk.PhotoImage(file=p) for p in sorted(paths)]
+            self.iconphoto(True, *self._icons)
+
+    def on_configure(self, event):
+        # Window drags fire many events; rescale once the size settles
+        if event.widget is not self:
+            return
+        if self._resize_pending is not None:
+            self.after_cancel(self._resize_pending)
+        self._resize_pending = self.after(RESIZE_DEBOUNCE_MS, self.rescale)
+
+    def rescale(self):
+        self._resize_pending = None
+        photo = self.backgrounds.photo(self.winfo_width(), self.winfo_height())
+        if photo is self.bg_photo:
+            return
+        self.bg_photo = photo
+        for frame in self.frames.values():
+            frame.bg_lbl.config(image=photo)
+
+    def close(self):
+        if self.diagnostics is not None:
+            self.diagnostics.write_report()
+        self.destroy()
+
+
+# ============================================================
+# INFERENCE ENGINE (loaded on first use)
+# ============================================================
+
+_engine = None
+
+
+def get_similar_index():
+    """Similar-case index over past scans graded by the current model (see similar_cases.py)."""
+    from similar_cases import default_index
+    return default_index(get_engine().MODEL_VERSION)
+
+
+DASHBOARD_REFRESH_MS = 5000
+REFERRAL_STAGES = ("Moderate", "Severe", "Proliferative DR")
+
+
+def get_dashboard_stats():
+    """Live dashboard figures from scans and the job queue."""
+    total = cur.execute("SELECT COUNT(*) FROM scans").fetchone()[0]
+    positive = cur.execute(
+        "SELECT COUNT(*) FROM scans WHERE diagnosis IS NOT NULL AND diagnosis != 'No DR'"
+    ).fetchone()[0]
+    referrals = cur.execute(
+        f"SELECT COUNT(*) FROM scans WHERE diagnosis IN ({','.join('?' * len(REFERRAL_STAGES))})",
+        REFERRAL_STAGES
+    ).fetchone()[0]
+    depth = scan_queue.queue_depth(conn)
+    # Jobs finished in the last 10 minutes, by any worker or the app
+    since = (datetime.now() - timedelta(minutes=10)).isoformat(timespec="seconds")
+    recent = cur.execute(
+        "SELECT COUNT(*) FROM scan_jobs WHERE state = 'done' AND updated_at >= ?", (since,)
+    ).fetchone()[0]
+    return {
+        "total_scans": total,
+        "positive_dr": positive,
+        "pending_referrals": referrals,
+        "queue_depth": depth["pending"] + depth["running"],
+        "queue_failed": depth["failed"],
+        "throughput_per_min": recent / 10,
+        "alerts_failed": notifications.outbox_counts(conn)["failed"],
+    }
+
+
+_image_store = None
+
+
+def get_image_store():
+    """Content-addressed store for uploaded fundus images."""
+    global _image_store
+    if _image_store is None:
+        from image_store import ImageStore
+        _image_store = ImageStore()
+    return _image_store
+
+
+# Fundus previews and Grad-CAM overlays; bounded so long sessions stay flat
+PREVIEW_CACHE_SIZE = 24
+preview_cache = PhotoCache(PREVIEW_CACHE_SIZE)
+
+_patient_searcher = None
+
+
+def get_patient_searcher():
+    """Background FTS5 search over all patient databases."""
+    global _patient_searcher
+    if _patient_searcher is None:
+        _patient_searcher = patient_search.PatientSearcher()
+    return _patient_searcher
+
+
+def get_engine():
+    """Real model if classifier.pt is available, otherwise the mock in model.py."""
+    global _engine
+    if _engine is None:
+        try:
+            import create_dummy_classifier as engine
+        except (FileNotFoundError, ImportError) as e:
+            print(f"[WARN] Falling back to mock model: {e}")
+            import model as engine
+        _engine = engine
+    return _engine
+
 # ============================================================
 # BASE PAGE (BACKGROUND + SIDEBAR)
 # ============================================================
@@ -104,10 +249,9 @@ class BasePage(tk.Frame):
         super().__init__(parent)
         self.app = app
 
-        # Background image
-        bg = Image.open("assets/medical_background.jpg").resize((1400, 800))
-        self.bg_img = ImageTk.PhotoImage(bg)
-        tk.Label(self, image=self.bg_img).place(relwidth=1, relheight=1)
+        # Shared window-sized background; the app swaps it on resize
+        self.bg_lbl = tk.Label(self, image=app.bg_photo)
+        self.bg_lbl.place(relwidth=1, relheight=1)
 
         # Dark overlay
         overlay = tk.Frame(self, bg="#020617")
@@ -159,9 +303,9 @@ class SplashPage(tk.Frame):
     def __init__(self, parent, app):
         super().__init__(parent)
 
-        bg = Image.open("assets/medical_background.jpg").resize((1400, 800))
-        self.bg_img = ImageTk.PhotoImage(bg)
-        tk.Label(self, image=self.bg_img).place(relwidth=1, relheight=1)
+        # Shared window-sized background; the app swaps it on resize
+        self.bg_lbl = tk.Label(self, image=app.bg_photo)
+        self.bg_lbl.place(relwidth=1, relheight=1)
 
         overlay = tk.Frame(self, bg="#020617")
         overlay.place(relwidth=1, relheight=1)
@@ -193,9 +337,9 @@ class LoginPage(tk.Frame):
     def __init__(self, parent, app):
         super().__init__(parent)
 
-        bg = Image.open("assets/medical_background.jpg").resize((1400, 800))
-        self.bg_img = ImageTk.PhotoImage(bg)
-        tk.Label(self, image=self.bg_img).place(relwidth=1, relheight=1)
+        # Shared window-sized background; the app swaps it on resize
+        self.bg_lbl = tk.Label(self, image=app.bg_photo)
+        self.bg_lbl.place(relwidth=1, relheight=1)
 
         overlay = tk.Frame(self, bg="#020617")
         overlay.place(relwidth=1, relheight=1)
@@ -252,13 +396,20 @@ class DashboardPage(BasePage):
         stats = tk.Frame(self.content, bg="#f8fafc")
         stats.pack(anchor="w")
 
-        self.stat_card(stats, "Total Scans", "1,248", 0)
-        self.stat_card(stats, "Positive DR Cases", "312", 1)
-        self.stat_card(stats, "Pending Referrals", "48", 2)
+        self.values = {
+            "total_scans": self.stat_card(stats, "Total Scans", "–", 0),
+            "positive_dr": self.stat_card(stats, "Positive DR Cases", "–", 1),
+            "pending_referrals": self.stat_card(stats, "Pending Referrals", "–", 2),
+            "queue_depth": self.stat_card(stats, "Analysis Queue", "–", 0, row=1),
+            "throughput": self.stat_card(stats, "Throughput (scans/min)", "–", 1, row=1),
+            # Referral SMS that gave up after a day of retries; resend by hand
+            "alerts_failed": self.stat_card(stats, "Undelivered Alerts", "–", 2, row=1),
+        }
+        self.refresh()
 
-    def stat_card(self, parent, title, value, col):
+    def stat_card(self, parent, title, value, col, row=0):
         card = tk.Frame(parent, bg="white", width=280, height=140)
-        card.grid(row=0, column=col, padx=16)
+        card.grid(row=row, column=col, padx=16, pady=(0, 16))
         card.pack_propagate(False)
 
         tk.Label(card, text=title,
@@ -266,10 +417,101 @@ class DashboardPage(BasePage):
                  fg="#64748b",
                  bg="white").pack(anchor="w", padx=20, pady=(18, 4))
 
-        tk.Label(card, text=value,
-                 font=("Segoe UI", 30, "bold"),
-                 fg="#2563eb",
-                 bg="white").pack(anchor="w", padx=20)
+        value_lbl = tk.Label(card, text=value,
+                             font=("Segoe UI", 30, "bold"),
+                             fg="#2563eb",
+                             bg="white")
+        value_lbl.pack(anchor="w", padx=20)
+        return value_lbl
+
+    def refresh(self):
+        """Reload the live figures; camera-folder ingest keeps the queue moving."""
+        stats = get_dashboard_stats()
+        self.values["total_scans"].config(text=f"{stats['total_scans']:,}")
+        self.values["positive_dr"].config(text=f"{stats['positive_dr']:,}")
+        self.values["pending_referrals"].config(text=f"{stats['pending_referrals']:,}")
+        self.values["queue_depth"].config(text=f"{stats['queue_depth']:,}")
+        self.values["throughput"].config(text=f"{stats['throughput_per_min']:.1f}")
+        self.values["alerts_failed"].config(text=f"{stats['alerts_failed']:,}",
+                                            fg="#dc2626" if stats["alerts_failed"] else "#2563eb")
+        self.after(DASHBOARD_REFRESH_MS, self.refresh)
+
+# ============================================================
+# PATIENT SEARCH (TYPE-AHEAD)
+# ============================================================
+
+SEARCH_DEBOUNCE_MS = 150
+SEARCH_POLL_MS = 20
+
+
+class PatientSearchBox(tk.Frame):
+    """Search entry + result list; queries run on the searcher's thread."""
+
+    def __init__(self, parent, on_select):
+        super().__init__(parent, bg="#f8fafc")
+        self.on_select = on_select
+        self.results = []
+        self._pending = None
+        self._polling = False
+
+        tk.Label(self, text="Find patient (name, phone or ID)", bg="#f8fafc",
+                 font=("Segoe UI", 12)).pack(anchor="w")
+        self.entry = ttk.Entry(self, width=60)
+        self.entry.pack(anchor="w", pady=(4, 0))
+        self.entry.bind("<KeyRelease>", self.on_key)
+        self.listbox = tk.Listbox(self, width=80, height=6, font=("Segoe UI", 11))
+        self.listbox.bind("<<ListboxSelect>>", self.select)
+        self.status = tk.Label(self, text="", bg="#f8fafc", fg="#64748b",
+                               font=("Segoe UI", 9))
+        self.status.pack(anchor="w")
+
+    def on_key(self, _event):
+        # Only query once typing pauses
+        if self._pending is not None:
+            self.after_cancel(self._pending)
+        self._pending = self.after(SEARCH_DEBOUNCE_MS, self.submit)
+
+    def submit(self):
+        self._pending = None
+        text = self.entry.get().strip()
+        if not text:
+            self.show(text, [], None)
+            return
+        get_patient_searcher().submit(text)
+        if not self._polling:
+            self._polling = True
+            self.after(SEARCH_POLL_MS, self.poll)
+
+    def poll(self):
+        text = self.entry.get().strip()
+        if not text:
+            self._polling = False
+            return
+        latest = get_patient_searcher().latest()
+        # Results for text that has since changed are dropped
+        if latest is not None and latest[0] == text:
+            self._polling = False
+            self.show(*latest)
+        else:
+            self.after(SEARCH_POLL_MS, self.poll)
+
+    def show(self, text, results, elapsed_ms):
+        self.results = results
+        self.listbox.delete(0, "end")
+        for r in results:
+            details = " · ".join(str(v) for v in (r["phone"], r["age"], r["gender"]) if v)
+            self.listbox.insert("end", f"{r['pid']} – {r['name']}   {details}")
+        if results:
+            self.listbox.pack(anchor="w", pady=(4, 0), before=self.status)
+        else:
+            self.listbox.pack_forget()
+        self.status.config(text="" if elapsed_ms is None else
+                           f"{len(results)} match(es) in {elapsed_ms:.1f} ms")
+
+    def select(self, _event):
+        chosen = self.listbox.curselection()
+        if chosen:
+            self.on_select(self.results[chosen[0]])
 
 # ============================================================
 # PAGE 3 – PATIENT REGISTRATION
@@ -283,6 +525,8 @@ class PatientPage(BasePage):
                  font=("Segoe UI", 24, "bold"),
                  bg="#f8fafc").pack(anchor="w")
 
+        PatientSearchBox(self.content, self.fill_patient).pack(anchor="w", pady=(10, 0))
+
         form = tk.Frame(self.content, bg="#f8fafc")
         form.pack(pady=20, anchor="w")
 
@@ -302,12 +546,32 @@ class PatientPage(BasePage):
             command=self.save_patient
         ).pack(pady=20)
 
+    def fill_patient(self, patient):
+        """Load a search result into the form."""
+        values = {"Patient ID": patient["pid"], "Name": patient["name"],
+                  "Age": patient["age"], "Gender": patient["gender"], "Diabetes Years": None}
+        for field, value in values.items():
+            self.entries[field].delete(0, "end")
+            self.entries[field].insert(0, "" if value is None else str(value))
+
     def save_patient(self):
         pid = self.entries["Patient ID"].get()
         if not pid:
             messagebox.showerror("Error", "Patient ID required")
             return
+        age, years = (self.entries[f].get().strip() for f in ("Age", "Diabetes Years"))
+        cur.execute(
+            "INSERT INTO patients (patient_id, name, age, gender, diabetes_years, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(patient_id) DO UPDATE SET "
+            "name = excluded.name, age = excluded.age, gender = excluded.gender, "
+            "diabetes_years = COALESCE(excluded.diabetes_years, diabetes_years)",
+            (pid, self.entries["Name"].get().strip(), int(age) if age.isdigit() else None,
+             self.entries["Gender"].get().strip(), int(years) if years.isdigit() else None,
+             datetime.now().isoformat(timespec="seconds"))
+        )
+        conn.commit()
         self.app.current_patient = pid
+        self.app.frames[UploadPage].reset()
         self.app.show_page(UploadPage)
 
 # ============================================================
@@ -322,18 +586,94 @@ class UploadPage(BasePage):
                  font=("Segoe UI", 24, "bold"),
                  bg="#f8fafc").pack(anchor="w")
 
-        ttk.Button(
-            self.content,
-            text="Select Image",
-            command=lambda: filedialog.askopenfilename()
-        ).pack(pady=40)
+        eyes = tk.Frame(self.content, bg="#f8fafc")
+        eyes.pack(pady=30)
+        self.slots = {}
+        for col, eye in enumerate(EYES):
+            slot = tk.Frame(eyes, bg="#f8fafc")
+            slot.grid(row=0, column=col, padx=40, sticky="n")
+            ttk.Button(
+                slot,
+                text=f"Select {eye} Eye",
+                command=lambda e=eye: self.select_image(e)
+            ).pack(pady=(0, 10))
+            preview = tk.Label(slot, bg="#f8fafc")
+            preview.pack()
+            quality_lbl = tk.Label(slot, text="", font=("Segoe UI", 12),
+                                   bg="#f8fafc", justify="left")
+            quality_lbl.pack()
+            self.slots[eye] = {"preview": preview, "quality": quality_lbl}
 
         ttk.Button(
             self.content,
             text="Run AI Analysis",
-            command=lambda: app.show_page(AIProcessingPage)
+            command=self.run_analysis
         ).pack()
 
+    def reset(self):
+        """Clear both eye slots for a new patient."""
+        self.app.current_eyes = {}
+        for slot in self.slots.values():
+            slot["preview"].config(image="")
+            slot["quality"].config(text="")
+            slot.pop("photo", None)
+
+    def select_image(self, eye):
+        path = filedialog.askopenfilename(
+            filetypes=[("Fundus images", "*.png *.jpg *.jpeg *.tif *.tiff *.bmp")]
+        )
+        if not path:
+            return
+        slot = self.slots[eye]
+        self.app.current_eyes.pop(eye, None)
+        # Copy into the store once; everything after this refers to the hash
+        store = get_image_store()
+        try:
+            digest = store.ingest(path)
+            slot["photo"] = preview_cache.get(("thumb", digest),
+                                              lambda: store.open(digest, "thumb"))
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Error", f"Could not read image:\n{e}")
+            return
+        slot["preview"].config(image=slot["photo"])
+        # Quality gate takes milliseconds, so check right away
+        try:
+            quality = quality_gate.assess(path)
+        except ValueError as e:
+            slot["quality"].config(text=f"✖ {e}", fg="#dc2626")
+            return
+        self.app.current_eyes[eye] = {"path": store.path(digest), "hash": digest,
+                                      "quality": quality}
+        colors = {"ok": "#16a34a", "flag": "#d97706", "reject": "#dc2626"}
+        text = {"ok": "✔ Image quality OK", "flag": "⚠ Gradable, but check quality",
+                "reject": "✖ Ungradable image – please retake"}[quality["status"]]
+        if quality["reasons"]:
+            text += "\n" + "\n".join("• " + r for r in quality["reasons"])
+        slot["quality"].config(text=text, fg=colors[quality["status"]])
+
+    def run_analysis(self):
+        eyes = self.app.current_eyes
+        if not eyes:
+            messagebox.showerror("Error", "Select a fundus image for at least one eye")
+            return
+        rejected = [e for e, info in eyes.items() if info["quality"]["status"] == "reject"]
+        if rejected:
+            messagebox.showerror("Ungradable Image", "\n".join(
+                f"{e} eye: " + "; ".join(eyes[e]["quality"]["reasons"]) for e in rejected))
+            return
+        # Persist one job per eye first, leased to this app so no worker races for them
+        visit_id = uuid.uuid4().hex
+        job_ids = {
+            eye: scan_queue.enqueue(
+                conn, self.app.current_patient, info["path"], eye=eye,
+                image_hash=info["hash"], quality=info["quality"],
+                claim_as=APP_WORKER_ID, visit_id=visit_id
+            )
+            for eye, info in eyes.items()
+        }
+        self.app.show_page(AIProcessingPage)
+        self.app.frames[AIProcessingPage].start(job_ids)
+
 # ============================================================
 # PAGE 5 – AI PROCESSING
 # ============================================================
@@ -347,15 +687,83 @@ class AIProcessingPage(BasePage):
                  font=("Segoe UI", 28, "bold"),
                  bg="#f8fafc").pack(pady=100)
 
-        self.after(3000, self.finish)
-
-    def finish(self):
-        self.app.current_result = {
-            "stage": random.choice(
-                ["No DR", "Mild DR", "Moderate DR", "Severe DR", "Proliferative DR"]
-            ),
-            "confidence": round(random.uniform(88, 99), 2)
-        }
+    def start(self, job_ids):
+        """Score the visit's leased jobs (one per eye) off the UI thread, then poll."""
+        self._result = None
+        self._scan_ids = {}
+        self._error = None
+
+        def work():
+            wconn = scan_queue.connect(DB_NAME)
+            jobs = {eye: scan_queue.get_job(wconn, job_id) for eye, job_id in job_ids.items()}
+            eyes = list(jobs)
+            try:
+                qualities = {e: json.loads(j["quality"]) for e, j in jobs.items() if j["quality"]}
+                # Both eyes go through the model as one batch of two
+                result = get_engine().predict_patient(
+                    {e: j["image_path"] for e, j in jobs.items()}, qualities=qualities)
+                # Both scans (or failures) are stored in one transaction
+                scan_ids = scan_queue.record_results(
+                    wconn, [jobs[e] for e in eyes], [result["eyes"][e] for e in eyes],
+                    APP_WORKER_ID)
+                if scan_ids is None:
+                    raise RuntimeError("Analysis was taken over by a background worker")
+                if result["value"] is None:
+                    raise next(iter(result["eyes"].values()))
+                self._scan_ids = dict(zip(eyes, scan_ids))
+                self._result = result
+            except Exception as e:
+                # Anything but an ungradable image is retried by a worker
+                for job in jobs.values():
+                    scan_queue.fail(wconn, job, APP_WORKER_ID, e,
+                                    retry=not isinstance(e, quality_gate.UngradableImageError))
+                self._error = e
+            finally:
+                wconn.close()
+
+        self._thread = threading.Thread(target=work, daemon=True)
+        self._thread.start()
+        self.after(100, self.poll)
+
+    def poll(self):
+        if self._thread.is_alive():
+            self.after(100, self.poll)
+        elif self._error is not None:
+            messagebox.showerror("Analysis Failed", str(self._error))
+            self.app.show_page(UploadPage)
+        else:
+            self.finish(self._result)
+
+    def finish(self, result):
+        worst = result["worst_eye"]
+        eyes = {}
+        index = get_similar_index()
+        # record_results already indexed this visit; don't offer its own scans
+        own = set(self._scan_ids.values())
+        for eye, r in result["eyes"].items():
+            if isinstance(r, Exception):
+                eyes[eye] = {"error": str(r)}
+                continue
+            scan_id = self._scan_ids.get(eye)
+            eyes[eye] = {
+                "stage": r["stage"],
+                "value": r["value"],
+                "probs": r["probs"],
+                "confidence": round(100 * r["confidence"], 2),
+                "scan_id": scan_id,
+                "similar": [],
+            }
+            if r.get("embedding") is not None and scan_id is not None:
+                similar = index.search(r["embedding"], k=3 + len(own))
+                eyes[eye]["similar"] = [s for s in similar if s[0] not in own][:3]
+
+        # Top-level fields describe the worse eye, which drives the recommendation
+        self.app.current_result = dict(eyes[worst], eye=worst, eyes=eyes,
+                                       referral=result["referral"], reasons=result["reasons"])
+        self.app.current_image = self.app.current_eyes[worst]["path"]
+
+        self.app.frames[DiagnosisPage].update_result()
+        self.app.frames[RecommendationPage].update_result()
         self.app.show_page(DiagnosisPage)
 
 # ============================================================
@@ -377,7 +785,17 @@ class DiagnosisPage(BasePage):
             bg="#f8fafc",
             fg="#2563eb"
         )
-        self.result_lbl.pack(pady=40)
+        self.result_lbl.pack(pady=(40, 10))
+
+        self.similar_lbl = tk.Label(self.content, bg="#f8fafc", fg="#334155",
+                                    font=("Segoe UI", 11), justify="left")
+        self.similar_lbl.pack()
+
+        # Grad-CAM overlay, filled in asynchronously once it is rendered
+        self.cam_lbl = tk.Label(self.content, bg="#f8fafc", fg="#64748b",
+                                font=("Segoe UI", 11))
+        self.cam_lbl.pack(pady=10)
+        self._cam_future = None
 
         ttk.Button(
             self.content,
@@ -390,9 +808,46 @@ class DiagnosisPage(BasePage):
     def update_result(self):
         if self.app.current_result:
             r = self.app.current_result
-            self.result_lbl.config(
-                text=f"{r['stage']} DR\nConfidence: {r['confidence']}%"
-            )
+            lines = [f"{r['stage']} ({r['eye']} eye)", f"Confidence: {r['confidence']}%"]
+            for eye, e in r["eyes"].items():
+                if eye != r["eye"]:
+                    lines.append(f"{eye} eye: " + (f"{e['stage']} ({e['confidence']}%)"
+                                                   if "error" not in e else "ungradable"))
+            self.result_lbl.config(text="\n".join(lines))
+            self.cam_lbl.config(image="", text="")
+            self._cam_future = None
+
+            similar = r.get("similar") or []
+            names = getattr(get_engine(), "classes", [])
+            self.similar_lbl.config(text="\n".join(
+                ["Similar past cases:"] +
+                [f"  Scan #{sid}: {names[g] if g < len(names) else g} ({sim:.0%} similar)"
+                 for sid, g, sim in similar]
+            ) if similar else "")
+
+            engine = get_engine()
+            if hasattr(engine, "explain") and self.app.current_image:
+                self.cam_lbl.config(text="Generating explanation map...")
+                self._cam_future = engine.explain([self.app.current_image], [r["value"]])
+                self.after(200, self.poll_overlay, self._cam_future, r.get("scan_id"))
+
+    def poll_overlay(self, future, scan_id):
+        if future is not self._cam_future:
+            return  # a newer scan replaced this one
+        if not future.done():
+            self.after(200, self.poll_overlay, future, scan_id)
+            return
+        if future.exception() is not None:
+            self.cam_lbl.config(text="Explanation map unavailable")
+            return
+
+        path = future.result()[0]
+        self.cam_img = preview_cache.get(("cam", path),
+                                         lambda: Image.open(path).resize((320, 320)))
+        self.cam_lbl.config(image=self.cam_img, text="")
+        if scan_id is not None:
+            cur.execute("UPDATE scans SET cam_path=? WHERE id=?", (path, scan_id))
+            conn.commit()
 
 # ============================================================
 # PAGE 7 – RECOMMENDATION
@@ -407,12 +862,32 @@ class RecommendationPage(BasePage):
                  font=("Segoe UI", 24, "bold"),
                  bg="#f8fafc").pack(anchor="w")
 
-        tk.Label(
+        self.summary_lbl = tk.Label(self.content, font=("Segoe UI", 14, "bold"),
+                                    bg="#f8fafc", fg="#2563eb", justify="left")
+        self.summary_lbl.pack(pady=(30, 0))
+
+        self.advice_lbl = tk.Label(
             self.content,
-            text="• Refer to ophthalmologist\n• Follow-up in 3–6 months\n• Maintain glycemic control",
+            text=RECOMMENDATIONS[REFERRAL_GRADE],
             font=("Segoe UI", 16),
-            bg="#f8fafc"
-        ).pack(pady=40)
+            bg="#f8fafc",
+            justify="left"
+        )
+        self.advice_lbl.pack(pady=40)
+
+    def update_result(self):
+        """Advice follows the worse eye (already computed with the diagnosis)."""
+        r = self.app.current_result
+        if not r:
+            return
+        summary = f"Patient severity: {r['stage']} (worse eye: {r['eye']})"
+        if r["reasons"]:
+            summary += "\nReferral: " + "; ".join(r["reasons"])
+        self.summary_lbl.config(text=summary, fg="#dc2626" if r["referral"] else "#16a34a")
+        advice = RECOMMENDATIONS[r["value"]]
+        if r["referral"] and r["value"] < REFERRAL_GRADE:
+            advice = "• Refer: an eye could not be graded\n" + advice
+        self.advice_lbl.config(text=advice)
 
 # ============================================================
 # PAGE 8 – HISTORY
@@ -458,4 +933,11 @@ class SettingsPage(BasePage):
 # ============================================================
 
 if __name__ == "__main__":
-    RetinalAIApp().mainloop()
+    parser = argparse.ArgumentParser(description="RetinalAI clinical screening app")
+    parser.add_argument("--diagnostics", action="store_true",
+                        default=bool(os.environ.get("RETINAL_DIAGNOSTICS")),
+                        help="profile memory and write a report on exit")
+    parser.add_argument("--diag-interval", type=float, default=60,
+                        help="seconds between memory snapshots")
+    args = parser.parse_args()
+    RetinalAIApp(args.diagnostics, int(args.diag_interval * 1000)).mainloop()
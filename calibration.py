@@ -0,0 +1,160 @@
+"""
+Confidence calibration and compact probability storage.
+
+Temperature scaling is fitted offline on validation logits (loaded with
+the checkpoint's own ``preprocessing``) and saved to ``calibration.json``; the inference engine divides its log-probabilities
+by that temperature before the softmax. Probability vectors are stored
+per scan as a packed little-endian float16 blob (10 bytes for 5 classes)
+so triage and statistics never need to re-run the model.
+
+Usage:
+    python calibration.py --checkpoint classifier.pt --data dataset/train
+    python calibration.py --checkpoint classifier_student.pt --out calibration_student.json
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+
+CALIBRATION_PATH = "calibration.json"
+NUM_CLASSES = 5
+
+
+# ============================================================
+# Packed Probability Blobs
+# ============================================================
+def pack_probs(probs):
+    """Probability vector -> float16 bytes for a SQLite BLOB column."""
+    return np.asarray(probs, dtype="<f2").tobytes()
+
+
+def unpack_probs(blob):
+    """Inverse of ``pack_probs``; accepts one blob or a list of equal-size blobs."""
+    if isinstance(blob, (list, tuple)):
+        blob = b"".join(blob)
+        data = np.frombuffer(blob, dtype="<f2").astype(np.float32)
+        return data.reshape(-1, NUM_CLASSES)
+    return np.frombuffer(blob, dtype="<f2").astype(np.float32)
+
+
+# ============================================================
+# Temperature Scaling
+# ============================================================
+def softmax(logits, temperature=1.0):
+    z = np.asarray(logits, dtype=np.float64) / temperature
+    z = z - z.max(axis=1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def nll(logits, labels, temperature):
+    z = np.asarray(logits, dtype=np.float64) / temperature
+    z = z - z.max(axis=1, keepdims=True)
+    log_norm = np.log(np.exp(z).sum(axis=1))
+    return float(np.mean(log_norm - z[np.arange(len(labels)), labels]))
+
+
+def fit_temperature(logits, labels, lo=0.05, hi=20.0, iters=60):
+    """Temperature minimizing validation NLL (golden-section search on log T).
+
+    ``logits`` may be raw logits or log-probabilities (LogSoftmax output);
+    scaling either by 1/T gives the same calibrated softmax.
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    a, b = np.log(lo), np.log(hi)
+    ratio = (np.sqrt(5) - 1) / 2
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    fc, fd = nll(logits, labels, np.exp(c)), nll(logits, labels, np.exp(d))
+    for _ in range(iters):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = nll(logits, labels, np.exp(c))
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = nll(logits, labels, np.exp(d))
+    return float(np.exp((a + b) / 2))
+
+
+def expected_calibration_error(probs, labels, bins=15):
+    """ECE over equal-width confidence bins, computed with bincount."""
+    probs = np.asarray(probs)
+    labels = np.asarray(labels)
+    conf = probs.max(axis=1)
+    correct = (probs.argmax(axis=1) == labels).astype(np.float64)
+    idx = np.minimum((conf * bins).astype(np.int64), bins - 1)
+    count = np.bincount(idx, minlength=bins)
+    gap = np.abs(np.bincount(idx, correct, bins) - np.bincount(idx, conf, bins))
+    return float(gap.sum() / max(count.sum(), 1))
+
+
+def load_temperature(path=CALIBRATION_PATH):
+    """Fitted temperature, or 1.0 (no calibration) if none has been saved."""
+    if not os.path.exists(path):
+        return 1.0
+    with open(path) as f:
+        return float(json.load(f)["temperature"])
+
+
+# ============================================================
+# Offline Fit
+# ============================================================
+def main():
+    import torch
+    from torch.utils.data import DataLoader, Subset, random_split
+    from torchvision import datasets, transforms
+
+    from checkpoints import load_classifier
+
+    parser = argparse.ArgumentParser(description="Fit temperature scaling on a validation split")
+    parser.add_argument("--checkpoint", default="classifier.pt")
+    parser.add_argument("--data", default="dataset/train")
+    parser.add_argument("--out", default=CALIBRATION_PATH)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model, checkpoint = load_classifier(args.checkpoint, device)
+    preprocessing = checkpoint.get("preprocessing")
+    loader = datasets.folder.default_loader
+    if preprocessing == "ben_graham":
+        from preprocessing import FundusPreprocessor
+        loader = FundusPreprocessor(size=224).load
+
+    dataset = datasets.ImageFolder(args.data, loader=loader, transform=transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225))
+    ]))
+    train_size = int(0.8 * len(dataset))
+    _, val_idx = random_split(range(len(dataset)), [train_size, len(dataset) - train_size],
+                              generator=torch.Generator().manual_seed(args.seed))
+    loader = DataLoader(Subset(dataset, list(val_idx)), batch_size=64, num_workers=2)
+
+    logits, labels = [], []
+    with torch.inference_mode():
+        for inputs, targets in loader:
+            logits.append(model(inputs.to(device)).cpu().numpy())
+            labels.append(targets.numpy())
+    logits, labels = np.concatenate(logits), np.concatenate(labels)
+
+    temperature = fit_temperature(logits, labels)
+    result = {
+        "temperature": temperature,
+        "nll_before": nll(logits, labels, 1.0),
+        "nll_after": nll(logits, labels, temperature),
+        "ece_before": expected_calibration_error(softmax(logits), labels),
+        "ece_after": expected_calibration_error(softmax(logits, temperature), labels),
+        "n_validation": int(len(labels)),
+        "preprocessing": preprocessing,
+    }
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"🌡️ Temperature {temperature:.3f} | ECE {result['ece_before']:.4f} -> "
+          f"{result['ece_after']:.4f} | saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
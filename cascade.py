@@ -0,0 +1,136 @@
+"""
+Confidence-based two-stage cascade inference.
+
+A small, fast model (e.g. the distilled student from ``distill.py``)
+scores every image. Only images whose top-class probability is below
+``threshold`` are escalated to the ResNet152. The cascade records its
+escalation rate, end-to-end throughput and -- on audited images, where
+the large model is run regardless -- agreement with always running the
+large model.
+
+Each model is calibrated separately: ``small_temperature`` and
+``large_temperature`` (see calibration.py; fit the student with
+``--checkpoint classifier_student.pt --out calibration_student.json``)
+are applied to that model's own log-probabilities, so the escalation
+threshold compares calibrated student confidences. Test-time
+augmentation (``large_views``) applies to escalated images only; the
+student always scores a single view so confident cases stay cheap.
+"""
+import time
+
+import numpy as np
+import torch
+
+from tta import predict_tta
+
+
+class CascadeClassifier:
+    """Two-stage small -> large classifier over batches of image tensors."""
+
+    def __init__(self, small, large, threshold=0.9, audit_rate=0.0, device=None,
+                 small_temperature=1.0, large_temperature=1.0, large_views=1):
+        self.small = small.eval()
+        self.large = large.eval()
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.device = device or next(large.parameters()).device
+        self.small_temperature = small_temperature
+        self.large_temperature = large_temperature
+        self.large_views = large_views
+        self.last_large = None      # rows of the last batch the large model ran on
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.stats = {
+            "images": 0,
+            "escalated": 0,
+            "seconds": 0.0,
+            "audited": 0,
+            "audit_agree": 0,
+        }
+
+    def _probs(self, model, batch, temperature=1.0, views=1):
+        """Calibrated probabilities; softmax(log p / T) is invariant to LogSoftmax heads."""
+        if views > 1:
+            probs = predict_tta(model, batch, views, self.device)
+            return torch.softmax(torch.log(probs) / temperature, dim=1) \
+                if temperature != 1.0 else probs
+        return torch.softmax(model(batch) / temperature, dim=1)
+
+    def _small_probs(self, batch):
+        return self._probs(self.small, batch, self.small_temperature)
+
+    def _large_probs(self, batch):
+        return self._probs(self.large, batch, self.large_temperature, self.large_views)
+
+    def predict(self, batch):
+        """Return ``(probs, escalated)`` for a (B, C, H, W) batch.
+
+        ``probs`` come from the large model for escalated rows and from the
+        small model otherwise, each with its own temperature applied;
+        ``escalated`` is a boolean NumPy mask.
+        """
+        start = time.perf_counter()
+        batch = batch.to(self.device)
+        with torch.inference_mode():
+            probs = self._small_probs(batch)
+            escalate = probs.max(dim=1).values < self.threshold
+
+            audit = torch.zeros_like(escalate)
+            if self.audit_rate > 0:
+                audit = (torch.rand(len(batch), device=escalate.device) < self.audit_rate) & ~escalate
+
+            run_large = escalate | audit
+            self.last_large = run_large.cpu().numpy()
+            if run_large.any():
+                large_probs = self._large_probs(batch[run_large])
+                if audit.any():
+                    audited = audit[run_large]
+                    agree = large_probs[audited].argmax(1) == probs[audit].argmax(1)
+                    self.stats["audited"] += int(audited.sum())
+                    self.stats["audit_agree"] += int(agree.sum())
+                probs[escalate] = large_probs[escalate[run_large]]
+
+        self.stats["images"] += len(batch)
+        self.stats["escalated"] += int(escalate.sum())
+        self.stats["seconds"] += time.perf_counter() - start
+        return probs.cpu(), escalate.cpu().numpy()
+
+    def summary(self):
+        s = self.stats
+        return {
+            "images": s["images"],
+            "escalation_rate": s["escalated"] / max(s["images"], 1),
+            "images_per_second": s["images"] / s["seconds"] if s["seconds"] else 0.0,
+            "audit_agreement": s["audit_agree"] / s["audited"] if s["audited"] else None,
+        }
+
+    def measure_agreement(self, loader):
+        """Run the cascade and the large model on every image and compare.
+
+        Returns escalation rate, agreement with always-large and the
+        throughput of both paths, so ``threshold`` can be tuned offline.
+        """
+        self.reset_stats()
+        cascade_preds, large_preds = [], []
+        large_seconds = 0.0
+        for batch in loader:
+            inputs = batch[0] if isinstance(batch, (list, tuple)) else batch
+            probs, _ = self.predict(inputs)
+            cascade_preds.append(probs.argmax(1).numpy())
+
+            start = time.perf_counter()
+            with torch.inference_mode():
+                large = self._large_probs(inputs.to(self.device))
+            large_seconds += time.perf_counter() - start
+            large_preds.append(large.argmax(1).cpu().numpy())
+
+        cascade_preds = np.concatenate(cascade_preds)
+        large_preds = np.concatenate(large_preds)
+        report = self.summary()
+        report["agreement"] = float((cascade_preds == large_preds).mean())
+        report["large_images_per_second"] = len(large_preds) / large_seconds
+        print(f"🪜 Cascade @ {self.threshold:.2f}: escalated {report['escalation_rate']:.1%}, "
+              f"agreement {report['agreement']:.1%}, "
+              f"{report['images_per_second']:.1f} vs {report['large_images_per_second']:.1f} img/s")
+        return report
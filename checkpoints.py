@@ -0,0 +1,102 @@
+"""
+Shared model construction and checkpoint loading.
+
+Rebuilds the architectures this project trains -- the ResNet152
+classifier from ``training.py`` / ``create_dummy_classifier.py``, the
+ResNet18 model from ``train_model.py`` and the distilled MobileNetV3
+student from ``distill.py`` -- from the ``architecture`` key a checkpoint
+carries, without loading anything at import time.
+"""
+import hashlib
+import os
+
+import torch
+from torch import nn
+from torchvision import models
+
+NUM_CLASSES = 5
+
+
+# ============================================================
+# Architectures
+# ============================================================
+def build_model(architecture="resnet152", num_classes=NUM_CLASSES, pretrained=False):
+    """Return a model with the project's classification head.
+
+    ``pretrained`` initializes the backbone from ImageNet weights; the head
+    is always freshly initialized.
+    """
+    weights = "DEFAULT" if pretrained else None
+    if architecture == "resnet152":
+        model = models.resnet152(weights=weights)
+        model.fc = nn.Sequential(
+            nn.Linear(model.fc.in_features, 512),
+            nn.ReLU(),
+            nn.Linear(512, num_classes),
+            nn.LogSoftmax(dim=1)
+        )
+    elif architecture == "resnet18":
+        model = models.resnet18(weights=weights)
+        model.fc = nn.Sequential(
+            nn.Linear(model.fc.in_features, 512),
+            nn.ReLU(inplace=True),
+            nn.Dropout(0.3),
+            nn.Linear(512, num_classes)
+        )
+    elif architecture == "mobilenet_v3_small":
+        model = models.mobilenet_v3_small(weights=weights)
+        model.classifier = nn.Sequential(
+            nn.Linear(model.classifier[0].in_features, 512),
+            nn.Hardswish(inplace=True),
+            nn.Dropout(0.3),
+            nn.Linear(512, num_classes)
+        )
+    else:
+        raise ValueError(f"Unknown architecture: {architecture}")
+    return model
+
+
+# ============================================================
+# Checkpoints
+# ============================================================
+def load_classifier(path, device="cpu", architecture=None):
+    """Load a checkpoint into a freshly built model, in eval mode.
+
+    The architecture defaults to the checkpoint's ``architecture`` key and
+    falls back to ResNet152, which is what ``training.py`` saved without
+    the key. Returns ``(model, checkpoint)``.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"⚠️ Model file not found at: {path}")
+
+    checkpoint = torch.load(path, map_location="cpu")
+    architecture = architecture or checkpoint.get("architecture", "resnet152")
+    model = build_model(architecture, checkpoint.get("num_classes", NUM_CLASSES))
+    model.load_state_dict(checkpoint["model_state_dict"])
+    model.to(device)
+    model.eval()
+    return model, checkpoint
+
+
+def model_version(path):
+    """Short content hash identifying a checkpoint file."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()[:12]
+
+
+def serving_version(paths, **settings):
+    """Short hash of every file and setting that shapes a grade (recorded on every scan).
+
+    ``paths`` are checkpoints and calibration files; a missing file hashes
+    as absent, so adding or deleting one changes the version too.
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        digest = model_version(path) if os.path.exists(path) else "-"
+        h.update(f"{os.path.basename(path)}:{digest};".encode())
+    for key in sorted(settings):
+        h.update(f"{key}={settings[key]};".encode())
+    return h.hexdigest()[:12]
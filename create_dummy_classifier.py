@@ -9,6 +9,18 @@ from torchvision import models, transforms
 from PIL import Image
 from torch.optim import lr_scheduler
 import os
+import threading
+import numpy as np
+
+from tta import predict_tta
+from preprocessing import FundusPreprocessor
+from checkpoints import load_classifier, serving_version
+from cascade import CascadeClassifier
+from calibration import load_temperature
+from gradcam import GradCAM, GradCAMService
+from similar_cases import EmbeddingHook
+from quality_gate import UngradableImageError, assess
+from patient_grading import aggregate
 
 print("✅ Imported packages successfully")
 
@@ -41,7 +53,7 @@ model.to(device)
 # Load Model Function — NO OPTIMIZER LOADING
 # ============================================================
 def load_model(path):
-    """Load model weights only, skip optimizer completely."""
+    """Load model weights only, skip optimizer completely. Returns ``(model, checkpoint)``."""
     if not os.path.exists(path):
         raise FileNotFoundError(
             f"⚠️ Model file not found at: {path}\n"
@@ -55,38 +67,75 @@ def load_model(path):
     print("✅ Model weights loaded successfully!")
     print("ℹ️ Optimizer loading skipped — not required for prediction.")
 
-    return model
+    return model, checkpoint
 
 # ============================================================
 # Inference Function
 # ============================================================
-def inference(model, file, transform, classes):
-    """Run inference on a single retinal image."""
-    file = Image.open(file).convert('RGB')
+def inference(model, file, transform, classes, tta_views=1, preprocessor=None,
+              cascade=None, temperature=1.0):
+    """Run inference on a single retinal image.
+
+    Returns ``(value, predicted_class, probs)`` where ``probs`` is the full
+    softmax vector, temperature-scaled when a calibration has been fitted.
+
+    With ``tta_views > 1`` the prediction averages that many deterministic
+    test-time augmentation views, evaluated in one forward pass. Pass a
+    ``FundusPreprocessor`` for checkpoints trained on Ben Graham images.
+    With a ``CascadeClassifier`` the small model answers confident cases
+    and only uncertain ones reach ``model``; the cascade applies each
+    model's own temperature and TTA (escalated images only) itself.
+    """
+    if preprocessor is not None:
+        file = preprocessor.load(file)
+    else:
+        file = Image.open(file).convert('RGB')
     img = transform(file).unsqueeze(0)
     print("🌀 Transforming image and sending to model...")
 
     model.eval()
     with torch.no_grad():
-        out = model(img.to(device))
-        ps = torch.exp(out)
+        if cascade is not None:
+            cascade.large_views = tta_views
+            ps, escalated = cascade.predict(img)
+            print(f"🪜 Cascade: {'escalated to large model' if escalated[0] else 'answered by small model'}")
+        else:
+            if tta_views > 1:
+                ps = predict_tta(model, img, tta_views, device)
+            else:
+                ps = torch.exp(model(img.to(device)))
+            if temperature != 1.0:
+                ps = torch.softmax(torch.log(ps) / temperature, dim=1)
         top_p, top_class = ps.topk(1, dim=1)
         value = top_class.item()
         predicted_class = classes[value]
 
         print(f"🎯 Predicted Severity Value: {value}")
-        print(f"🔹 Predicted Class: {predicted_class}")
+        print(f"🔹 Predicted Class: {predicted_class} ({top_p.item():.1%})")
 
-        return value, predicted_class
+        return value, predicted_class, ps[0].cpu().numpy()
 
 # ============================================================
 # Model Initialization and Transforms
 # ============================================================
 MODEL_PATH = os.path.join(os.getcwd(), "classifier.pt")
-model = load_model(MODEL_PATH)
+model, checkpoint = load_model(MODEL_PATH)
 
 classes = ['No DR', 'Mild', 'Moderate', 'Severe', 'Proliferative DR']
 
+# Number of test-time augmentation views per image (1 = no TTA)
+TTA_VIEWS = 1
+
+# Temperature fitted offline by calibration.py (1.0 when not calibrated)
+CALIBRATION_PATH = os.path.join(os.getcwd(), "calibration.json")
+TEMPERATURE = load_temperature(CALIBRATION_PATH)
+
+# Serve images the way the checkpoint was trained (train_model.py records it)
+PREPROCESSING = checkpoint.get("preprocessing")
+preprocessor = FundusPreprocessor(size=224) if PREPROCESSING == "ben_graham" else None
+if preprocessor is not None:
+    print("✅ Ben Graham preprocessing enabled (from checkpoint)")
+
 test_transforms = transforms.Compose([
     transforms.Resize((224, 224)),
     transforms.ToTensor(),
@@ -94,11 +143,175 @@ test_transforms = transforms.Compose([
                          std=(0.229, 0.224, 0.225))
 ])
 
+# ============================================================
+# Cascade Mode (enabled when a distilled student is present)
+# ============================================================
+STUDENT_PATH = os.path.join(os.getcwd(), "classifier_student.pt")
+# The student's own temperature (calibration.py --checkpoint classifier_student.pt
+# --out calibration_student.json); uncalibrated (1.0) until fitted
+STUDENT_CALIBRATION_PATH = os.path.join(os.getcwd(), "calibration_student.json")
+STUDENT_TEMPERATURE = load_temperature(STUDENT_CALIBRATION_PATH)
+CASCADE_THRESHOLD = 0.9     # escalate when the student's top probability is below this
+CASCADE_AUDIT_RATE = 0.05   # share of confident images also checked by the large model
+
+cascade = None
+if os.path.exists(STUDENT_PATH):
+    student, student_checkpoint = load_classifier(STUDENT_PATH, device)
+    # Both models see the same input images, so they must share the preprocessing
+    if student_checkpoint.get("preprocessing") != PREPROCESSING:
+        print(f"[WARN] Student preprocessing {student_checkpoint.get('preprocessing')!r} != "
+              f"{PREPROCESSING!r}; re-distill it. Cascade disabled.")
+    else:
+        cascade = CascadeClassifier(student, model, CASCADE_THRESHOLD,
+                                    audit_rate=CASCADE_AUDIT_RATE, device=device,
+                                    small_temperature=STUDENT_TEMPERATURE,
+                                    large_temperature=TEMPERATURE, large_views=TTA_VIEWS)
+        print("✅ Cascade mode enabled (student -> ResNet152)")
+
+# Stored with every scan so grades can be traced to (and re-scored by) a model:
+# changes to either checkpoint, calibration, TTA or preprocessing give a new version
+if cascade is not None:
+    MODEL_VERSION = serving_version(
+        [MODEL_PATH, CALIBRATION_PATH, STUDENT_PATH, STUDENT_CALIBRATION_PATH],
+        tta_views=TTA_VIEWS, preprocessing=PREPROCESSING, cascade_threshold=CASCADE_THRESHOLD)
+else:
+    MODEL_VERSION = serving_version([MODEL_PATH, CALIBRATION_PATH],
+                                    tta_views=TTA_VIEWS, preprocessing=PREPROCESSING)
+print(f"ℹ️ Model version {MODEL_VERSION}")
+
+# ============================================================
+# Grad-CAM Explanations (background thread, last conv block)
+# ============================================================
+model_lock = threading.Lock()   # shared by predict() and Grad-CAM hooks
+gradcam_service = GradCAMService(GradCAM(model, model.layer4, model_lock), test_transforms,
+                                 loader=preprocessor.load if preprocessor is not None else None)
+
+
+# 512-d output of model.fc[0], used for similar-case retrieval
+embedding_hook = EmbeddingHook(model)
+
+
+def explain(paths, class_idx=None):
+    """Future resolving to cached Grad-CAM overlay paths for ``paths``."""
+    return gradcam_service.submit(paths, class_idx)
+
+# ============================================================
+# Quality Gate (runs in milliseconds, before the model)
+# ============================================================
+QUALITY_GATE = True
+
 # ============================================================
 # Main Function
 # ============================================================
-def main(path):
+def predict(path, tta_views=TTA_VIEWS, quality=None):
+    """Full result for the app: grade, class name and calibrated probabilities.
+
+    Raises ``UngradableImageError`` when the image fails the quality gate;
+    pass a precomputed ``quality`` dict to skip re-assessing it.
+    """
+    if QUALITY_GATE:
+        quality = quality or assess(path)
+        if quality["status"] == "reject":
+            raise UngradableImageError(quality)
+    with model_lock:
+        embedding_hook.last = None
+        value, predicted_class, probs = inference(model, path, test_transforms, classes, tta_views,
+                                                  preprocessor, cascade, TEMPERATURE)
+        # None when the cascade answered without running the ResNet152
+        embedding = embedding_hook.pop()
+    return {
+        "value": value,
+        "stage": predicted_class,
+        "probs": probs,
+        "confidence": float(probs[value]),
+        "embedding": embedding,
+        "quality": quality,
+        "model_version": MODEL_VERSION,
+    }
+
+
+def predict_batch(paths, tta_views=TTA_VIEWS, qualities=None):
+    """``predict`` for several images with a single forward pass.
+
+    Returns one entry per path, in order: the result dict, or the exception
+    (e.g. ``UngradableImageError``) that image failed with.
+    """
+    qualities = qualities or [None] * len(paths)
+    out = [None] * len(paths)
+    images, kept = [], []
+    for i, (path, quality) in enumerate(zip(paths, qualities)):
+        try:
+            if QUALITY_GATE:
+                quality = quality or assess(path)
+                if quality["status"] == "reject":
+                    raise UngradableImageError(quality)
+            img = preprocessor.load(path) if preprocessor is not None else \
+                Image.open(path).convert('RGB')
+        except (OSError, ValueError) as e:
+            out[i] = e
+            continue
+        images.append(test_transforms(img))
+        kept.append((i, quality))
+    if not images:
+        return out
+
+    batch = torch.stack(images)
+    with model_lock:
+        embedding_hook.last = None
+        model.eval()
+        with torch.no_grad():
+            if cascade is not None:
+                # Calibrated per model inside the cascade; TTA on escalated rows only
+                cascade.large_views = tta_views
+                ps, _ = cascade.predict(batch)
+            else:
+                if tta_views > 1:
+                    ps = predict_tta(model, batch, tta_views, device)
+                else:
+                    ps = torch.exp(model(batch.to(device)))
+                if TEMPERATURE != 1.0:
+                    ps = torch.softmax(torch.log(ps) / TEMPERATURE, dim=1)
+        embeddings = embedding_hook.last
+        embedding_hook.last = None
+    ps = ps.cpu().numpy()
+
+    # The cascade runs the ResNet152 on escalated/audited rows only; the rest get no embedding
+    rows = np.arange(len(images)) if cascade is None else np.flatnonzero(cascade.last_large)
+    by_row = {}
+    if embeddings is not None and len(rows):
+        # TTA views are stacked view-major: (views * rows, 512)
+        embeddings = embeddings.float().view(-1, len(rows), embeddings.shape[-1])
+        by_row = dict(zip(rows.tolist(), embeddings.mean(dim=0).cpu().numpy()))
+
+    for j, (i, quality) in enumerate(kept):
+        value = int(ps[j].argmax())
+        out[i] = {
+            "value": value,
+            "stage": classes[value],
+            "probs": ps[j],
+            "confidence": float(ps[j][value]),
+            "embedding": by_row.get(j),
+            "quality": quality,
+            "model_version": MODEL_VERSION,
+        }
+    return out
+
+
+def predict_patient(eye_paths, tta_views=TTA_VIEWS, qualities=None):
+    """Score a patient's eyes (``{"Right": path, "Left": path}``) as one batch.
+
+    Returns the per-eye results plus the patient-level grade (worse eye)
+    and referral decision; see ``patient_grading.aggregate``.
+    """
+    eyes = list(eye_paths)
+    qualities = qualities or {}
+    results = predict_batch([eye_paths[e] for e in eyes], tta_views,
+                            [qualities.get(e) for e in eyes])
+    return aggregate(dict(zip(eyes, results)), classes)
+
+
+def main(path, tta_views=TTA_VIEWS):
     """Main function to get model predictions."""
-    x, y = inference(model, path, test_transforms, classes)
-    return x, y
+    result = predict(path, tta_views)
+    return result["value"], result["stage"]
     
\ No newline at end of file
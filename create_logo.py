@@ -1,38 +1,58 @@
 """
 Create logo for Retinal AI application
+
+Also draws the logo natively at every size in ui_assets.LOGO_SIZES
+(assets/renditions/), so small icons stay crisp instead of being
+downscaled from the 200px version.
 """
 from PIL import Image, ImageDraw, ImageFont
 import os
 
-def create_logo():
-    """Create a logo image for the Retinal AI app"""
-    # Create logo image
-    width, height = 200, 200
-    img = Image.new('RGB', (width, height), color='#007BFF')
+from ui_assets import LOGO_SIZES, RENDITIONS_DIR, rendition_path
+
+def draw_logo(size=200):
+    """Draw the logo at ``size`` x ``size`` pixels (designed at 200)"""
+    s = size / 200
+    img = Image.new('RGB', (size, size), color='#007BFF')
     draw = ImageDraw.Draw(img)
-    
+
+    def box(x0, y0, x1, y1):
+        return [round(x0 * s), round(y0 * s), round(x1 * s), round(y1 * s)]
+
     # Draw eye shape
     # Outer eye
-    draw.ellipse([20, 40, 180, 160], fill='white', outline='#0056B3', width=3)
-    
+    draw.ellipse(box(20, 40, 180, 160), fill='white', outline='#0056B3', width=max(1, round(3 * s)))
+
     # Iris
-    draw.ellipse([60, 80, 140, 120], fill='#007BFF', outline='#0056B3', width=2)
-    
+    draw.ellipse(box(60, 80, 140, 120), fill='#007BFF', outline='#0056B3', width=max(1, round(2 * s)))
+
     # Pupil
-    draw.ellipse([90, 95, 110, 105], fill='#1A2B3C')
-    
+    draw.ellipse(box(90, 95, 110, 105), fill='#1A2B3C')
+
     # Reflection
-    draw.ellipse([95, 98, 105, 103], fill='white')
-    
+    draw.ellipse(box(95, 98, 105, 103), fill='white')
+    return img
+
+def create_logo():
+    """Create a logo image for the Retinal AI app"""
+    # Create logo image
+    img = draw_logo(200)
+
     # Save logo
     os.makedirs('assets', exist_ok=True)
     img.save('assets/logo.png')
     print("Logo created: assets/logo.png")
-    
+
     # Create small icon version
     icon = img.resize((64, 64), Image.Resampling.LANCZOS)
     icon.save('assets/logo_icon.png')
     print("Logo icon created: assets/logo_icon.png")
 
+    # Renditions for the resizable app (window icons, HiDPI screens)
+    os.makedirs(RENDITIONS_DIR, exist_ok=True)
+    for size in LOGO_SIZES:
+        draw_logo(size).save(rendition_path('logo', (size, size), 'png'))
+    print(f"Logo renditions created: {RENDITIONS_DIR}/logo_*.png ({len(LOGO_SIZES)} sizes)")
+
 if __name__ == "__main__":
     create_logo()
@@ -0,0 +1,291 @@
+"""
+Knowledge distillation from the ResNet152 classifier to a compact student.
+
+The teacher's class log-probabilities are computed once over the dataset
+and cached to disk, keyed on the sample list, the teacher checkpoint's
+content hash and its preprocessing. The student (ResNet18 or
+MobileNetV3-Small, from ImageNet weights) is trained on a mix of the
+temperature-softened teacher distribution and the hard labels. Images
+are loaded with the teacher's ``preprocessing`` (Ben Graham or raw),
+which is saved into the student checkpoint. A report compares teacher and student
+on validation QWK/accuracy, CPU latency and model size.
+
+Usage:
+    python distill.py --teacher classifier.pt --student resnet18 \\
+        --out classifier_student.pt
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from torch import optim
+from torch.utils.data import DataLoader, Dataset, random_split
+from torchvision import datasets, transforms
+from tqdm import tqdm
+
+from checkpoints import build_model, load_classifier, model_version
+from evaluation import quadratic_weighted_kappa
+from preprocessing import FundusPreprocessor
+
+# ===============================================================
+# CONFIG
+# ===============================================================
+DATA_DIR = "dataset/train"
+TEACHER_CACHE = os.path.join("dataset", ".teacher_logits.npy")
+SEED = 42
+
+normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                                 std=[0.229, 0.224, 0.225])
+train_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.RandomHorizontalFlip(),
+    transforms.ToTensor(),
+    normalize
+])
+eval_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    normalize
+])
+
+
+def image_loader(preprocessing=None):
+    """ImageFolder loader matching a checkpoint's ``preprocessing`` key."""
+    if preprocessing == "ben_graham":
+        return FundusPreprocessor(size=224).load
+    return datasets.folder.default_loader
+
+
+class IndexedDataset(Dataset):
+    """Wraps a dataset so each item also carries its index."""
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        x, y = self.dataset[index]
+        return x, y, index
+
+
+# ===============================================================
+# TEACHER SOFT TARGETS (computed once, cached to disk)
+# ===============================================================
+def cache_teacher_logits(teacher, data_dir=DATA_DIR, cache_path=TEACHER_CACHE,
+                         batch_size=32, device=None, teacher_version=None, preprocessing=None):
+    """Return (N, C) teacher log-probabilities for every ImageFolder sample.
+
+    The cache sits next to a JSON sidecar listing the sample paths, the
+    teacher's ``model_version`` and the preprocessing, so it is rebuilt
+    when the dataset, the teacher or its inputs change.
+    """
+    device = device or next(teacher.parameters()).device
+    dataset = datasets.ImageFolder(data_dir, transform=eval_transform,
+                                   loader=image_loader(preprocessing))
+    key = {"paths": [p for p, _ in dataset.samples], "teacher": teacher_version,
+           "preprocessing": preprocessing}
+    index_path = cache_path + ".json"
+
+    if os.path.exists(cache_path) and os.path.exists(index_path):
+        with open(index_path) as f:
+            if json.load(f) == key:
+                print(f"♻️ Using cached teacher targets: {cache_path}")
+                return np.load(cache_path)
+
+    logits = np.empty((len(dataset), 5), dtype=np.float32)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=2)
+    pos = 0
+    teacher.eval()
+    with torch.inference_mode():
+        for inputs, _ in tqdm(loader, desc="Teacher"):
+            out = F.log_softmax(teacher(inputs.to(device)), dim=1)
+            logits[pos:pos + len(out)] = out.cpu().numpy()
+            pos += len(out)
+
+    os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+    np.save(cache_path, logits)
+    with open(index_path, "w") as f:
+        json.dump(key, f)
+    return logits
+
+
+def distillation_loss(student_logits, teacher_logp, labels, temperature=4.0, alpha=0.7):
+    """alpha * T^2 * KL(teacher_T || student_T) + (1 - alpha) * CE(student, labels)."""
+    soft_targets = F.softmax(teacher_logp / temperature, dim=1)
+    soft_loss = F.kl_div(F.log_softmax(student_logits / temperature, dim=1),
+                         soft_targets, reduction="batchmean") * temperature ** 2
+    hard_loss = F.cross_entropy(student_logits, labels)
+    return alpha * soft_loss + (1 - alpha) * hard_loss
+
+
+# ===============================================================
+# EVALUATION + REPORT
+# ===============================================================
+def evaluate(model, loader, device):
+    model.eval()
+    preds, truth = [], []
+    with torch.inference_mode():
+        for batch in loader:
+            inputs, labels = batch[0], batch[1]
+            preds.append(model(inputs.to(device)).argmax(dim=1).cpu().numpy())
+            truth.append(np.asarray(labels))
+    preds, truth = np.concatenate(preds), np.concatenate(truth)
+    return float((preds == truth).mean()), quadratic_weighted_kappa(truth, preds)
+
+
+def cpu_latency_ms(model, batch_size=1, runs=20):
+    """Median CPU forward latency in ms for a 224x224 batch."""
+    model = model.to("cpu").eval()
+    x = torch.randn(batch_size, 3, 224, 224)
+    times = []
+    with torch.inference_mode():
+        model(x)  # warm-up
+        for _ in range(runs):
+            start = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def model_size(model):
+    params = sum(p.numel() for p in model.parameters())
+    with tempfile.NamedTemporaryFile(suffix=".pt", delete=False) as f:
+        tmp = f.name
+    try:
+        torch.save(model.state_dict(), tmp)
+        megabytes = os.path.getsize(tmp) / 2 ** 20
+    finally:
+        os.remove(tmp)
+    return params, megabytes
+
+
+def compare_models(teacher, student, valid_loader, device):
+    report = {}
+    for name, model in (("teacher", teacher), ("student", student)):
+        model.to(device)
+        acc, kappa = evaluate(model, valid_loader, device)
+        params, megabytes = model_size(model)
+        report[name] = {
+            "val_accuracy": acc,
+            "val_kappa": kappa,
+            "cpu_ms_per_image": cpu_latency_ms(model),
+            "params": params,
+            "size_mb": megabytes,
+        }
+        model.to(device)
+
+    t, s = report["teacher"], report["student"]
+    report["speedup"] = t["cpu_ms_per_image"] / s["cpu_ms_per_image"]
+    report["size_ratio"] = t["size_mb"] / s["size_mb"]
+    report["kappa_drop"] = t["val_kappa"] - s["val_kappa"]
+
+    print("\n📊 Distillation report")
+    print(f"{'':10}{'QWK':>8}{'Acc':>8}{'ms/img':>10}{'MB':>9}")
+    for name in ("teacher", "student"):
+        r = report[name]
+        print(f"{name:10}{r['val_kappa']:>8.4f}{r['val_accuracy']:>8.4f}"
+              f"{r['cpu_ms_per_image']:>10.1f}{r['size_mb']:>9.1f}")
+    print(f"⚡ {report['speedup']:.1f}x faster, {report['size_ratio']:.1f}x smaller, "
+          f"QWK drop {report['kappa_drop']:+.4f}")
+    return report
+
+
+# ===============================================================
+# TRAINING
+# ===============================================================
+def distill(teacher, student_arch="resnet18", data_dir=DATA_DIR, epochs=10, lr=1e-4,
+            batch_size=32, temperature=4.0, alpha=0.7, out_path="classifier_student.pt",
+            device=None, teacher_version=None, preprocessing=None):
+    device = device or torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher.to(device)
+    teacher_logp = torch.from_numpy(cache_teacher_logits(
+        teacher, data_dir, device=device, teacher_version=teacher_version,
+        preprocessing=preprocessing))
+
+    loader = image_loader(preprocessing)
+    full_dataset = datasets.ImageFolder(data_dir, transform=train_transform, loader=loader)
+    eval_dataset = datasets.ImageFolder(data_dir, transform=eval_transform, loader=loader)
+    train_size = int(0.8 * len(full_dataset))
+    generator = torch.Generator().manual_seed(SEED)
+    train_idx, val_idx = random_split(range(len(full_dataset)),
+                                      [train_size, len(full_dataset) - train_size],
+                                      generator=generator)
+
+    train_loader = DataLoader(torch.utils.data.Subset(IndexedDataset(full_dataset), list(train_idx)),
+                              batch_size=batch_size, shuffle=True, num_workers=2)
+    valid_loader = DataLoader(torch.utils.data.Subset(eval_dataset, list(val_idx)),
+                              batch_size=batch_size, shuffle=False, num_workers=2)
+
+    student = build_model(student_arch, pretrained=True).to(device)
+    optimizer = optim.Adam(student.parameters(), lr=lr)
+    scheduler = optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    best_kappa = -1.0
+    for epoch in range(epochs):
+        student.train()
+        running_loss = 0.0
+        for inputs, labels, index in tqdm(train_loader, desc=f"Epoch {epoch+1}/{epochs}"):
+            inputs, labels = inputs.to(device), labels.to(device)
+            optimizer.zero_grad()
+            loss = distillation_loss(student(inputs), teacher_logp[index].to(device),
+                                     labels, temperature, alpha)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+        scheduler.step()
+
+        val_acc, val_kappa = evaluate(student, valid_loader, device)
+        print(f"📘 Epoch {epoch+1} | Loss: {running_loss / len(train_loader):.4f}"
+              f" | Val Acc: {val_acc:.4f} | Val QWK: {val_kappa:.4f}")
+
+        if val_kappa > best_kappa:
+            best_kappa = val_kappa
+            torch.save({
+                "model_state_dict": student.state_dict(),
+                "num_classes": 5,
+                "architecture": student_arch,
+                "distilled_from": "resnet152",
+                "teacher_version": teacher_version,
+                "preprocessing": preprocessing,
+                "val_accuracy": val_acc,
+                "val_kappa": val_kappa,
+                "timestamp": datetime.utcnow().isoformat()
+            }, out_path)
+            print(f"💾 Best student saved! (Val QWK: {val_kappa:.4f})")
+
+    student, _ = load_classifier(out_path, device)
+    report = compare_models(teacher, student, valid_loader, device)
+    with open(os.path.splitext(out_path)[0] + "_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    return student, report
+
+
+# ===============================================================
+# MAIN
+# ===============================================================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distill the ResNet152 classifier into a small student")
+    parser.add_argument("--teacher", default="classifier.pt")
+    parser.add_argument("--student", default="resnet18", choices=["resnet18", "mobilenet_v3_small"])
+    parser.add_argument("--data", default=DATA_DIR)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--temperature", type=float, default=4.0)
+    parser.add_argument("--alpha", type=float, default=0.7)
+    parser.add_argument("--out", default="classifier_student.pt")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher, checkpoint = load_classifier(args.teacher, device, architecture="resnet152")
+    distill(teacher, args.student, args.data, args.epochs, args.lr,
+            temperature=args.temperature, alpha=args.alpha, out_path=args.out, device=device,
+            teacher_version=model_version(args.teacher),
+            preprocessing=checkpoint.get("preprocessing"))
@@ -0,0 +1,296 @@
+"""
+Frozen-backbone feature cache for fast head-only fine-tuning.
+
+``training.py`` freezes ``conv1``/``bn1``/``layer1`` of ResNet152 but
+still pushes every image through them on every epoch. This module runs
+the frozen stem once over the dataset, stores its activations as float16
+in a memory-mapped file, and then trains only the unfrozen layers
+(``layer2`` onwards by default) from that store.
+
+Without ``--checkpoint`` the stem starts from ImageNet weights, as in
+``training.py``. Inputs get the same preprocessing the model is trained
+with: the checkpoint's ``preprocessing`` key, or Ben Graham (the
+``train_model.py`` default) for a fresh ImageNet model. The store
+records which stem produced it (the checkpoint's ``model_version``, or
+``imagenet``), and ``train`` refuses a store built from a different stem.
+
+Usage:
+    python feature_cache.py build --data dataset/train --checkpoint classifier.pt
+    python feature_cache.py train --epochs 5 --lr 1e-5
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from torch import nn, optim
+from torch.utils.data import DataLoader, Dataset, Subset
+from torchvision import datasets, transforms
+
+from checkpoints import build_model, load_classifier, model_version
+from evaluation import quadratic_weighted_kappa
+from preprocessing import FundusPreprocessor
+
+STORE_DIR = os.path.join("dataset", ".feature_store")
+STEM_LAYERS = ["conv1", "bn1", "relu", "maxpool", "layer1", "layer2", "layer3", "layer4"]
+
+base_transform = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=(0.485, 0.456, 0.406),
+                         std=(0.229, 0.224, 0.225))
+])
+
+
+# ============================================================
+# Splitting the ResNet
+# ============================================================
+def split_resnet(model, split_at="layer1"):
+    """Return ``(stem, head)``: frozen layers up to ``split_at`` and the rest.
+
+    ``head(stem(x))`` equals ``model(x)``. The head shares parameters with
+    ``model``, so training it updates the original model in place.
+    """
+    cut = STEM_LAYERS.index(split_at) + 1
+    stem = nn.Sequential(*[getattr(model, n) for n in STEM_LAYERS[:cut]])
+    head = nn.Sequential(
+        *[getattr(model, n) for n in STEM_LAYERS[cut:]],
+        model.avgpool,
+        nn.Flatten(1),
+        model.fc
+    )
+    return stem, head
+
+
+# ============================================================
+# Building the Store
+# ============================================================
+def build_feature_store(model, dataset, out_dir=STORE_DIR, split_at="layer1",
+                        batch_size=32, hflip=True, device=None, preprocessing=None,
+                        stem_version=None):
+    """Run the frozen stem once and write float16 activations to a memmap.
+
+    With ``hflip`` a horizontally flipped view of every image is stored
+    too, so training from the store keeps the flip augmentation. The
+    build resumes after the last completed batch if interrupted.
+    ``preprocessing`` (how ``dataset`` loads images) is recorded in the
+    store and carried into the trained checkpoint; ``stem_version`` names
+    the weights that produced the activations.
+    """
+    device = device or next(model.parameters()).device
+    stem, _ = split_resnet(model, split_at)
+    stem.eval()  # frozen BatchNorm: running stats are part of the cached function
+    views = 2 if hflip else 1
+
+    with torch.inference_mode():
+        sample = stem(dataset[0][0].unsqueeze(0).to(device))
+    feat_shape = tuple(sample.shape[1:])
+    n = len(dataset)
+
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, "meta.json")
+    meta = {"n": n, "views": views, "shape": feat_shape, "split_at": split_at,
+            "preprocessing": preprocessing, "stem_version": stem_version, "dtype": "float16",
+            "completed": 0}
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            old = json.load(f)
+        same = ("n", "views", "split_at", "preprocessing", "stem_version")
+        if {k: old.get(k) for k in same} == {k: meta[k] for k in same}:
+            meta["completed"] = old["completed"]
+
+    mode = "r+" if meta["completed"] else "w+"
+    features = np.memmap(os.path.join(out_dir, "features.f16"), dtype=np.float16,
+                         mode=mode, shape=(views, n) + feat_shape)
+    labels = np.memmap(os.path.join(out_dir, "labels.i64"), dtype=np.int64,
+                       mode=mode, shape=(n,))
+
+    start = meta["completed"]
+    if start:
+        print(f"⏩ Resuming feature extraction at image {start}/{n}")
+    loader = DataLoader(Subset(dataset, range(start, n)), batch_size=batch_size,
+                        shuffle=False, num_workers=2)
+
+    pos = start
+    with torch.inference_mode():
+        for inputs, targets in loader:
+            inputs = inputs.to(device)
+            end = pos + len(inputs)
+            features[0, pos:end] = stem(inputs).half().cpu().numpy()
+            if hflip:
+                features[1, pos:end] = stem(torch.flip(inputs, dims=[-1])).half().cpu().numpy()
+            labels[pos:end] = np.asarray(targets)
+            pos = end
+
+            features.flush()
+            labels.flush()
+            meta["completed"] = pos
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+            print(f"💾 Cached {pos}/{n}", end="\r")
+
+    size_mb = features.nbytes / 2 ** 20
+    print(f"\n✅ Feature store ready: {n} x {views} views x {feat_shape} ({size_mb:.0f} MB)")
+    return out_dir
+
+
+# ============================================================
+# Reading the Store
+# ============================================================
+class FeatureStoreDataset(Dataset):
+    """Cached stem activations; picks a random stored view when ``augment``."""
+
+    def __init__(self, store_dir=STORE_DIR, augment=True):
+        super().__init__()
+        with open(os.path.join(store_dir, "meta.json")) as f:
+            self.meta = json.load(f)
+        if self.meta["completed"] < self.meta["n"]:
+            raise RuntimeError(f"Feature store {store_dir} is incomplete; re-run build")
+        self.store_dir = store_dir
+        self.augment = augment
+        self._features = None
+        self.labels = np.fromfile(os.path.join(store_dir, "labels.i64"), dtype=np.int64)
+
+    @property
+    def features(self):
+        # Opened lazily so DataLoader workers each map the file themselves
+        if self._features is None:
+            shape = (self.meta["views"], self.meta["n"]) + tuple(self.meta["shape"])
+            self._features = np.memmap(os.path.join(self.store_dir, "features.f16"),
+                                       dtype=np.float16, mode="r", shape=shape)
+        return self._features
+
+    def __len__(self):
+        return self.meta["n"]
+
+    def __getitem__(self, index):
+        view = np.random.randint(self.meta["views"]) if self.augment else 0
+        x = torch.from_numpy(np.array(self.features[view, index])).float()
+        return x, int(self.labels[index])
+
+
+# ============================================================
+# Head-only Training
+# ============================================================
+def train_from_store(model, store_dir=STORE_DIR, epochs=5, lr=1e-5, batch_size=64,
+                     valid_size=0.2, seed=42, device=None, save_path=None, stem_version=None):
+    """Train the layers after the split point from cached activations.
+
+    Uses the same NLLLoss / Adam / StepLR setup as ``training.py`` and
+    reports validation accuracy and QWK per epoch. Raises ``ValueError``
+    if the store was built by a stem other than ``stem_version``.
+    """
+    device = device or next(model.parameters()).device
+    train_set = FeatureStoreDataset(store_dir, augment=True)
+    built_by = train_set.meta.get("stem_version")
+    if stem_version is not None and built_by != stem_version:
+        # The saved checkpoint's stem must be the one that produced the features
+        raise ValueError(f"Feature store {store_dir} was built from stem {built_by or 'unknown'}, "
+                         f"not {stem_version}; train with that --checkpoint or rebuild the store")
+    valid_set = FeatureStoreDataset(store_dir, augment=False)
+    _, head = split_resnet(model, train_set.meta["split_at"])
+
+    rng = np.random.default_rng(seed)
+    indices = rng.permutation(len(train_set))
+    split = int(np.floor(valid_size * len(indices)))
+    trainloader = DataLoader(Subset(train_set, indices[split:]), batch_size=batch_size,
+                             shuffle=True, num_workers=2)
+    validloader = DataLoader(Subset(valid_set, indices[:split]), batch_size=batch_size,
+                             num_workers=2)
+
+    criterion = nn.NLLLoss()
+    optimizer = optim.Adam(head.parameters(), lr=lr)
+    scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=5, gamma=0.1)
+
+    history = []
+    for epoch in range(epochs):
+        head.train()
+        running_loss = 0.0
+        for feats, labels in trainloader:
+            feats, labels = feats.to(device), labels.to(device)
+            optimizer.zero_grad()
+            loss = criterion(torch.log_softmax(head(feats), dim=1), labels)
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item()
+        scheduler.step()
+
+        head.eval()
+        preds, truth = [], []
+        with torch.no_grad():
+            for feats, labels in validloader:
+                preds.append(head(feats.to(device)).argmax(dim=1).cpu().numpy())
+                truth.append(labels.numpy())
+        preds, truth = np.concatenate(preds), np.concatenate(truth)
+        stats = {
+            "epoch": epoch + 1,
+            "train_loss": running_loss / len(trainloader),
+            "val_accuracy": float((preds == truth).mean()),
+            "val_kappa": quadratic_weighted_kappa(truth, preds),
+        }
+        history.append(stats)
+        print(f"📘 Epoch {stats['epoch']}/{epochs} | Train Loss: {stats['train_loss']:.4f}"
+              f" | Val Acc: {stats['val_accuracy']:.4f} | Val QWK: {stats['val_kappa']:.4f}")
+
+    if save_path:
+        torch.save({
+            "model_state_dict": model.state_dict(),
+            "architecture": "resnet152",
+            "preprocessing": train_set.meta.get("preprocessing"),
+            "history": history
+        }, save_path)
+        print(f"💾 Model saved to {save_path}")
+    return history
+
+
+# ============================================================
+# Main
+# ============================================================
+def main():
+    parser = argparse.ArgumentParser(description="Frozen-backbone feature cache")
+    parser.add_argument("command", choices=["build", "train"])
+    parser.add_argument("--data", default=os.path.join("dataset", "train"),
+                        help="ImageFolder root (see prepare_data.py)")
+    parser.add_argument("--checkpoint", default=None, help="Start from this checkpoint")
+    parser.add_argument("--store", default=STORE_DIR)
+    parser.add_argument("--split-at", default="layer1", choices=STEM_LAYERS[4:7])
+    parser.add_argument("--no-hflip", action="store_true")
+    parser.add_argument("--preprocessing", default="auto", choices=["auto", "ben_graham", "none"],
+                        help="auto: the checkpoint's, or ben_graham without a checkpoint")
+    parser.add_argument("--epochs", type=int, default=5)
+    parser.add_argument("--lr", type=float, default=1e-5)
+    parser.add_argument("--save", default="classifier_head.pt")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.checkpoint:
+        model, checkpoint = load_classifier(args.checkpoint, device, architecture="resnet152")
+        preprocessing = checkpoint.get("preprocessing")
+        stem_version = model_version(args.checkpoint)
+    else:
+        # A random stem would make the cached features meaningless
+        model = build_model("resnet152", pretrained=True).to(device)
+        preprocessing = "ben_graham"
+        stem_version = "imagenet"
+    if args.preprocessing != "auto":
+        preprocessing = None if args.preprocessing == "none" else args.preprocessing
+
+    if args.command == "build":
+        ben_graham = preprocessing == "ben_graham"
+        loader = FundusPreprocessor().load if ben_graham else datasets.folder.default_loader
+        dataset = datasets.ImageFolder(args.data, transform=base_transform, loader=loader)
+        print(f"🧪 Preprocessing: {preprocessing or 'none'}")
+        build_feature_store(model, dataset, args.store, args.split_at,
+                            hflip=not args.no_hflip, device=device,
+                            preprocessing=preprocessing, stem_version=stem_version)
+    else:
+        try:
+            train_from_store(model, args.store, epochs=args.epochs, lr=args.lr,
+                             device=device, save_path=args.save, stem_version=stem_version)
+        except ValueError as e:
+            parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
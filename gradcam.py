@@ -0,0 +1,164 @@
+"""
+Batched Grad-CAM explanation maps with an on-disk cache.
+
+Hooks the last convolutional block of the ResNet (``layer4``), computes
+heatmaps for a whole batch with a single backward pass, blends them over
+the input images with vectorized NumPy, and caches the rendered overlays
+by image content hash and class. ``GradCAMService`` runs all of this on a
+background thread so the UI can show the grade first and the overlay when
+it is ready.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+CACHE_DIR = "gradcam_cache"
+
+# Jet colormap as a (256, 3) RGB lookup table, applied by fancy indexing
+_JET = cv2.applyColorMap(np.arange(256, dtype=np.uint8)[:, None], cv2.COLORMAP_JET)
+JET_LUT = cv2.cvtColor(_JET, cv2.COLOR_BGR2RGB)[:, 0, :]
+
+
+# ============================================================
+# Grad-CAM
+# ============================================================
+class GradCAM:
+    """Grad-CAM over ``target_layer`` (default: ``model.layer4``)."""
+
+    def __init__(self, model, target_layer=None, lock=None):
+        self.model = model
+        self.target_layer = target_layer if target_layer is not None else model.layer4
+        # Shared with the inference path so hooks never see another thread's forward
+        self.lock = lock or threading.Lock()
+
+    def compute(self, batch, class_idx=None):
+        """Return ``(cams, class_idx)``: (B, H, W) maps in [0, 1] and the explained classes.
+
+        ``class_idx`` defaults to each image's predicted class. All images
+        share one forward and one backward pass.
+        """
+        store = {}
+
+        def save_activation(module, inputs, output):
+            store["acts"] = output
+            output.register_hook(lambda grad: store.__setitem__("grads", grad))
+
+        with self.lock:
+            handle = self.target_layer.register_forward_hook(save_activation)
+            was_training = self.model.training
+            self.model.eval()
+            try:
+                device = next(self.model.parameters()).device
+                batch = batch.to(device)
+                with torch.enable_grad():
+                    out = self.model(batch)
+                    if class_idx is None:
+                        class_idx = out.argmax(dim=1)
+                    class_idx = torch.as_tensor(class_idx, device=out.device).view(-1)
+                    # Per-image scores are independent, so their sum gives every
+                    # image's gradient in one backward pass
+                    out.gather(1, class_idx[:, None]).sum().backward()
+            finally:
+                handle.remove()
+                self.model.zero_grad(set_to_none=True)
+                self.model.train(was_training)
+
+        acts, grads = store["acts"].detach(), store["grads"]
+        weights = grads.mean(dim=(2, 3), keepdim=True)
+        cams = F.relu((weights * acts).sum(dim=1, keepdim=True))
+        cams = F.interpolate(cams, size=batch.shape[-2:], mode="bilinear", align_corners=False)
+        cams = cams[:, 0]
+        lo = cams.amin(dim=(1, 2), keepdim=True)
+        hi = cams.amax(dim=(1, 2), keepdim=True)
+        cams = (cams - lo) / (hi - lo).clamp_min(1e-8)
+        return cams.cpu().numpy(), class_idx.cpu().numpy()
+
+
+def overlay(images, cams, alpha=0.4):
+    """Blend (B, H, W) heatmaps over (B, H, W, 3) uint8 images in one NumPy pass."""
+    heat = JET_LUT[np.clip(cams * 255, 0, 255).astype(np.uint8)]
+    blended = (1 - alpha) * images.astype(np.float32) + alpha * heat.astype(np.float32)
+    return blended.astype(np.uint8)
+
+
+# ============================================================
+# Cache
+# ============================================================
+def cache_path(image_path, class_idx, cache_dir=CACHE_DIR):
+    h = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    key = h.hexdigest()
+    return os.path.join(cache_dir, key[:2], f"{key}_c{int(class_idx)}.png")
+
+
+def explain_paths(cam, paths, transform, class_idx=None, size=224, cache_dir=CACHE_DIR,
+                  loader=None):
+    """Overlay PNG paths for a batch of image files, computing only cache misses.
+
+    ``class_idx`` (one per path) fixes the explained class so the cache can
+    be checked before running the model; without it the predicted class is
+    explained and the cache is written but not consulted. ``loader`` (e.g.
+    ``FundusPreprocessor.load``) must match what the model was trained on.
+    """
+    from PIL import Image
+
+    paths = list(paths)
+    out = [None] * len(paths)
+    todo = list(range(len(paths)))
+    if class_idx is not None:
+        class_idx = list(class_idx)
+        todo = []
+        for i, p in enumerate(paths):
+            cached = cache_path(p, class_idx[i], cache_dir)
+            if os.path.exists(cached):
+                out[i] = cached
+            else:
+                todo.append(i)
+    if not todo:
+        return out
+
+    loader = loader or (lambda path: Image.open(path).convert("RGB"))
+    pil = [loader(paths[i]) for i in todo]
+    batch = torch.stack([transform(im) for im in pil])
+    cams, classes = cam.compute(batch, None if class_idx is None else [class_idx[i] for i in todo])
+
+    images = np.stack([np.asarray(im.resize(cams.shape[1:][::-1])) for im in pil])
+    rendered = overlay(images, cams)
+    for j, i in enumerate(todo):
+        target = cache_path(paths[i], classes[j], cache_dir)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = target + ".tmp.png"
+        Image.fromarray(rendered[j]).save(tmp)
+        os.replace(tmp, target)
+        out[i] = target
+    return out
+
+
+# ============================================================
+# Asynchronous Service
+# ============================================================
+class GradCAMService:
+    """Single background worker producing overlays; returns futures."""
+
+    def __init__(self, cam, transform, cache_dir=CACHE_DIR, loader=None):
+        self.cam = cam
+        self.transform = transform
+        self.cache_dir = cache_dir
+        self.loader = loader
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gradcam")
+
+    def submit(self, paths, class_idx=None):
+        """Future resolving to the list of overlay paths for ``paths``."""
+        return self._pool.submit(explain_paths, self.cam, paths, self.transform,
+                                 class_idx, cache_dir=self.cache_dir, loader=self.loader)
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
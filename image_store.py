@@ -0,0 +1,150 @@
+"""
+Content-addressed fundus image store.
+
+Uploads are copied into a sharded directory named by the SHA-256 of their
+bytes (``image_store/ab/cd/<hash>.orig``), so the same photo picked twice,
+or from two places, is stored once. At ingest the original is decoded a
+single time to write the derivatives every other view needs:
+
+    thumb   256 px (longest side) JPEG for history and preview widgets
+    model   224 x 224 PNG, the exact ``Resize((224, 224))`` model input
+
+Everything downstream refers to images by hash and asks the store for the
+rendition it needs, so history views and re-scoring never decode the
+full-resolution original again.
+
+Usage:
+    python image_store.py ingest sampleimages/*.jpg
+    python image_store.py migrate-reports retinal_clinical.db
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+
+from PIL import Image
+
+STORE_DIR = "image_store"
+THUMB_SIZE = 256
+MODEL_SIZE = 224
+
+# kind -> file suffix
+KINDS = {
+    "original": ".orig",
+    "thumb": ".thumb.jpg",
+    "model": ".224.png",
+}
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# ============================================================
+# Store
+# ============================================================
+class ImageStore:
+    """Hash-addressed originals plus cached thumbnail and model-input derivatives."""
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def path(self, digest, kind="original"):
+        """Filesystem path of a rendition (it may not exist yet)."""
+        return os.path.join(self.root, digest[:2], digest[2:4], digest + KINDS[kind])
+
+    def __contains__(self, digest):
+        return os.path.exists(self.path(digest))
+
+    def open(self, digest, kind="thumb"):
+        """PIL image of a stored rendition, rebuilding derivatives if missing."""
+        if kind != "original" and not os.path.exists(self.path(digest, kind)):
+            self._derive(digest)
+        return Image.open(self.path(digest, kind))
+
+    def ingest(self, src):
+        """Store ``src`` and its derivatives; return its hash. Duplicates are free."""
+        digest = file_hash(src)
+        target = self.path(digest)
+        with self._lock:
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp = f"{target}.tmp{os.getpid()}"
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, target)
+        if not all(os.path.exists(self.path(digest, k)) for k in KINDS):
+            self._derive(digest)
+        return digest
+
+    def _derive(self, digest):
+        """Decode the original once and write every missing derivative."""
+        with Image.open(self.path(digest)) as im:
+            rgb = im.convert("RGB")
+        thumb = rgb.copy()
+        thumb.thumbnail((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR)
+        self._save(thumb, self.path(digest, "thumb"), quality=85)
+        # Same resampling as transforms.Resize, so this is the model's exact input
+        self._save(rgb.resize((MODEL_SIZE, MODEL_SIZE), Image.BILINEAR),
+                   self.path(digest, "model"))
+
+    @staticmethod
+    def _save(image, target, **kwargs):
+        if os.path.exists(target):
+            return
+        fmt = "JPEG" if target.endswith(".jpg") else "PNG"
+        tmp = f"{target}.tmp{os.getpid()}.{threading.get_ident()}"
+        image.save(tmp, fmt, **kwargs)
+        os.replace(tmp, target)
+
+
+# ============================================================
+# Migration of raw-path reports
+# ============================================================
+def migrate_reports(db_path, store):
+    """Ingest files referenced by ``reports.image_path`` and record their hash.
+
+    Adds a ``reports.image_hash`` column; rows whose file no longer exists
+    are left with a NULL hash.
+    """
+    conn = sqlite3.connect(db_path)
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(reports)")]
+    if "image_hash" not in cols:
+        conn.execute("ALTER TABLE reports ADD COLUMN image_hash TEXT")
+    rows = conn.execute(
+        "SELECT id, image_path FROM reports WHERE image_hash IS NULL AND image_path IS NOT NULL"
+    ).fetchall()
+    done = 0
+    for report_id, image_path in rows:
+        if os.path.exists(image_path):
+            conn.execute("UPDATE reports SET image_hash = ? WHERE id = ?",
+                         (store.ingest(image_path), report_id))
+            done += 1
+    conn.commit()
+    conn.close()
+    print(f"🗂️ Migrated {done}/{len(rows)} report images into {store.root}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Content-addressed fundus image store")
+    parser.add_argument("--root", default=STORE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_ingest = sub.add_parser("ingest", help="Ingest image files")
+    p_ingest.add_argument("files", nargs="+")
+    p_migrate = sub.add_parser("migrate-reports", help="Hash images referenced by reports")
+    p_migrate.add_argument("db", nargs="?", default="retinal_clinical.db")
+    args = parser.parse_args()
+
+    image_store = ImageStore(args.root)
+    if args.command == "ingest":
+        for f in args.files:
+            print(f"{image_store.ingest(f)}  {f}")
+    else:
+        migrate_reports(args.db, image_store)
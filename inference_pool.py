@@ -0,0 +1,133 @@
+"""
+Multi-process inference pool with shared-memory model weights.
+
+The checkpoint is loaded once in the parent and its tensors are moved to
+shared memory (``share_memory()``). Workers are forked after the load
+where the platform allows it (spawned elsewhere, receiving the shared
+storages by handle), so N workers cost one copy of the weights instead
+of N. Each worker pins its intra-op thread count so the workers together
+do not oversubscribe the cores. Workers decode, transform and score whole
+batches of image paths.
+
+Usage:
+    python inference_pool.py --images sampleimages --workers 1 2 4 8 16
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from PIL import Image
+from torchvision import transforms
+
+from checkpoints import load_classifier
+from preprocessing import FundusPreprocessor
+
+test_transforms = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=(0.485, 0.456, 0.406),
+                         std=(0.229, 0.224, 0.225))
+])
+
+# ============================================================
+# Worker Side
+# ============================================================
+_worker = {}
+
+
+def _init_worker(model, threads, ben_graham):
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed by an inherited (forked) runtime
+    model.eval()
+    _worker["model"] = model
+    _worker["load"] = FundusPreprocessor().load if ben_graham else \
+        (lambda p: Image.open(p).convert("RGB"))
+
+
+def _predict_batch(paths):
+    batch = torch.stack([test_transforms(_worker["load"](p)) for p in paths])
+    with torch.inference_mode():
+        return torch.softmax(_worker["model"](batch), dim=1).numpy()
+
+
+# ============================================================
+# Pool
+# ============================================================
+class InferencePool:
+    """Process pool sharing one set of model weights across workers."""
+
+    def __init__(self, checkpoint_path="classifier.pt", workers=None, threads_per_worker=None,
+                 architecture=None):
+        self.workers = workers or os.cpu_count()
+        self.threads = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+
+        model, checkpoint = load_classifier(checkpoint_path, "cpu", architecture)
+        model.share_memory()
+        ben_graham = checkpoint.get("preprocessing") == "ben_graham"
+
+        method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+        self._pool = mp.get_context(method).Pool(
+            self.workers,
+            initializer=_init_worker,
+            initargs=(model, self.threads, ben_graham)
+        )
+        # The parent keeps only the shared copy for its own (rare) use
+        self.model = model
+
+    def predict_paths(self, paths, batch_size=8):
+        """Return an (N, C) probability matrix for ``paths``, in input order."""
+        paths = list(paths)
+        chunks = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        if not chunks:
+            return np.empty((0, 5), dtype=np.float32)
+        return np.concatenate(list(self._pool.imap(_predict_batch, chunks)))
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ============================================================
+# Scaling Benchmark
+# ============================================================
+def benchmark(checkpoint_path, paths, worker_counts, batch_size=8, repeat=4):
+    """Images/second for each worker count, to check near-linear scaling."""
+    paths = list(paths) * repeat
+    results = {}
+    for n in worker_counts:
+        with InferencePool(checkpoint_path, workers=n) as pool:
+            pool.predict_paths(paths[:n * batch_size], batch_size)  # warm-up
+            start = time.perf_counter()
+            pool.predict_paths(paths, batch_size)
+            results[n] = len(paths) / (time.perf_counter() - start)
+        base = results[worker_counts[0]] / worker_counts[0]
+        print(f"⚙️ {n:>2} workers: {results[n]:7.1f} img/s "
+              f"(scaling efficiency {results[n] / (base * n):.0%})")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared-weight multi-process inference")
+    parser.add_argument("--checkpoint", default="classifier.pt")
+    parser.add_argument("--images", default="sampleimages")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count()])
+    parser.add_argument("--batch-size", type=int, default=8)
+    args = parser.parse_args()
+
+    image_paths = sorted(
+        os.path.join(args.images, f) for f in os.listdir(args.images)
+        if f.lower().endswith((".png", ".jpg", ".jpeg"))
+    )
+    benchmark(args.checkpoint, image_paths, args.workers, args.batch_size)
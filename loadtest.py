@@ -0,0 +1,308 @@
+"""
+Load test: N simulated screening stations against inference + SQLite.
+
+Each station is a thread with its own SQLite connection that replays
+``sampleimages/`` the way the app handles an upload: quality gate,
+``scan_queue.enqueue`` (leased to itself), model prediction, and the
+scan insert + job completion transaction. Arrivals are open-loop Poisson
+at ``--rate`` scans/second in total, so when the system cannot keep up
+the backlog (and latency) grows instead of the load politely slowing
+down.
+
+Every scan records its queueing delay, inference time, write time and
+the time spent waiting for the database write lock (``BEGIN
+IMMEDIATE``); errors are counted by type. ``sweep`` repeats the run at
+increasing rates and reports the saturation point: the first rate whose
+completion rate falls below 90% of the arrival rate, whose p95 latency
+exceeds the SLO, or whose error rate exceeds 1%.
+
+Engines: ``real`` (create_dummy_classifier), ``mock`` (model.py, 1.5 s
+sleep) or ``fixed`` (``--infer-ms`` delay, isolates the write path).
+Runs against a fresh database in a temp dir. ``--db`` with an existing
+database also needs ``--allow-existing``, since the run adds "LT-station"
+scans to it. Stations never queue referral alerts.
+
+Usage:
+    python loadtest.py run --stations 10 --rate 2 --duration 60 --engine fixed
+    python loadtest.py sweep --stations 10 --rates 1 2 4 8 16 32 --engine fixed
+"""
+import argparse
+import glob
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+import numpy as np
+
+import quality_gate
+import scan_queue
+
+CLASSES = ["No DR", "Mild", "Moderate", "Severe", "Proliferative DR"]
+SATURATION_THROUGHPUT = 0.9     # completion rate / arrival rate below this = saturated
+SATURATION_ERRORS = 0.01
+LATENCY_SLO = 10.0              # seconds, p95 end-to-end
+
+
+# ============================================================
+# Engines
+# ============================================================
+class FixedEngine:
+    """Sleeps ``infer_ms`` and returns a random grade; no model cost."""
+    MODEL_VERSION = "loadtest"
+
+    def __init__(self, infer_ms=300):
+        self.delay = infer_ms / 1000
+
+    def predict(self, path, quality=None):
+        time.sleep(self.delay)
+        value = random.choices(range(5), weights=[0.5, 0.2, 0.15, 0.1, 0.05])[0]
+        probs = np.full(5, 0.05, dtype=np.float32)
+        probs[value] = 0.8
+        return {"value": value, "stage": CLASSES[value], "probs": probs, "confidence": 0.8,
+                "quality": quality, "model_version": self.MODEL_VERSION}
+
+
+def load_engine(name, infer_ms):
+    if name == "fixed":
+        return FixedEngine(infer_ms)
+    if name == "mock":
+        import model as engine
+    else:
+        import create_dummy_classifier as engine
+    return engine
+
+
+# ============================================================
+# Stations
+# ============================================================
+def timed_write(conn, write):
+    """Run ``write()`` in a BEGIN IMMEDIATE transaction; returns (result, lock wait s)."""
+    start = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    waited = time.perf_counter() - start
+    try:
+        result = write()
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if conn.in_transaction:
+        conn.execute("COMMIT")
+    return result, waited
+
+
+class Station(threading.Thread):
+    """One workstation: processes its Poisson arrivals before ``end`` in order."""
+
+    def __init__(self, index, db_path, engine, images, rate, start, end, busy_timeout, seed):
+        super().__init__(daemon=True)
+        self.name = f"station-{index:02d}"
+        self.db_path = db_path
+        self.engine = engine
+        self.images = images
+        self.rate = rate
+        self.start_at = start
+        self.end = end
+        self.busy_timeout = busy_timeout
+        self.rng = random.Random(seed)
+        self.records = []
+        self.backlog = 0
+
+    def run(self):
+        conn = scan_queue.connect(self.db_path, timeout=self.busy_timeout)
+        owner = f"loadtest:{self.name}"
+        arrival = self.start_at + self.rng.expovariate(self.rate)
+        try:
+            while arrival < self.end:
+                delay = arrival - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                # Arrivals inside the window may finish late, up to the latency SLO
+                if time.time() >= self.end + LATENCY_SLO:
+                    break
+                self.records.append(self.scan(conn, owner, arrival))
+                arrival += self.rng.expovariate(self.rate)
+            # Arrivals never started before the drain deadline
+            while arrival < self.end:
+                self.backlog += 1
+                arrival += self.rng.expovariate(self.rate)
+        finally:
+            conn.close()
+
+    def scan(self, conn, owner, arrival):
+        record = {"arrival": arrival, "queued": time.time() - arrival, "lock_wait": 0.0,
+                  "error": None, "rejected": False}
+        path = self.rng.choice(self.images)
+        try:
+            t = time.perf_counter()
+            quality = quality_gate.assess(path)
+            record["quality"] = time.perf_counter() - t
+            if quality["status"] == "reject":
+                # The app asks for a retake; nothing is queued or written
+                record["rejected"] = True
+                record["done"] = time.time()
+                return record
+
+            t = time.perf_counter()
+            job_id, waited = timed_write(conn, lambda: scan_queue.enqueue(
+                conn, f"LT-{self.name}", path, eye="Right", quality=quality,
+                claim_as=owner, visit_id=uuid.uuid4().hex))
+            record["lock_wait"] += waited
+            job = scan_queue.get_job(conn, job_id)
+            record["enqueue"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            result = self.engine.predict(path, quality=quality)
+            record["inference"] = time.perf_counter() - t
+
+            t = time.perf_counter()
+            # No referral SMS for synthetic scans, whatever RETINAL_NOTIFY_RECIPIENTS says
+            _, waited = timed_write(conn, lambda: scan_queue.insert_scan(conn, job, result, owner,
+                                                                         notify_to=[]))
+            record["lock_wait"] += waited
+            record["write"] = time.perf_counter() - t + record["enqueue"]
+        except Exception as e:
+            record["error"] = f"{type(e).__name__}: {str(e)[:60]}"
+        record["done"] = time.time()
+        return record
+
+
+# ============================================================
+# Runs + Reporting
+# ============================================================
+def fresh_db():
+    return os.path.join(tempfile.mkdtemp(prefix="retinal_loadtest_"), "retinal_ai.db")
+
+
+def run(stations=10, rate=1.0, duration=30.0, engine="fixed", infer_ms=300,
+        images="sampleimages", db_path=None, busy_timeout=5.0, seed=0, allow_existing=False):
+    """One load level; returns the summary dict.
+
+    Raises ``ValueError`` for an existing ``db_path`` unless ``allow_existing``.
+    """
+    if db_path and os.path.exists(db_path) and not allow_existing:
+        raise ValueError(f"{db_path} already exists; the load test would write synthetic scans "
+                         f"into it (pass --allow-existing to a copy, never a live database)")
+    db_path = db_path or fresh_db()
+    scan_queue.connect(db_path).close()  # create/migrate scans + scan_jobs once, up front
+    paths = sorted(glob.glob(os.path.join(images, "*")))
+    model = load_engine(engine, infer_ms)
+
+    start = time.time() + 0.5
+    end = start + duration
+    workers = [Station(i, db_path, model, paths, rate / stations, start, end, busy_timeout,
+                       seed * 1000 + i) for i in range(stations)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    records = [r for w in workers for r in w.records]
+    elapsed = max([duration] + [r["done"] - start for r in records])
+    return summarize(records, sum(w.backlog for w in workers), rate, duration, elapsed, stations)
+
+
+def summarize(records, backlog, rate, duration, elapsed, stations):
+    ok = [r for r in records if r["error"] is None and not r["rejected"]]
+    rejected = sum(r["rejected"] for r in records)
+    offered = len(records) + backlog
+
+    def pct(key):
+        values = [r[key] for r in ok] if key != "latency" else \
+            [r["done"] - r["arrival"] for r in ok]
+        return np.percentile(values, [50, 95, 99]) if values else np.full(3, np.nan)
+
+    summary = {
+        "stations": stations,
+        "offered_rate": rate,
+        "throughput": (len(ok) + rejected) / elapsed,
+        "offered": offered,
+        "completed": len(ok),
+        "backlog": backlog,
+        "rejected": rejected,
+        "error_rate": (len(records) - len(ok) - rejected) / max(offered, 1),
+        "errors": Counter(r["error"] for r in records if r["error"]),
+        "latency": pct("latency"),
+        "queued": pct("queued"),
+        "inference": pct("inference"),
+        "write": pct("write"),
+        "lock_wait": pct("lock_wait"),
+        "lock_wait_total": sum(r["lock_wait"] for r in records),
+    }
+    p95 = summary["latency"][1]
+    summary["saturated"] = bool(
+        summary["throughput"] < SATURATION_THROUGHPUT * offered / duration
+        or summary["error_rate"] > SATURATION_ERRORS
+        or not p95 <= LATENCY_SLO
+    )
+    return summary
+
+
+def print_summary(s):
+    def ms(p):
+        return " / ".join(f"{1000 * v:.0f}" for v in p)
+
+    print(f"📈 {s['stations']} stations @ {s['offered_rate']:.2f} scans/s offered: "
+          f"{s['throughput']:.2f} scans/s done ({s['completed']}/{s['offered']} scored, "
+          f"{s['rejected']} rejected, backlog {s['backlog']}){' ⚠️ SATURATED' if s['saturated'] else ''}")
+    print(f"   latency p50/p95/p99 ms : {ms(s['latency'])}")
+    print(f"   queued at station      : {ms(s['queued'])}")
+    print(f"   inference              : {ms(s['inference'])}")
+    print(f"   db writes              : {ms(s['write'])}")
+    print(f"   lock wait              : {ms(s['lock_wait'])} "
+          f"(total {s['lock_wait_total']:.2f}s)")
+    print(f"   error rate             : {s['error_rate']:.2%}")
+    for error, n in s["errors"].most_common(5):
+        print(f"      {n} × {error}")
+
+
+def sweep(rates, **kwargs):
+    """Run each rate in turn; returns (summaries, first saturated rate or None)."""
+    summaries = []
+    for rate in rates:
+        s = run(rate=rate, **kwargs)
+        print_summary(s)
+        summaries.append(s)
+        # Later levels may reuse the --db the first level created
+        kwargs["allow_existing"] = True
+        if s["saturated"]:
+            break
+    sustainable = [s["offered_rate"] for s in summaries if not s["saturated"]]
+    saturation = summaries[-1]["offered_rate"] if summaries[-1]["saturated"] else None
+    print(f"🎯 Highest sustained rate: {max(sustainable) if sustainable else 'none'} scans/s"
+          f" | saturates at: {saturation if saturation is not None else 'not reached'}")
+    return summaries, saturation
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent screening-station load test")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("run", "sweep"):
+        p = sub.add_parser(name)
+        p.add_argument("--stations", type=int, default=10)
+        p.add_argument("--duration", type=float, default=30.0, help="seconds per load level")
+        p.add_argument("--engine", choices=("real", "mock", "fixed"), default="fixed")
+        p.add_argument("--infer-ms", type=float, default=300, help="fixed engine delay")
+        p.add_argument("--images", default="sampleimages")
+        p.add_argument("--db", default=None, help="database to load (default: fresh temp db)")
+        p.add_argument("--allow-existing", action="store_true",
+                       help="let --db point at an existing database (use a copy)")
+        p.add_argument("--busy-timeout", type=float, default=5.0)
+        if name == "run":
+            p.add_argument("--rate", type=float, default=1.0, help="total scans/second")
+        else:
+            p.add_argument("--rates", type=float, nargs="+", default=[0.5, 1, 2, 4, 8, 16, 32])
+    args = parser.parse_args()
+
+    options = dict(stations=args.stations, duration=args.duration, engine=args.engine,
+                   infer_ms=args.infer_ms, images=args.images, db_path=args.db,
+                   busy_timeout=args.busy_timeout, allow_existing=args.allow_existing)
+    try:
+        if args.command == "run":
+            print_summary(run(rate=args.rate, **options))
+        else:
+            sweep(args.rates, **options)
+    except ValueError as e:
+        parser.error(str(e))
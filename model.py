@@ -1,6 +1,10 @@
 import time
 import random
 
+import numpy as np
+
+from patient_grading import aggregate
+
 # Define the classes as expected by the main app
 classes = [
     "No DR",
@@ -10,6 +14,9 @@ classes = [
     "Proliferative DR"
 ]
 
+# Scans graded by the mock are tagged so re-scoring replaces them
+MODEL_VERSION = "mock"
+
 def main(image_path):
     """
     Mock inference function for Diabetic Retinopathy detection.
@@ -35,4 +42,38 @@ def main(image_path):
     severity_value = random.choices(range(5), weights=weights)[0]
     predicted_class = classes[severity_value]
     
-    return severity_value, predicted_class
\ No newline at end of file
+    return severity_value, predicted_class
+
+
+def predict(image_path, quality=None):
+    """
+    Mock counterpart of ``create_dummy_classifier.predict``.
+
+    Returns a dict with the severity value, class name and a probability
+    vector peaked on the sampled class, so the app can run without a model.
+    """
+    value, predicted_class = main(image_path)
+    probs = np.random.dirichlet(np.ones(len(classes)))
+    probs = 0.3 * probs + 0.7 * np.eye(len(classes))[value]
+    return {
+        "value": value,
+        "stage": predicted_class,
+        "probs": probs.astype(np.float32),
+        "confidence": float(probs[value]),
+        "quality": quality,
+        "model_version": MODEL_VERSION,
+    }
+
+
+def predict_batch(image_paths, qualities=None):
+    """Mock counterpart of ``create_dummy_classifier.predict_batch``."""
+    qualities = qualities or [None] * len(image_paths)
+    return [predict(p, quality=q) for p, q in zip(image_paths, qualities)]
+
+
+def predict_patient(eye_paths, qualities=None):
+    """Mock counterpart of ``create_dummy_classifier.predict_patient``."""
+    eyes = list(eye_paths)
+    qualities = qualities or {}
+    results = predict_batch([eye_paths[e] for e in eyes], [qualities.get(e) for e in eyes])
+    return aggregate(dict(zip(eyes, results)), classes)
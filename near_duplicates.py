@@ -0,0 +1,233 @@
+"""
+Near-duplicate and leakage detection for the training set.
+
+APTOS/EyePACS contain the same fundus photographed (or re-exported)
+more than once. A plain ``random_split`` can put copies on both sides of
+the train/val boundary and inflate validation scores. This tool:
+
+1. computes a 64-bit DCT perceptual hash (pHash) per image in parallel,
+   decoding JPEGs at 1/8 scale since the hash only needs a 32 x 32 image;
+2. finds all pairs within ``--radius`` bits with multi-index hashing: the
+   hash is split into four 16-bit chunks, and by the pigeonhole principle
+   any pair within r bits agrees to within r // 4 bits on some chunk, so
+   only those buckets are probed (sub-linear instead of all-pairs);
+3. unions the pairs into duplicate clusters and writes a report, and
+4. writes a group-aware, label-stratified split (``split.json``) that
+   keeps every cluster on one side. ``train_model.py`` uses it when present.
+
+Usage:
+    python near_duplicates.py --data dataset/train --radius 6
+"""
+import argparse
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+SPLIT_PATH = "dataset/split.json"
+CHUNK_BITS = 16
+N_CHUNKS = 64 // CHUNK_BITS
+
+
+# ============================================================
+# Perceptual Hash
+# ============================================================
+def phash(path):
+    """64-bit DCT hash of a 32 x 32 grayscale thumbnail (0 if unreadable)."""
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None or min(img.shape) < 32:
+        img = cv2.imread(path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return 0
+    small = cv2.resize(img, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    bits = low > np.median(low[1:])  # DC term excluded from the median
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _hash_chunk(paths):
+    return [phash(p) for p in paths]
+
+
+def hash_paths(paths, workers=None, chunk=256):
+    """pHash every path using a process pool; returns a uint64 array in input order."""
+    chunks = [paths[i:i + chunk] for i in range(0, len(paths), chunk)]
+    with ProcessPoolExecutor(workers) as pool:
+        hashes = list(itertools.chain.from_iterable(pool.map(_hash_chunk, chunks)))
+    return np.array(hashes, dtype=np.uint64)
+
+
+def popcount(x):
+    x = np.asarray(x, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    return np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+
+# ============================================================
+# Multi-Index Hashing
+# ============================================================
+def _flip_masks(bits, radius):
+    """All ``bits``-wide XOR masks with at most ``radius`` bits set."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        masks += [sum(1 << b for b in combo) for combo in itertools.combinations(range(bits), r)]
+    return np.array(masks, dtype=np.int64)
+
+
+def near_pairs(hashes, radius):
+    """All index pairs ``(i, j)``, ``i < j``, with Hamming distance <= ``radius``.
+
+    ``hashes`` should be unique (collapse exact duplicates first) so no
+    bucket degenerates into a quadratic blow-up.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    n = len(hashes)
+    masks = _flip_masks(CHUNK_BITS, radius // N_CHUNKS)
+    found = []
+    for c in range(N_CHUNKS):
+        keys = ((hashes >> np.uint64(c * CHUNK_BITS)) & np.uint64(0xFFFF)).astype(np.int64)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        for mask in masks:
+            q = keys ^ mask
+            lo = np.searchsorted(sorted_keys, q, "left")
+            hi = np.searchsorted(sorted_keys, q, "right")
+            counts = hi - lo
+            if not counts.any():
+                continue
+            # Expand every query's bucket range into candidate pairs
+            left = np.repeat(np.arange(n), counts)
+            starts = np.repeat(lo - np.cumsum(counts) + counts, counts)
+            right = order[starts + np.arange(counts.sum())]
+            keep = left < right
+            left, right = left[keep], right[keep]
+            close = popcount(hashes[left] ^ hashes[right]) <= radius
+            found.append(left[close] * n + right[close])
+    if not found:
+        return np.empty((0, 2), dtype=np.int64)
+    codes = np.unique(np.concatenate(found))
+    return np.stack([codes // n, codes % n], axis=1)
+
+
+# ============================================================
+# Clusters
+# ============================================================
+def connected_groups(n, pairs):
+    """Component label per node (union-find with path halving)."""
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.array([find(i) for i in range(n)])
+
+
+def find_clusters(hashes, radius):
+    """Group id per image: exact duplicates first, then near pairs over unique hashes."""
+    unique, inverse = np.unique(hashes, return_inverse=True)
+    pairs = near_pairs(unique, radius)
+    return connected_groups(len(unique), pairs)[inverse.ravel()]
+
+
+def group_split(groups, labels, val_fraction=0.2, seed=42):
+    """Boolean val mask with whole groups per side, stratified by each group's majority label."""
+    rng = np.random.default_rng(seed)
+    val = np.zeros(len(groups), dtype=bool)
+    members = {}
+    for i, g in enumerate(groups):
+        members.setdefault(g, []).append(i)
+    by_label = {}
+    for g, idx in members.items():
+        majority = np.bincount(labels[idx]).argmax()
+        by_label.setdefault(majority, []).append(idx)
+    for label_groups in by_label.values():
+        target = val_fraction * sum(len(idx) for idx in label_groups)
+        taken = 0
+        for k in rng.permutation(len(label_groups)):
+            if taken >= target:
+                break
+            val[label_groups[k]] = True
+            taken += len(label_groups[k])
+    return val
+
+
+# ============================================================
+# Dataset Scan + Report
+# ============================================================
+def list_dataset(data_dir):
+    """ImageFolder-style ``(relative_path, class_index)`` listing, sorted like ImageFolder."""
+    classes = sorted(e.name for e in os.scandir(data_dir) if e.is_dir())
+    items = []
+    for label, cls in enumerate(classes):
+        for root, _, files in sorted(os.walk(os.path.join(data_dir, cls))):
+            for f in sorted(files):
+                if f.lower().endswith(IMAGE_EXTS):
+                    rel = os.path.relpath(os.path.join(root, f), data_dir)
+                    items.append((rel.replace(os.sep, "/"), label))
+    return classes, items
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find near-duplicates and write a group-aware split")
+    parser.add_argument("--data", default="dataset/train")
+    parser.add_argument("--radius", type=int, default=6, help="max Hamming distance for duplicates")
+    parser.add_argument("--val-fraction", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--out", default=SPLIT_PATH)
+    parser.add_argument("--report", default="dataset/duplicates.csv")
+    args = parser.parse_args()
+
+    classes, items = list_dataset(args.data)
+    paths = [os.path.join(args.data, rel) for rel, _ in items]
+    labels = np.array([label for _, label in items], dtype=np.int64)
+    print(f"🔍 Hashing {len(paths)} images...")
+    hashes = hash_paths(paths, args.workers)
+
+    groups = find_clusters(hashes, args.radius)
+    _, group_idx, sizes = np.unique(groups, return_inverse=True, return_counts=True)
+    size_per_image = sizes[group_idx.ravel()]
+    in_cluster = size_per_image > 1
+
+    # Clusters whose members carry different grades are label noise as well as leakage
+    conflicts = {g for g in np.unique(groups[in_cluster])
+                 if len(np.unique(labels[groups == g])) > 1}
+
+    os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+    with open(args.report, "w") as f:
+        f.write("group,size,label_conflict,path,label,phash\n")
+        for i in np.flatnonzero(in_cluster)[np.argsort(groups[in_cluster], kind="stable")]:
+            f.write(f"{groups[i]},{size_per_image[i]},{int(groups[i] in conflicts)},"
+                    f"{items[i][0]},{classes[labels[i]]},{int(hashes[i]):016x}\n")
+
+    val = group_split(groups, labels, args.val_fraction, args.seed)
+    split = {
+        "data_dir": args.data,
+        "radius": args.radius,
+        "seed": args.seed,
+        "train": [items[i][0] for i in np.flatnonzero(~val)],
+        "val": [items[i][0] for i in np.flatnonzero(val)],
+    }
+    with open(args.out, "w") as f:
+        json.dump(split, f)
+
+    n_clusters = int((sizes > 1).sum())
+    print(f"🧬 {n_clusters} duplicate clusters covering {int(in_cluster.sum())} images "
+          f"({len(conflicts)} with conflicting labels) -> {args.report}")
+    print(f"✂️ Group-aware split: {len(split['train'])} train / {len(split['val'])} val -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
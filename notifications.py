@@ -0,0 +1,316 @@
+"""
+Referral notification outbox.
+
+When a scan is graded Moderate or worse, ``scan_queue.record_result``
+writes one ``notify_outbox`` row per configured recipient in the same
+transaction as the scan, so nothing is sent inline and the diagnosis
+flow never waits on the network. A unique ``dedup_key`` (scan +
+recipient) keeps retried jobs from queueing a second alert.
+
+An asyncio worker drains the outbox: due rows are grouped per recipient
+and folded into as few messages as fit the SMS length limit, sends go
+through a token-bucket rate limiter, and failures are retried with
+exponential backoff capped at ``RETRY_CAP``, so a gateway outage of up
+to about a day is ridden out. Rows that still fail end up ``failed``.
+The worker logs them and the dashboard shows their count. The transport is pluggable:
+Twilio (as in send_sms.py) or plain HTTP, which ``fake-server`` stands in
+for during tests.
+
+Recipients come from ``RETINAL_NOTIFY_RECIPIENTS`` (comma-separated phone
+numbers); Twilio credentials from ``TWILIO_ACCOUNT_SID``,
+``TWILIO_AUTH_TOKEN`` and ``TWILIO_FROM``.
+
+Usage:
+    python notifications.py fake-server --port 8766 --fail-rate 0.2
+    python notifications.py worker --transport http://127.0.0.1:8766
+    python notifications.py worker --transport twilio
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import time
+import urllib.request
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DB_NAME = "retinal_ai.db"
+REFERRAL_MIN_GRADE = 2      # Moderate or worse
+MAX_SMS_CHARS = 1600        # Twilio concatenated-SMS limit
+RETRY_BASE = 15             # seconds, doubled per attempt (plus jitter)...
+RETRY_CAP = 1800            # ...up to 30 minutes between attempts
+MAX_ATTEMPTS = 54           # ~24 h of retrying before a row is marked failed
+
+
+def recipients():
+    raw = os.environ.get("RETINAL_NOTIFY_RECIPIENTS", "")
+    return [r.strip() for r in raw.split(",") if r.strip()]
+
+
+# ============================================================
+# Outbox Table
+# ============================================================
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS notify_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dedup_key TEXT UNIQUE NOT NULL,
+        recipient TEXT NOT NULL,
+        scan_id INTEGER,
+        patient_id TEXT,
+        severity TEXT,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT,
+        sent_at TEXT
+    )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_notify_outbox_due "
+                 "ON notify_outbox (state, next_attempt)")
+    conn.commit()
+
+
+def enqueue_referral(conn, scan_id, patient_id, stage, value, to=None):
+    """Queue a referral alert for a scan; no-op below Moderate. Call inside the scan's transaction."""
+    if value < REFERRAL_MIN_GRADE:
+        return 0
+    rows = [(f"referral:{scan_id}:{r}", r, scan_id, patient_id, stage,
+             datetime.now().isoformat(timespec="seconds"))
+            for r in (to if to is not None else recipients())]
+    conn.executemany(
+        "INSERT OR IGNORE INTO notify_outbox "
+        "(dedup_key, recipient, scan_id, patient_id, severity, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)", rows
+    )
+    return len(rows)
+
+
+def compose(rows, limit=MAX_SMS_CHARS):
+    """Fold one recipient's outbox rows into ``[(body, [row ids])]`` messages."""
+    messages, lines, ids = [], [], []
+    header = "RetinalAI referral alert:"
+    for row_id, patient_id, severity, scan_id in rows:
+        line = f"\n- Patient {patient_id or '?'}: {severity} (scan #{scan_id})"
+        if lines and len(header) + sum(map(len, lines)) + len(line) > limit:
+            messages.append((header + "".join(lines), ids))
+            lines, ids = [], []
+        lines.append(line)
+        ids.append(row_id)
+    if lines:
+        messages.append((header + "".join(lines), ids))
+    return messages
+
+
+# ============================================================
+# Transports
+# ============================================================
+class HttpTransport:
+    """POST ``{"to", "body"}`` JSON to a URL (the fake server, or an SMS gateway)."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url.rstrip("/") + "/send"
+        self.timeout = timeout
+
+    def _post(self, to, body):
+        data = json.dumps({"to": to, "body": body}).encode()
+        req = urllib.request.Request(self.url, data=data,
+                                     headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return resp.status
+
+    async def send(self, to, body):
+        await asyncio.to_thread(self._post, to, body)
+
+
+class TwilioTransport:
+    """Twilio SMS; the blocking client call runs in a thread."""
+
+    def __init__(self, account_sid=None, auth_token=None, from_number=None):
+        from twilio.rest import Client
+
+        self.client = Client(account_sid or os.environ["TWILIO_ACCOUNT_SID"],
+                             auth_token or os.environ["TWILIO_AUTH_TOKEN"])
+        self.from_number = from_number or os.environ["TWILIO_FROM"]
+
+    async def send(self, to, body):
+        await asyncio.to_thread(self.client.messages.create,
+                                to=to, from_=self.from_number, body=body)
+
+
+class RateLimiter:
+    """Token bucket shared by all sends: ``rate`` messages/second, bursts up to ``burst``."""
+
+    def __init__(self, rate=1.0, burst=5):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# ============================================================
+# Asyncio Worker
+# ============================================================
+def _mark(conn, ids, error=None):
+    marks = ",".join("?" * len(ids))
+    if error is None:
+        conn.execute(f"UPDATE notify_outbox SET state = 'sent', sent_at = ?, last_error = NULL "
+                     f"WHERE id IN ({marks})",
+                     (datetime.now().isoformat(timespec="seconds"), *ids))
+    else:
+        for row_id, attempts in conn.execute(
+                f"SELECT id, attempts FROM notify_outbox WHERE id IN ({marks})", ids).fetchall():
+            delay = min(RETRY_CAP, RETRY_BASE * 2 ** attempts) * random.uniform(0.8, 1.2)
+            conn.execute(
+                "UPDATE notify_outbox SET attempts = attempts + 1, last_error = ?, "
+                "next_attempt = ?, state = CASE WHEN attempts + 1 >= ? THEN 'failed' "
+                "ELSE 'pending' END WHERE id = ?",
+                (str(error)[:500], time.time() + delay, MAX_ATTEMPTS, row_id)
+            )
+    conn.commit()
+
+
+def outbox_counts(conn):
+    """Outbox row count per state (``pending``, ``sent``, ``failed``)."""
+    counts = dict(conn.execute("SELECT state, COUNT(*) FROM notify_outbox GROUP BY state"))
+    return {state: counts.get(state, 0) for state in ("pending", "sent", "failed")}
+
+
+def report_failed(conn, since_id=0):
+    """Print alerts that gave up after ``MAX_ATTEMPTS``; returns the highest id reported."""
+    rows = conn.execute(
+        "SELECT id, recipient, patient_id, severity, scan_id, last_error FROM notify_outbox "
+        "WHERE state = 'failed' AND id > ? ORDER BY id", (since_id,)
+    ).fetchall()
+    for row_id, to, patient_id, severity, scan_id, error in rows:
+        print(f"⚠️ Referral alert NOT delivered: patient {patient_id} ({severity}, "
+              f"scan #{scan_id}) to {to}: {error}")
+    return rows[-1][0] if rows else since_id
+
+
+async def _send_one(conn, transport, limiter, to, body, ids, stats):
+    await limiter.acquire()
+    try:
+        await transport.send(to, body)
+    except Exception as e:
+        _mark(conn, ids, e)
+        stats["failed"] += 1
+    else:
+        _mark(conn, ids)
+        stats["sent"] += 1
+
+
+async def drain_once(conn, transport, limiter, stats=None):
+    """Send everything currently due; returns the number of messages attempted."""
+    stats = stats if stats is not None else {"sent": 0, "failed": 0}
+    due = conn.execute(
+        "SELECT id, recipient, patient_id, severity, scan_id FROM notify_outbox "
+        "WHERE state = 'pending' AND next_attempt <= ? ORDER BY recipient, id", (time.time(),)
+    ).fetchall()
+    per_recipient = {}
+    for row_id, to, patient_id, severity, scan_id in due:
+        per_recipient.setdefault(to, []).append((row_id, patient_id, severity, scan_id))
+    tasks = [
+        _send_one(conn, transport, limiter, to, body, ids, stats)
+        for to, rows in per_recipient.items()
+        for body, ids in compose(rows)
+    ]
+    await asyncio.gather(*tasks)
+    return len(tasks)
+
+
+async def run_worker(db_path=DB_NAME, transport=None, rate=1.0, burst=5, poll=5.0, once=False):
+    """Drain the outbox forever (or, with ``once``, until nothing is pending)."""
+    conn = sqlite3.connect(db_path, timeout=30)
+    ensure_schema(conn)
+    limiter = RateLimiter(rate, burst)
+    stats = {"sent": 0, "failed": 0}
+    print(f"📨 Notification worker on {db_path} ({type(transport).__name__})")
+    reported = report_failed(conn)
+    try:
+        while True:
+            attempted = await drain_once(conn, transport, limiter, stats)
+            if attempted:
+                print(f"📨 {stats['sent']} sent | {stats['failed']} failed attempts")
+                reported = report_failed(conn, reported)
+            if once and not attempted:
+                # Rows waiting out their backoff are not done yet: sleep until the first is due
+                due = conn.execute("SELECT MIN(next_attempt) FROM notify_outbox "
+                                   "WHERE state = 'pending'").fetchone()[0]
+                if due is None:
+                    break
+                await asyncio.sleep(max(due - time.time(), 0))
+                continue
+            await asyncio.sleep(poll)
+    finally:
+        conn.close()
+    return stats
+
+
+# ============================================================
+# Fake SMS Server (tests)
+# ============================================================
+def serve_fake(port=8766, fail_rate=0.0, log_path=None):
+    """HTTP stand-in for an SMS gateway; fails ``fail_rate`` of requests with a 503."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if random.random() < fail_rate:
+                self.send_response(503)
+                self.end_headers()
+                return
+            print(f"📱 to {payload['to']}: {payload['body']!r}")
+            if log_path:
+                with open(log_path, "a") as f:
+                    f.write(json.dumps(payload) + "\n")
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    print(f"📡 Fake SMS gateway on :{port} (fail rate {fail_rate:.0%})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Referral notification outbox")
+    parser.add_argument("--db", default=DB_NAME)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_worker = sub.add_parser("worker", help="Drain the outbox")
+    p_worker.add_argument("--transport", default="twilio", help="'twilio' or an http:// URL")
+    p_worker.add_argument("--rate", type=float, default=1.0, help="messages per second")
+    p_worker.add_argument("--burst", type=int, default=5)
+    p_worker.add_argument("--once", action="store_true")
+    p_fake = sub.add_parser("fake-server", help="Run a local fake SMS gateway")
+    p_fake.add_argument("--port", type=int, default=8766)
+    p_fake.add_argument("--fail-rate", type=float, default=0.0)
+    p_fake.add_argument("--log")
+    args = parser.parse_args()
+
+    if args.command == "fake-server":
+        serve_fake(args.port, args.fail_rate, args.log)
+    else:
+        chosen = HttpTransport(args.transport) if args.transport.startswith("http") \
+            else TwilioTransport()
+        asyncio.run(run_worker(args.db, chosen, args.rate, args.burst, once=args.once))
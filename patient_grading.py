@@ -0,0 +1,48 @@
+"""
+Patient-level grading from per-eye results.
+
+Screening decisions are made per patient, not per photo: the patient's
+severity is the worse eye's grade, and the patient is referred if either
+eye is Moderate or worse, or if an eye could not be graded (it has to be
+re-imaged or examined in clinic).
+"""
+REFERRAL_GRADE = 2          # Moderate or worse
+
+RECOMMENDATIONS = {
+    0: "• No referral needed\n• Re-screen in 12 months\n• Maintain glycemic control",
+    1: "• Re-screen in 6–12 months\n• Optimize glycemic and blood pressure control",
+    2: "• Refer to ophthalmologist\n• Follow-up in 3–6 months\n• Maintain glycemic control",
+    3: "• Urgent referral to ophthalmologist (within 4 weeks)\n• Follow-up in 2–3 months\n"
+       "• Tighten glycemic and blood pressure control",
+    4: "• Urgent referral (within 1 week) for laser / anti-VEGF assessment\n"
+       "• Close follow-up\n• Tighten glycemic and blood pressure control",
+}
+
+
+def aggregate(eyes, classes):
+    """Combine ``{eye: result dict or exception}`` into one patient result.
+
+    Returns ``{"eyes", "worst_eye", "value", "stage", "referral", "reasons"}``;
+    ``value``/``stage``/``worst_eye`` are None when no eye was gradable.
+    """
+    graded = {eye: r for eye, r in eyes.items() if not isinstance(r, Exception)}
+    ungradable = [eye for eye, r in eyes.items() if isinstance(r, Exception)]
+
+    worst_eye = max(graded, key=lambda e: (graded[e]["value"], graded[e]["confidence"])) \
+        if graded else None
+    value = graded[worst_eye]["value"] if graded else None
+
+    reasons = []
+    if value is not None and value >= REFERRAL_GRADE:
+        reasons.append(f"{worst_eye} eye graded {classes[value]}")
+    for eye in ungradable:
+        reasons.append(f"{eye} eye ungradable – re-image or examine")
+
+    return {
+        "eyes": eyes,
+        "worst_eye": worst_eye,
+        "value": value,
+        "stage": classes[value] if value is not None else None,
+        "referral": bool(reasons),
+        "reasons": reasons,
+    }
@@ -0,0 +1,251 @@
+"""
+Full-text / prefix patient search over every ``patients`` table.
+
+The three databases keep patients in differently shaped tables
+(``retinal_ai.db``: text ``patient_id``; ``phc_retinal.db``: integer ``id``
++ ``phone``; ``retinal_clinical.db``: ``p_id``). Each gets a
+``patient_fts`` FTS5 index over (id, name, phone) whose rowids are the
+patients' rowids, kept in sync by insert/update/delete triggers, so rows
+written by any app or by ``phc_sync`` are searchable immediately.
+
+Every typed word is matched as a token prefix ("sur 9876" finds Suresh
+with phone 98765 43210) and all words must match. Results are bm25
+ranked over every match as soon as any word has 3+ characters, so
+"ravi" puts the patient named exactly Ravi ahead of 2000 Ravi Kumars.
+Queries made only of 1-2 character prefixes match a large share of all
+patients (~45k of 300k). For those, only the first ``RANK_WINDOW``
+matches by rowid (the oldest patients) are ranked, which keeps the first
+keystrokes under ~20 ms. Those results are a fast preview, not the best
+matches. Prefix indexes on 1-3 characters keep short queries fast.
+
+``PatientSearcher`` runs queries on one background thread (SQLite
+connections stay on that thread) and only ever runs the latest request,
+so the Tk search box in blindness.py never blocks on the database.
+
+Usage:
+    python patient_search.py index
+    python patient_search.py query "suresh 9876"
+    python patient_search.py bench --patients 300000
+"""
+import argparse
+import os
+import queue
+import random
+import re
+import sqlite3
+import string
+import tempfile
+import threading
+import time
+from itertools import zip_longest
+
+import numpy as np
+
+# database -> how its patients table maps onto (pid, name, phone); {r} is the row alias
+SOURCES = {
+    "retinal_ai.db": {"pid": "{r}.patient_id", "phone": "NULL"},
+    "phc_retinal.db": {"pid": "CAST({r}.id AS TEXT)", "phone": "{r}.phone"},
+    "retinal_clinical.db": {"pid": "{r}.p_id", "phone": "NULL"},
+}
+RANK_WINDOW = 500           # matches ranked for queries of only short prefixes
+SHORT_PREFIX = 2            # tokens up to this long match too many rows to rank them all
+DEFAULT_LIMIT = 20
+
+
+# ============================================================
+# Index + Triggers
+# ============================================================
+def ensure_index(conn, source):
+    """Create ``patient_fts`` and its sync triggers for ``source`` (a SOURCES key).
+
+    Backfills existing patients on first creation; returns False if the
+    index already existed.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'patient_fts'").fetchone():
+        return False
+    spec = SOURCES[source]
+
+    def columns(r):
+        return f"{r}.rowid, {spec['pid'].format(r=r)}, {r}.name, {spec['phone'].format(r=r)}"
+
+    conn.executescript(f"""
+    BEGIN;
+    CREATE VIRTUAL TABLE patient_fts USING fts5(
+        pid, name, phone,
+        tokenize = "unicode61 remove_diacritics 2",
+        prefix = '1 2 3'
+    );
+    CREATE TRIGGER patient_fts_ai AFTER INSERT ON patients BEGIN
+        INSERT INTO patient_fts (rowid, pid, name, phone) VALUES ({columns('new')});
+    END;
+    CREATE TRIGGER patient_fts_ad AFTER DELETE ON patients BEGIN
+        DELETE FROM patient_fts WHERE rowid = old.rowid;
+    END;
+    CREATE TRIGGER patient_fts_au AFTER UPDATE ON patients BEGIN
+        DELETE FROM patient_fts WHERE rowid = old.rowid;
+        INSERT INTO patient_fts (rowid, pid, name, phone) VALUES ({columns('new')});
+    END;
+    INSERT INTO patient_fts (rowid, pid, name, phone) SELECT {columns('p')} FROM patients p;
+    COMMIT;
+    """)
+    return True
+
+
+# ============================================================
+# Queries
+# ============================================================
+def match_expression(text):
+    """``'Sur 98'`` -> ``'"sur"* AND "98"*'``; None if there is nothing to search for."""
+    tokens = re.findall(r"\w+", text.lower())
+    return " AND ".join(f'"{t}"*' for t in tokens) if tokens else None
+
+
+def search(conn, text, source, limit=DEFAULT_LIMIT):
+    """Matching patients in one database as dicts (best match first)."""
+    expr = match_expression(text)
+    if expr is None:
+        return []
+    if max(len(t) for t in re.findall(r"\w+", text)) > SHORT_PREFIX:
+        # Rank every match before limiting (3+ character prefixes: <= ~18 ms at 300k)
+        order, window = "ORDER BY rank ", limit
+    else:
+        # Only 1-2 character prefixes: rank the first RANK_WINDOW matches
+        order, window = "", RANK_WINDOW
+    rows = conn.execute(
+        "SELECT m.pid, m.name, m.phone, p.age, p.gender FROM ("
+        "  SELECT rowid, pid, name, phone, rank FROM patient_fts WHERE patient_fts MATCH ? "
+        f"  {order}LIMIT ?"
+        ") m JOIN patients p ON p.rowid = m.rowid ORDER BY m.rank LIMIT ?",
+        (expr, window, limit)
+    ).fetchall()
+    return [{"source": source, "pid": pid, "name": name, "phone": phone,
+             "age": age, "gender": gender} for pid, name, phone, age, gender in rows]
+
+
+def search_all(conns, text, limit=DEFAULT_LIMIT):
+    """Search every ``{source: conn}``; results interleaved so each database is represented."""
+    per_source = [search(c, text, source, limit) for source, c in conns.items()]
+    merged = [r for tier in zip_longest(*per_source) for r in tier if r is not None]
+    return merged[:limit]
+
+
+def open_sources(base_dir="."):
+    """Connections to every SOURCES database present, each indexed."""
+    conns = {}
+    for source in SOURCES:
+        path = os.path.join(base_dir, source)
+        if not os.path.exists(path):
+            continue
+        conn = sqlite3.connect(path, timeout=5)
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'patients'").fetchone() is None:
+            conn.close()
+            continue
+        ensure_index(conn, source)
+        conns[source] = conn
+    return conns
+
+
+# ============================================================
+# Background Searcher (for the UI)
+# ============================================================
+class PatientSearcher:
+    """Serves search requests on one daemon thread; only the newest request runs.
+
+    ``submit(text)`` never blocks; ``latest()`` returns ``(text, results,
+    elapsed_ms)`` for the most recently finished query (or None).
+    """
+
+    def __init__(self, base_dir=".", limit=DEFAULT_LIMIT):
+        self.base_dir = base_dir
+        self.limit = limit
+        self._requests = queue.Queue()
+        self._result = None
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, text):
+        self._requests.put(text)
+
+    def latest(self):
+        with self._lock:
+            result, self._result = self._result, None
+        return result
+
+    def _run(self):
+        conns = open_sources(self.base_dir)
+        while True:
+            text = self._requests.get()
+            # Skip requests superseded while the previous query ran
+            while not self._requests.empty():
+                text = self._requests.get_nowait()
+            start = time.perf_counter()
+            try:
+                results = search_all(conns, text, self.limit)
+            except sqlite3.Error as e:
+                print(f"[WARN] Patient search failed: {e}")
+                results = []
+            with self._lock:
+                self._result = (text, results, 1000 * (time.perf_counter() - start))
+
+
+# ============================================================
+# Benchmark
+# ============================================================
+def bench(n_patients=300000, n_queries=500, seed=0):
+    """Time type-ahead queries against a synthetic phc-style database."""
+    rng = random.Random(seed)
+    syllables = ["ra", "ma", "su", "sh", "ni", "ka", "vi", "an", "de", "pr", "ya", "la", "ha"]
+
+    def word():
+        return "".join(rng.choice(syllables) for _ in range(rng.randint(2, 4))).title()
+
+    path = os.path.join(tempfile.mkdtemp(), "phc_retinal.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE patients (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, "
+                 "age INTEGER, gender TEXT, phone TEXT, address TEXT)")
+    ensure_index(conn, "phc_retinal.db")
+    start = time.perf_counter()
+    conn.executemany(
+        "INSERT INTO patients (name, age, gender, phone) VALUES (?, ?, ?, ?)",
+        ((f"{word()} {word()}", rng.randint(20, 90), rng.choice("MF"),
+          "".join(rng.choice(string.digits) for _ in range(10))) for _ in range(n_patients)))
+    conn.commit()
+    print(f"📥 {n_patients} patients inserted and indexed in {time.perf_counter() - start:.1f}s")
+
+    # Realistic keystroke prefixes of existing names/phones, 2+ characters
+    names = [r[0] for r in conn.execute("SELECT name, phone FROM patients ORDER BY random() LIMIT ?",
+                                        (n_queries,))]
+    queries = [name[:rng.randint(2, len(name))] for name in names]
+    times = []
+    for q in queries:
+        start = time.perf_counter()
+        search(conn, q, "phc_retinal.db")
+        times.append(1000 * (time.perf_counter() - start))
+    p50, p95, p99 = np.percentile(times, [50, 95, 99])
+    print(f"⏱️ {n_queries} queries: p50 {p50:.2f} ms | p95 {p95:.2f} ms | p99 {p99:.2f} ms "
+          f"| max {max(times):.2f} ms")
+    conn.close()
+    return times
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FTS5 patient search")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("index", help="Create search indexes in every patient database")
+    p_query = sub.add_parser("query", help="Search all patient databases")
+    p_query.add_argument("text")
+    p_query.add_argument("--limit", type=int, default=DEFAULT_LIMIT)
+    p_bench = sub.add_parser("bench", help="Query latency on synthetic patients")
+    p_bench.add_argument("--patients", type=int, default=300000)
+    p_bench.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.patients, args.queries)
+    else:
+        dbs = open_sources()
+        print(f"🔎 Indexed: {', '.join(dbs) or 'no patient databases found'}")
+        if args.command == "query":
+            for r in search_all(dbs, args.text, args.limit):
+                print(f"   [{r['source']}] {r['pid']} | {r['name']} | {r['phone'] or '-'} "
+                      f"| {r['age'] or '-'} {r['gender'] or ''}")
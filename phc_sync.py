@@ -0,0 +1,378 @@
+"""
+Incremental PHC-to-hub synchronization.
+
+Each primary health centre keeps its own ``phc_retinal.db``. Triggers on
+``patients`` and ``reports`` append every insert, update and delete to a
+``sync_changelog`` table; ``push`` ships only changelog entries after the
+hub's last acknowledged sequence number, as zlib-compressed JSON batches
+with column names sent once per table. The hub bulk-upserts a batch in a
+single transaction, keyed by ``(phc_id, id)``, and answers with its new
+high-water mark. Batches are idempotent: a resent batch is acknowledged
+without being applied twice, and acknowledged changelog rows are pruned.
+Bandwidth and time therefore scale with new rows only, with one
+exception. The changelog is shared by all hubs, so a hub that needs rows
+that were already pruned (a new hub, one restored from an old backup,
+or one back after ``STALE_HUB_DAYS``) makes the PHC re-log every row.
+Every hub then receives that full copy on its next push. The upserts are
+idempotent, so nothing is duplicated, but that one push costs the whole
+database.
+
+A hub that stops acknowledging would hold pruning back forever. After
+``STALE_HUB_DAYS`` without an acknowledgement it is ignored for pruning,
+and ``forget-hub`` removes a retired hub for good.
+
+The hub is either a local database file (stand-in for testing) or
+``serve-hub`` behind HTTP.
+
+Usage:
+    python phc_sync.py push --db phc_retinal.db --hub hub_retinal.db
+    python phc_sync.py serve-hub --db hub_retinal.db --port 8765
+    python phc_sync.py push --db phc_retinal.db --hub http://hub.local:8765
+    python phc_sync.py forget-hub --db phc_retinal.db --hub http://old-hub.local:8765
+"""
+import argparse
+import json
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TABLES = {
+    "patients": ("id", "name", "age", "gender", "phone", "address"),
+    "reports": ("id", "patient_id", "dr_stage", "risk", "recommendation", "referred",
+                "created_at"),
+}
+BATCH_SIZE = 1000
+STALE_HUB_DAYS = 30         # hubs silent this long stop holding back changelog pruning
+
+
+# ============================================================
+# PHC Side: Change Tracking
+# ============================================================
+def enable_tracking(conn, phc_id=None):
+    """Install changelog triggers (idempotent) and return this PHC's id.
+
+    On first install every existing row is logged once, so the first push
+    is a full copy and later pushes are deltas.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_meta (key TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS sync_state "
+                 "(hub TEXT PRIMARY KEY, acked_seq INTEGER, acked_at REAL)")
+    # Databases tracked before stale-hub pruning lack acked_at; count them as seen now
+    if "acked_at" not in [r[1] for r in conn.execute("PRAGMA table_info(sync_state)")]:
+        conn.execute("ALTER TABLE sync_state ADD COLUMN acked_at REAL")
+        conn.execute("UPDATE sync_state SET acked_at = ?", (time.time(),))
+        conn.commit()
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = 'phc_id'").fetchone()
+    if row:
+        return row[0]
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS sync_changelog (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        tbl TEXT NOT NULL,
+        row_id INTEGER NOT NULL
+    )
+    """)
+    for table in TABLES:
+        # The changelog records which row changed; push reads its current state
+        for event, ref in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+            conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS sync_{table}_{event.lower()}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO sync_changelog (tbl, row_id) VALUES ('{table}', {ref}.id);
+            END
+            """)
+    reseed(conn)
+    phc_id = phc_id or uuid.uuid4().hex[:12]
+    conn.execute("INSERT INTO sync_meta (key, value) VALUES ('phc_id', ?)", (phc_id,))
+    conn.commit()
+    return phc_id
+
+
+def reseed(conn):
+    """Log every current row again (full resend on the next push)."""
+    for table in TABLES:
+        conn.execute(f"INSERT INTO sync_changelog (tbl, row_id) "
+                     f"SELECT '{table}', id FROM {table} ORDER BY id")
+
+
+def build_batch(conn, phc_id, after_seq, limit=BATCH_SIZE):
+    """Delta after ``after_seq`` as a dict, or None if there is nothing new.
+
+    Repeated changes to one row collapse to its current state; rows that
+    no longer exist become deletes.
+    """
+    changes = conn.execute(
+        "SELECT seq, tbl, row_id FROM sync_changelog WHERE seq > ? ORDER BY seq LIMIT ?",
+        (after_seq, limit)
+    ).fetchall()
+    if not changes:
+        return None
+    batch = {"phc_id": phc_id, "from_seq": after_seq, "to_seq": changes[-1][0],
+             "upserts": {}, "deletes": {}}
+    for table, columns in TABLES.items():
+        ids = sorted({row_id for _, tbl, row_id in changes if tbl == table})
+        if not ids:
+            continue
+        rows = []
+        for i in range(0, len(ids), 500):  # stay under SQLite's bound-parameter limit
+            chunk = ids[i:i + 500]
+            rows += conn.execute(
+                f"SELECT {', '.join(columns)} FROM {table} "
+                f"WHERE id IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+        present = {row[0] for row in rows}
+        batch["upserts"][table] = {"columns": list(columns), "rows": [list(r) for r in rows]}
+        batch["deletes"][table] = [i for i in ids if i not in present]
+    return batch
+
+
+def encode_batch(batch):
+    return zlib.compress(json.dumps(batch, separators=(",", ":")).encode(), 6)
+
+
+def decode_batch(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+# ============================================================
+# Hub Side: Bulk Upsert
+# ============================================================
+def ensure_hub_schema(conn):
+    for table, columns in TABLES.items():
+        cols = ", ".join(f"{c} {'INTEGER' if c == 'id' else ''}".strip() for c in columns)
+        conn.execute(f"CREATE TABLE IF NOT EXISTS hub_{table} (phc_id TEXT NOT NULL, {cols}, "
+                     f"synced_at TEXT, PRIMARY KEY (phc_id, id))")
+    conn.execute("CREATE TABLE IF NOT EXISTS hub_state (phc_id TEXT PRIMARY KEY, "
+                 "last_seq INTEGER NOT NULL, last_sync TEXT)")
+    conn.commit()
+
+
+def apply_batch(conn, batch):
+    """Apply one decoded batch atomically; returns the hub's high-water mark for the PHC.
+
+    A batch the hub has already applied, or one that starts past the hub's
+    mark (the hub lost data), is not applied; the returned mark tells the
+    PHC where to resume.
+    """
+    phc_id = batch["phc_id"]
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT last_seq FROM hub_state WHERE phc_id = ?", (phc_id,)).fetchone()
+        last_seq = row[0] if row else 0
+        if batch["from_seq"] != last_seq:
+            conn.execute("ROLLBACK")
+            return last_seq
+        for table, data in batch["upserts"].items():
+            columns = data["columns"]
+            updates = ", ".join(f"{c} = excluded.{c}" for c in columns if c != "id")
+            conn.executemany(
+                f"INSERT INTO hub_{table} (phc_id, {', '.join(columns)}, synced_at) "
+                f"VALUES (?, {', '.join('?' * len(columns))}, ?) "
+                f"ON CONFLICT (phc_id, id) DO UPDATE SET {updates}, synced_at = excluded.synced_at",
+                [(phc_id, *r, now) for r in data["rows"]]
+            )
+        for table, ids in batch["deletes"].items():
+            conn.executemany(f"DELETE FROM hub_{table} WHERE phc_id = ? AND id = ?",
+                             [(phc_id, i) for i in ids])
+        conn.execute(
+            "INSERT INTO hub_state (phc_id, last_seq, last_sync) VALUES (?, ?, ?) "
+            "ON CONFLICT (phc_id) DO UPDATE SET last_seq = excluded.last_seq, "
+            "last_sync = excluded.last_sync", (phc_id, batch["to_seq"], now)
+        )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return batch["to_seq"]
+
+
+class LocalHub:
+    """Hub database opened directly; the stand-in used for testing."""
+
+    def __init__(self, db_path):
+        self.name = db_path
+        self.conn = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()  # one connection shared by the HTTP handler threads
+        ensure_hub_schema(self.conn)
+
+    def send(self, blob):
+        batch = decode_batch(blob)
+        with self._lock:
+            return apply_batch(self.conn, batch)
+
+    def mark(self, phc_id):
+        with self._lock:
+            row = self.conn.execute("SELECT last_seq FROM hub_state WHERE phc_id = ?",
+                                    (phc_id,)).fetchone()
+        return row[0] if row else 0
+
+
+class HttpHub:
+    """Hub reached over HTTP (see ``serve_hub``)."""
+
+    def __init__(self, url, timeout=60):
+        self.name = url.rstrip("/")
+        self.timeout = timeout
+
+    def _request(self, path, data=None):
+        req = urllib.request.Request(self.name + path, data=data,
+                                     headers={"Content-Type": "application/octet-stream"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            return json.loads(resp.read())["last_seq"]
+
+    def send(self, blob):
+        return self._request("/sync", blob)
+
+    def mark(self, phc_id):
+        return self._request(f"/mark?phc_id={phc_id}")
+
+
+def serve_hub(db_path, port=8765):
+    hub = LocalHub(db_path)
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, last_seq):
+            body = json.dumps({"last_seq": last_seq}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            blob = self.rfile.read(int(self.headers["Content-Length"]))
+            self._reply(hub.send(blob))
+
+        def do_GET(self):
+            self._reply(hub.mark(self.path.partition("phc_id=")[2]))
+
+    server = ThreadingHTTPServer(("", port), Handler)
+    server.daemon_threads = True
+    print(f"🏥 Hub listening on :{port} -> {db_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+# ============================================================
+# Push
+# ============================================================
+def _resend_if_pruned(conn, acked):
+    """Re-log all rows when the hub needs entries that were already pruned.
+
+    Happens for a hub added after pruning, or one restored from a backup
+    older than its last acknowledgement.
+    """
+    row = conn.execute("SELECT value FROM sync_meta WHERE key = 'pruned_through'").fetchone()
+    if row and acked < int(row[0]):
+        print(f"[WARN] Hub is at {acked}, changes up to {row[0]} were pruned; resending all rows")
+        reseed(conn)
+
+
+def prune(conn, stale_days=STALE_HUB_DAYS):
+    """Delete changelog entries every active hub has acknowledged; returns the new floor.
+
+    Hubs without an acknowledgement for ``stale_days`` are left out; if one
+    comes back it gets a full resend (see ``_resend_if_pruned``).
+    """
+    cutoff = time.time() - stale_days * 86400
+    for hub, acked_at in conn.execute("SELECT hub, acked_at FROM sync_state WHERE acked_at < ?",
+                                      (cutoff,)).fetchall():
+        print(f"[WARN] Hub {hub} silent for {(time.time() - acked_at) / 86400:.0f} days; "
+              f"ignored for pruning (phc_sync.py forget-hub to remove it)")
+    pruned = conn.execute("SELECT MIN(acked_seq) FROM sync_state WHERE acked_at >= ?",
+                          (cutoff,)).fetchone()[0]
+    if pruned is None:
+        return None
+    conn.execute("DELETE FROM sync_changelog WHERE seq <= ?", (pruned,))
+    conn.execute("INSERT INTO sync_meta (key, value) VALUES ('pruned_through', ?) "
+                 "ON CONFLICT (key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), "
+                 "CAST(excluded.value AS INTEGER))", (pruned,))
+    return pruned
+
+
+def forget_hub(phc_db, hub_name):
+    """Stop tracking a retired hub so it no longer holds back pruning; returns True if known."""
+    conn = sqlite3.connect(phc_db)
+    enable_tracking(conn)
+    known = conn.execute("DELETE FROM sync_state WHERE hub = ?", (hub_name,)).rowcount > 0
+    prune(conn)
+    conn.commit()
+    conn.close()
+    return known
+
+
+def push(phc_db, hub, batch_size=BATCH_SIZE, stale_days=STALE_HUB_DAYS):
+    """Send all pending changes; returns a stats dict."""
+    conn = sqlite3.connect(phc_db)
+    phc_id = enable_tracking(conn)
+    row = conn.execute("SELECT acked_seq FROM sync_state WHERE hub = ?", (hub.name,)).fetchone()
+    acked = row[0] if row else hub.mark(phc_id)
+    _resend_if_pruned(conn, acked)
+
+    stats = {"batches": 0, "rows": 0, "bytes": 0}
+    start = time.perf_counter()
+    while True:
+        batch = build_batch(conn, phc_id, acked, batch_size)
+        if batch is None:
+            break
+        blob = encode_batch(batch)
+        mark = hub.send(blob)
+        if mark == batch["to_seq"]:
+            stats["batches"] += 1
+            stats["bytes"] += len(blob)
+            stats["rows"] += sum(len(d["rows"]) for d in batch["upserts"].values()) + \
+                sum(len(ids) for ids in batch["deletes"].values())
+        else:
+            _resend_if_pruned(conn, mark)
+        acked = mark  # resume wherever the hub says it is
+        conn.execute("INSERT INTO sync_state (hub, acked_seq, acked_at) VALUES (?, ?, ?) "
+                     "ON CONFLICT (hub) DO UPDATE SET acked_seq = excluded.acked_seq, "
+                     "acked_at = excluded.acked_at",
+                     (hub.name, acked, time.time()))
+        # Entries every active hub has acknowledged are no longer needed
+        prune(conn, stale_days)
+        conn.commit()
+    conn.close()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Incremental PHC-to-hub sync")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_push = sub.add_parser("push", help="Ship new changes to the hub")
+    p_push.add_argument("--db", default="phc_retinal.db")
+    p_push.add_argument("--hub", required=True, help="hub database path or http:// URL")
+    p_push.add_argument("--batch", type=int, default=BATCH_SIZE)
+    p_push.add_argument("--stale-days", type=float, default=STALE_HUB_DAYS,
+                        help="hubs silent this long no longer hold back pruning")
+    p_forget = sub.add_parser("forget-hub", help="Stop tracking a retired hub")
+    p_forget.add_argument("--db", default="phc_retinal.db")
+    p_forget.add_argument("--hub", required=True, help="the --hub value it was pushed with")
+    p_serve = sub.add_parser("serve-hub", help="Run the hub HTTP endpoint")
+    p_serve.add_argument("--db", default="hub_retinal.db")
+    p_serve.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if args.command == "serve-hub":
+        serve_hub(args.db, args.port)
+    elif args.command == "forget-hub":
+        name = args.hub.rstrip("/") if args.hub.startswith("http") else args.hub
+        if forget_hub(args.db, name):
+            print(f"🗑️ Forgot hub {name}; changelog pruned to the remaining hubs")
+        else:
+            print(f"[WARN] {name} is not a known hub of {args.db}")
+    else:
+        target = HttpHub(args.hub) if args.hub.startswith("http") else LocalHub(args.hub)
+        result = push(args.db, target, args.batch, args.stale_days)
+        print(f"🔄 Synced {result['rows']} rows in {result['batches']} batches "
+              f"({result['bytes'] / 1024:.1f} KiB compressed) in {result['seconds']:.2f}s")
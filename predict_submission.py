@@ -0,0 +1,256 @@
+"""
+Streaming prediction / Kaggle submission writer for large test sets.
+
+Replaces the notebook's ``predict(testloader)``, which called ``.cuda()``
+unconditionally and collected every prediction in a Python list. Here
+predictions are written to disk chunk by chunk from preallocated NumPy
+buffers, so memory stays constant however large the test set is, and an
+interrupted run resumes from the rows already on disk.
+
+Usage:
+    python predict_submission.py --csv test.csv --images test_images \\
+        --checkpoint classifier.pt --out submission.csv
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from torchvision import transforms
+
+from checkpoints import load_classifier
+from evaluation import expected_grade, round_off_preds
+from preprocessing import FundusPreprocessor
+
+NUM_CLASSES = 5
+
+test_transforms = transforms.Compose([
+    transforms.Resize((224, 224)),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=(0.485, 0.456, 0.406),
+                         std=(0.229, 0.224, 0.225))
+])
+
+
+# ============================================================
+# Dataset
+# ============================================================
+def open_rgb(path):
+    return Image.open(path).convert("RGB")
+
+
+class TestImageDataset(Dataset):
+    """Images listed by ``id_code``; yields ``(tensor, row_index)``."""
+
+    def __init__(self, ids, img_dir, transform=test_transforms, ext=".png", loader=None):
+        super().__init__()
+        self.ids = np.asarray(ids, dtype=object)
+        self.img_dir = img_dir
+        self.transform = transform
+        self.ext = ext
+        self.loader = loader or open_rgb
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        path = os.path.join(self.img_dir, str(self.ids[index]) + self.ext)
+        return self.transform(self.loader(path)), index
+
+
+# ============================================================
+# Output Writers
+# ============================================================
+class CsvChunkWriter:
+    """Appends chunks to a single CSV file, fsync'd after every chunk."""
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+
+    def completed_rows(self):
+        """Number of complete data rows on disk; drops a torn trailing line."""
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb+") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            # Walk back to the last newline so a crash mid-write is discarded
+            pos = size
+            while pos > 0:
+                step = min(65536, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                nl = block.rfind(b"\n")
+                if nl >= 0:
+                    pos = pos - step + nl + 1
+                    break
+                pos -= step
+            if pos != size:
+                f.truncate(pos)
+
+            f.seek(0)
+            lines = sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b""))
+        return max(lines - 1, 0)  # minus header
+
+    def write(self, frame):
+        header = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        with open(self.path, "a", newline="") as f:
+            frame.to_csv(f, header=header, index=False, columns=self.columns)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ParquetChunkWriter:
+    """Writes one ``part-XXXXX.parquet`` file per chunk into a directory."""
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow.parquet  # noqa: F401
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow: pip install pyarrow")
+        self.path = path
+        self.columns = columns
+        os.makedirs(path, exist_ok=True)
+
+    def _parts(self):
+        return sorted(p for p in os.listdir(self.path)
+                      if p.startswith("part-") and p.endswith(".parquet"))
+
+    def completed_rows(self):
+        import pyarrow.parquet as pq
+        return sum(pq.read_metadata(os.path.join(self.path, p)).num_rows
+                   for p in self._parts())
+
+    def write(self, frame):
+        part = os.path.join(self.path, f"part-{len(self._parts()):05d}.parquet")
+        tmp = part + ".tmp"
+        frame[self.columns].to_parquet(tmp, index=False)
+        os.replace(tmp, part)  # a part is either complete or absent
+
+
+# ============================================================
+# Streaming Predictor
+# ============================================================
+def stream_predictions(model, ids, img_dir, out_path, fmt="csv", chunk_size=4096,
+                       batch_size=64, num_workers=2, thresholds=None,
+                       with_probs=False, device=None, ext=".png", loader=None):
+    """Predict every id and stream rows to ``out_path``; returns rows written.
+
+    Rows are written in input order, so the number of rows already on disk
+    is the resume offset. With ``thresholds`` the grade is the tuned
+    rounding of the probability-weighted severity, otherwise the argmax.
+    """
+    device = device or next(model.parameters()).device
+    columns = ["id_code", "diagnosis"]
+    if with_probs:
+        columns += [f"prob_{c}" for c in range(NUM_CLASSES)]
+
+    writer = (ParquetChunkWriter if fmt == "parquet" else CsvChunkWriter)(out_path, columns)
+    start = writer.completed_rows()
+    if start >= len(ids):
+        print(f"✅ Output already complete ({start} rows): {out_path}")
+        return 0
+    if start:
+        print(f"⏩ Resuming after {start} completed rows")
+
+    remaining = np.asarray(ids, dtype=object)[start:]
+    data_loader = DataLoader(
+        TestImageDataset(remaining, img_dir, ext=ext, loader=loader),
+        batch_size=batch_size,
+        shuffle=False,
+        num_workers=num_workers,
+        pin_memory=(torch.device(device).type == "cuda")
+    )
+
+    # Preallocated chunk buffers, reused for every chunk
+    buf_probs = np.empty((chunk_size, NUM_CLASSES), dtype=np.float32)
+    buf_index = np.empty(chunk_size, dtype=np.int64)
+    filled = 0
+    written = 0
+
+    def flush(n):
+        probs = buf_probs[:n]
+        if thresholds is not None:
+            grades = round_off_preds(expected_grade(probs), thresholds)
+        else:
+            grades = probs.argmax(axis=1)
+        frame = pd.DataFrame({"id_code": remaining[buf_index[:n]], "diagnosis": grades})
+        if with_probs:
+            for c in range(NUM_CLASSES):
+                frame[f"prob_{c}"] = probs[:, c]
+        writer.write(frame)
+
+    model.eval()
+    with torch.inference_mode():
+        for inputs, index in data_loader:
+            probs = torch.softmax(model(inputs.to(device, non_blocking=True)), dim=1)
+            probs = probs.cpu().numpy()
+            index = index.numpy()
+
+            pos = 0
+            while pos < len(probs):
+                take = min(chunk_size - filled, len(probs) - pos)
+                buf_probs[filled:filled + take] = probs[pos:pos + take]
+                buf_index[filled:filled + take] = index[pos:pos + take]
+                filled += take
+                pos += take
+                if filled == chunk_size:
+                    flush(filled)
+                    written += filled
+                    filled = 0
+
+        if filled:
+            flush(filled)
+            written += filled
+
+    print(f"✅ Wrote {written} predictions to {out_path}")
+    return written
+
+
+# ============================================================
+# Main
+# ============================================================
+def main():
+    parser = argparse.ArgumentParser(description="Streaming DR predictions for a test set")
+    parser.add_argument("--csv", required=True, help="CSV with an id_code column")
+    parser.add_argument("--images", required=True, help="Directory of test images")
+    parser.add_argument("--checkpoint", default="classifier.pt")
+    parser.add_argument("--out", default="submission.csv")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv")
+    parser.add_argument("--ext", default=".png")
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--probs", action="store_true", help="Also write class probabilities")
+    parser.add_argument("--argmax", action="store_true",
+                        help="Ignore tuned thresholds stored in the checkpoint")
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model, checkpoint = load_classifier(args.checkpoint, device)
+    thresholds = None if args.argmax else checkpoint.get("thresholds")
+    loader = None
+    if checkpoint.get("preprocessing") == "ben_graham":
+        loader = FundusPreprocessor(size=224).load
+
+    ids = pd.read_csv(args.csv, usecols=["id_code"])["id_code"].to_numpy()
+    stream_predictions(
+        model, ids, args.images, args.out,
+        fmt=args.format,
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        num_workers=args.workers,
+        thresholds=thresholds,
+        with_probs=args.probs,
+        device=device,
+        ext=args.ext,
+        loader=loader
+    )
+
+
+if __name__ == "__main__":
+    main()
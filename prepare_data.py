@@ -1,5 +1,10 @@
+import argparse
+import hashlib
+import json
 import os
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 from tqdm import tqdm
 
@@ -10,50 +15,193 @@ base_dir = "dataset"
 csv_path = os.path.join(base_dir, "train.csv")       # CSV file path
 img_dir = os.path.join(base_dir, "train_images")     # Folder with original images
 output_dir = os.path.join(base_dir, "train")         # Destination for organized images
+manifest_name = "manifest.json"
 
-# ===============================
-# CREATE OUTPUT FOLDERS
-# ===============================
 classes = ['0_No_DR', '1_Mild', '2_Moderate', '3_Severe', '4_Proliferative_DR']
+image_exts = ['.png', '.jpeg', '.jpg', '.tif', '.tiff']   # preference order for duplicate ids
 
-# Create main class folders if not already there
-for c in classes:
-    os.makedirs(os.path.join(output_dir, c), exist_ok=True)
 
 # ===============================
-# READ CSV
+# FILE LISTING (single scandir per directory)
 # ===============================
-df = pd.read_csv(csv_path)
-print(f"✅ Found {len(df)} labeled images in CSV.")
+def list_images(directory):
+    """One os.scandir pass -> DataFrame(stem, filename, size)."""
+    rows = []
+    if os.path.isdir(directory):
+        with os.scandir(directory) as it:
+            for entry in it:
+                stem, ext = os.path.splitext(entry.name)
+                if entry.is_file() and ext.lower() in image_exts:
+                    rows.append((stem, entry.name, ext.lower(), entry.stat().st_size))
+    return pd.DataFrame(rows, columns=["stem", "filename", "ext", "size"])
+
+
+def build_plan(df, id_col, label_col):
+    """Join labels against the source listing and the existing output."""
+    labels = df[[id_col, label_col]].rename(columns={id_col: "stem", label_col: "label"})
+    labels["stem"] = labels["stem"].astype(str)
+    labels["label"] = labels["label"].astype(int)
+
+    source = list_images(img_dir)
+    source["rank"] = source["ext"].map({e: i for i, e in enumerate(image_exts)})
+    source = source.sort_values("rank").drop_duplicates("stem")
+
+    plan = labels.merge(source[["stem", "filename", "size"]], on="stem", how="left")
+    plan["class_dir"] = plan["label"].map(dict(enumerate(classes)))
+
+    # What a previous run already organized, matched on (id, class folder)
+    existing = pd.concat(
+        [list_images(os.path.join(output_dir, c)).assign(class_dir=c) for c in classes],
+        ignore_index=True
+    ).drop_duplicates(["stem", "class_dir"])
+    plan = plan.merge(
+        existing[["stem", "class_dir", "filename", "size"]].rename(
+            columns={"filename": "dst_filename", "size": "dst_size"}),
+        on=["stem", "class_dir"], how="left"
+    )
+
+    # Done = same file already in place, or the source is gone after a --mode move run
+    has_src = plan["filename"].notna()
+    has_dst = plan["dst_filename"].notna()
+    plan["done"] = has_dst & (~has_src | (plan["dst_size"] == plan["size"]))
+    plan["missing"] = ~has_src & ~has_dst
+    plan["filename"] = plan["filename"].where(has_src, plan["dst_filename"])
+    plan["size"] = plan["size"].where(has_src, plan["dst_size"])
+
+    name = plan["filename"].fillna("")
+    plan["src"] = img_dir + os.sep + name
+    plan["rel"] = plan["class_dir"] + "/" + name
+    plan["dst"] = output_dir + os.sep + plan["class_dir"] + os.sep + name
+    return plan
+
 
 # ===============================
-# MOVE IMAGES TO CLASS FOLDERS
+# TRANSFER + CHECKSUM WORKERS
 # ===============================
-moved_count = 0
-missing_count = 0
+def transfer(src, dst, mode):
+    if os.path.exists(dst):
+        os.remove(dst)              # stale partial copy from an interrupted run
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass                    # cross-device or unsupported FS -> copy
+        shutil.copy2(src, dst)
+    elif mode == "copy":
+        shutil.copy2(src, dst)
+    else:
+        shutil.move(src, dst)
 
-for _, row in tqdm(df.iterrows(), total=len(df)):
-    img_id = str(row['id_code'])
-    label = int(row['diagnosis'])
-    label_folder = classes[label]
 
-    # Build source and destination paths
-    src = os.path.join(img_dir, img_id + ".png")     # assumes all are .png
-    dst = os.path.join(output_dir, label_folder, img_id + ".png")
+def sha1sum(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest():
+    path = os.path.join(output_dir, manifest_name)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {}
 
-    # Move if file exists
-    if os.path.exists(src):
-        shutil.move(src, dst)
-        moved_count += 1
-    else:
-        missing_count += 1
 
 # ===============================
-# SUMMARY
+# MAIN
 # ===============================
-print(f"\n✅ Dataset organized successfully!")
-print(f"📦 {moved_count} images moved into class folders.")
-if missing_count > 0:
-    print(f"⚠️  {missing_count} images not found in {img_dir}")
-else:
-    print("🎉 All images found and organized perfectly!")
+def main():
+    global csv_path, img_dir, output_dir
+
+    parser = argparse.ArgumentParser(description="Organize labeled fundus images into class folders")
+    parser.add_argument("--csv", default=csv_path)
+    parser.add_argument("--images", default=img_dir)
+    parser.add_argument("--out", default=output_dir)
+    parser.add_argument("--id-col", default="id_code", help="EyePACS: image")
+    parser.add_argument("--label-col", default="diagnosis", help="EyePACS: level")
+    parser.add_argument("--mode", choices=["hardlink", "copy", "move"], default="hardlink",
+                        help="hardlink (default, zero-copy) keeps the source layout intact")
+    parser.add_argument("--workers", type=int, default=min(32, (os.cpu_count() or 1) * 4))
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would happen")
+    parser.add_argument("--no-checksums", action="store_true")
+    args = parser.parse_args()
+    csv_path, img_dir, output_dir = args.csv, args.images, args.out
+
+    # ===============================
+    # READ CSV + PLAN
+    # ===============================
+    df = pd.read_csv(csv_path)
+    print(f"✅ Found {len(df)} labeled images in CSV.")
+
+    plan = build_plan(df, args.id_col, args.label_col)
+    todo = plan[~plan["missing"] & ~plan["done"]]
+    n_done = int(plan["done"].sum())
+    n_missing = int(plan["missing"].sum())
+
+    print(f"📋 To {args.mode}: {len(todo)} | already organized: {n_done} | missing: {n_missing}")
+    if args.dry_run:
+        print(plan.loc[~plan["missing"], "class_dir"].value_counts().sort_index().to_string())
+        print("🧪 Dry run — no files touched.")
+        return
+
+    # ===============================
+    # CREATE OUTPUT FOLDERS + TRANSFER
+    # ===============================
+    for c in classes:
+        os.makedirs(os.path.join(output_dir, c), exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        jobs = pool.map(lambda sd: transfer(sd[0], sd[1], args.mode),
+                        zip(todo["src"], todo["dst"]))
+        for _ in tqdm(jobs, total=len(todo), desc=args.mode):
+            pass
+
+    # ===============================
+    # MANIFEST (checksums reused from the previous run where unchanged)
+    # ===============================
+    organized = plan[~plan["missing"]]
+    previous = load_manifest().get("files", {})
+    files = {}
+    if not args.no_checksums:
+        need = [r for r, s in zip(organized["rel"], organized["size"])
+                if previous.get(r, {}).get("size") != int(s)]
+        with ThreadPoolExecutor(max_workers=args.workers) as pool:
+            fresh = dict(zip(need, tqdm(
+                pool.map(lambda r: sha1sum(os.path.join(output_dir, r)), need),
+                total=len(need), desc="checksums"
+            )))
+        for r, s in zip(organized["rel"], organized["size"]):
+            files[r] = {"size": int(s), "sha1": fresh.get(r) or previous[r]["sha1"]}
+
+    counts = organized["class_dir"].value_counts().reindex(classes, fill_value=0)
+    manifest = {
+        "source": os.path.abspath(img_dir),
+        "mode": args.mode,
+        "total": int(len(organized)),
+        "missing": n_missing,
+        "class_counts": {c: int(n) for c, n in counts.items()},
+        "files": files,
+    }
+    with open(os.path.join(output_dir, manifest_name), "w") as f:
+        json.dump(manifest, f, indent=1)
+
+    # ===============================
+    # SUMMARY
+    # ===============================
+    print(f"\n✅ Dataset organized successfully!")
+    verb = {"hardlink": "hardlinked", "copy": "copied", "move": "moved"}[args.mode]
+    print(f"📦 {len(todo)} images {verb}, {n_done} already in place.")
+    for c, n in counts.items():
+        print(f"   {c}: {n}")
+    if n_missing > 0:
+        print(f"⚠️  {n_missing} images not found in {img_dir}")
+    else:
+        print("🎉 All images found and organized perfectly!")
+    print(f"🧾 Manifest written to {os.path.join(output_dir, manifest_name)}")
+
+
+if __name__ == "__main__":
+    main()
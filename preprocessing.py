@@ -0,0 +1,140 @@
+"""
+Ben Graham preprocessing with fundus circle crop, cached by content hash.
+
+Raw fundus photos carry wide black borders around the circular field of
+view. This stage crops to the field of view, applies Gaussian-blur local
+contrast normalization (Ben Graham's APTOS/EyePACS recipe), masks the
+corners and resizes. Results are written to a cache keyed by the SHA-1
+of the source file bytes plus the stage parameters, so every image is
+processed once across epochs and re-runs.
+
+Usage:
+    python preprocessing.py dataset/train      # warm the cache in parallel
+"""
+import hashlib
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+CACHE_DIR = os.path.join("dataset", ".preprocess_cache")
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+
+
+# ============================================================
+# Vectorized Image Operations
+# ============================================================
+def crop_to_fov(img, tol=7):
+    """Crop an RGB array to the bounding box of its non-black field of view."""
+    mask = img.max(axis=2) > tol
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    if rows.size == 0 or cols.size == 0:
+        return img  # entirely dark image: leave it for the quality gate
+    return img[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+
+def circle_mask(img, scale=0.95):
+    """Zero everything outside the inscribed circle (removes boundary ringing)."""
+    h, w = img.shape[:2]
+    yy, xx = np.ogrid[:h, :w]
+    radius = scale * min(h, w) / 2
+    inside = (yy - h / 2) ** 2 + (xx - w / 2) ** 2 <= radius ** 2
+    return img * inside[..., None].astype(img.dtype)
+
+
+def ben_graham(img, sigma_ratio=1 / 30):
+    """Local contrast normalization: 4*img - 4*GaussianBlur(img) + 128."""
+    sigma = max(img.shape[:2]) * sigma_ratio
+    blurred = cv2.GaussianBlur(img, (0, 0), sigma)
+    return cv2.addWeighted(img, 4, blurred, -4, 128)
+
+
+def preprocess_array(img, size=224):
+    """Full stage on an RGB uint8 array: crop, resize, normalize, mask."""
+    img = crop_to_fov(img)
+    img = cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA)
+    img = ben_graham(img)
+    return circle_mask(img)
+
+
+# ============================================================
+# Cached Preprocessor
+# ============================================================
+class FundusPreprocessor:
+    """Loads images through the preprocessing stage and its on-disk cache.
+
+    ``load`` returns a PIL image and can be passed straight to
+    ``datasets.ImageFolder(loader=...)``; ``load_array`` returns an RGB
+    array for cv2-based datasets.
+    """
+
+    def __init__(self, size=224, cache_dir=CACHE_DIR):
+        self.size = size
+        self.cache_dir = cache_dir
+        self.tag = f"bg-v1-{size}"
+        # (path, size, mtime) -> content key, so unchanged files are not re-hashed
+        self._keys = {}
+
+    def _key(self, path):
+        st = os.stat(path)
+        memo = (path, st.st_size, st.st_mtime_ns)
+        key = self._keys.get(memo)
+        if key is None:
+            h = hashlib.sha1(self.tag.encode())
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            key = h.hexdigest()
+            self._keys[memo] = key
+        return key
+
+    def _cache_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".png")
+
+    def load_array(self, path):
+        cached = self._cache_path(self._key(path))
+        if os.path.exists(cached):
+            img = cv2.imread(cached, cv2.IMREAD_COLOR)
+            if img is not None:
+                return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        raw = cv2.imread(path, cv2.IMREAD_COLOR)
+        if raw is None:
+            raise ValueError(f"Could not decode image: {path}")
+        out = preprocess_array(cv2.cvtColor(raw, cv2.COLOR_BGR2RGB), self.size)
+
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        tmp = cached + f".{os.getpid()}-{threading.get_ident()}.tmp.png"
+        cv2.imwrite(tmp, cv2.cvtColor(out, cv2.COLOR_RGB2BGR))
+        os.replace(tmp, cached)  # atomic: concurrent workers never see a partial file
+        return out
+
+    def load(self, path):
+        return Image.fromarray(self.load_array(path))
+
+    def warm_cache(self, paths, workers=None):
+        """Preprocess many images in parallel threads (OpenCV releases the GIL)."""
+        workers = workers or os.cpu_count()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in pool.map(self.load_array, paths):
+                pass
+
+
+# ============================================================
+# Main
+# ============================================================
+if __name__ == "__main__":
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.join("dataset", "train")
+    paths = [
+        os.path.join(d, f)
+        for d, _, files in os.walk(root)
+        for f in files if f.lower().endswith(IMAGE_EXTS)
+    ]
+    print(f"🧼 Preprocessing {len(paths)} images from {root} ...")
+    FundusPreprocessor().warm_cache(paths)
+    print(f"✅ Cache ready at {CACHE_DIR}")
@@ -0,0 +1,129 @@
+"""
+Fast image-quality gate run before the model.
+
+Decodes a reduced-resolution copy of the upload and computes, in a few
+milliseconds: sharpness (variance of the Laplacian on a downscaled gray
+image), exposure (histogram mass in the dark and saturated tails plus
+mean brightness) and field-of-view geometry (how much of the frame the
+bright region covers and how circular it is). Images are classified as
+``ok``, ``flag`` (gradable but poor) or ``reject`` (ungradable, or not a
+fundus photo judging by geometry and its red-dominant colour profile),
+so blurred or non-fundus uploads never reach the ResNet152.
+"""
+import cv2
+import numpy as np
+
+# ============================================================
+# Thresholds (tuned for 512 px analysis size)
+# ============================================================
+ANALYSIS_SIZE = 512
+SHARPNESS_REJECT = 6.0      # Laplacian variance below this: hopelessly blurred
+SHARPNESS_FLAG = 20.0
+DARK_FLAG = 0.60            # share of FOV pixels in the darkest 10% of range
+BRIGHT_FLAG = 0.20          # share of FOV pixels saturated
+MEAN_REJECT = (20, 235)     # mean FOV brightness outside this is unusable
+FOV_MIN = 0.25              # fundus disc must cover at least this much of the frame
+CIRCULARITY_MIN = 0.70      # IoU of FOV mask with its fitted ellipse
+FOV_THRESHOLD = 15          # gray level separating the disc from the black border
+RED_BLUE_MIN = 1.2          # fundus photos are red-dominant: mean R >= G and >= 1.2 * B
+
+
+class UngradableImageError(ValueError):
+    """Raised when an upload fails the quality gate."""
+
+    def __init__(self, quality):
+        self.quality = quality
+        super().__init__("Ungradable image: " + "; ".join(quality["reasons"]))
+
+
+def _load(image):
+    """Reduced-resolution RGB decode (JPEG decodes at 1/4 scale directly)."""
+    if isinstance(image, np.ndarray):
+        return image
+    img = cv2.imread(image, cv2.IMREAD_REDUCED_COLOR_4)
+    if img is None or min(img.shape[:2]) < 256:
+        img = cv2.imread(image, cv2.IMREAD_COLOR)  # small upload: keep full detail
+    if img is None:
+        raise ValueError(f"Could not decode image: {image}")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def assess(image):
+    """Quality scores and verdict for a path or RGB array.
+
+    Returns a dict with ``status`` (``ok``/``flag``/``reject``),
+    ``reasons`` and the raw scores ``sharpness``, ``exposure``,
+    ``brightness``, ``fov_ratio``, ``circularity`` and ``red_ratio``.
+    """
+    rgb = _load(image)
+    scale = ANALYSIS_SIZE / max(rgb.shape[:2])
+    if scale < 1:
+        rgb = cv2.resize(rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+
+    # Field of view: bright region vs. the black camera border
+    fov = gray > FOV_THRESHOLD
+    fov_ratio = float(fov.mean())
+    circularity = 0.0
+    if fov.any():
+        rows = np.flatnonzero(fov.any(axis=1))
+        cols = np.flatnonzero(fov.any(axis=0))
+        cy, cx = (rows[0] + rows[-1]) / 2, (cols[0] + cols[-1]) / 2
+        ry, rx = max((rows[-1] - rows[0]) / 2, 1), max((cols[-1] - cols[0]) / 2, 1)
+        yy, xx = np.ogrid[:gray.shape[0], :gray.shape[1]]
+        ellipse = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 <= 1
+        circularity = float((fov & ellipse).sum() / max((fov | ellipse).sum(), 1))
+
+    # Exposure inside the FOV (histogram tails)
+    inside = gray[fov] if fov.any() else gray.ravel()
+    hist = np.bincount(inside, minlength=256) / max(inside.size, 1)
+    dark = float(hist[:26].sum())
+    bright = float(hist[250:].sum())
+    brightness = float(inside.mean()) if inside.size else 0.0
+    red, green, blue = (rgb[fov] if fov.any() else rgb.reshape(-1, 3)).mean(axis=0)
+
+    # Sharpness: Laplacian variance over the FOV only (the border edge is not detail)
+    lap = cv2.Laplacian(gray, cv2.CV_32F)
+    sharpness = float(lap[cv2.erode(fov.astype(np.uint8), np.ones((9, 9), np.uint8)) > 0].var()) \
+        if fov.sum() > 100 else float(lap.var())
+
+    reasons, status = [], "ok"
+
+    def reject(msg):
+        nonlocal status
+        reasons.append(msg)
+        status = "reject"
+
+    def flag(msg):
+        nonlocal status
+        reasons.append(msg)
+        if status == "ok":
+            status = "flag"
+
+    if fov_ratio < FOV_MIN:
+        reject("no fundus field of view detected")
+    elif circularity < CIRCULARITY_MIN and fov_ratio < 0.97:
+        reject("field of view is not circular (not a fundus photo?)")
+    if red < green or red < RED_BLUE_MIN * blue:
+        reject("colour profile does not match a fundus photo")
+    if not MEAN_REJECT[0] <= brightness <= MEAN_REJECT[1]:
+        reject("severely under- or over-exposed")
+    if sharpness < SHARPNESS_REJECT:
+        reject("image is too blurred")
+    elif sharpness < SHARPNESS_FLAG:
+        flag("image is soft / slightly blurred")
+    if dark > DARK_FLAG:
+        flag("under-exposed")
+    if bright > BRIGHT_FLAG:
+        flag("over-exposed / glare")
+
+    return {
+        "status": status,
+        "reasons": reasons,
+        "sharpness": sharpness,
+        "exposure": 1.0 - dark - bright,
+        "brightness": brightness,
+        "fov_ratio": fov_ratio,
+        "circularity": circularity,
+        "red_ratio": float(red / max(blue, 1.0)),
+    }
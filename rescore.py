@@ -0,0 +1,303 @@
+"""
+Background re-scoring of historical scans after a model upgrade.
+
+Every scan records the ``model_version`` that graded it: a hash of the
+checkpoints, calibration files, TTA views and preprocessing in use (see
+``checkpoints.serving_version``). When any of them changes, this
+scheduler re-grades older scans with the new setup and adds their new
+embeddings to that version's similar-case index:
+
+* most informative first: scans are ordered by how close they are to
+  a decision, i.e. the lower of the old top-class confidence and the
+  distance of P(Moderate or worse) from 0.5 (the referral boundary),
+  computed once per pass over the stale scans and then paged through;
+* from the image store's 224 px model-input derivative, so originals are
+  never decoded again (originals only for Ben Graham checkpoints);
+* only while live screening is idle (no pending/running scan jobs and a
+  low load average), at lowest OS priority, on one thread, and with a
+  duty cycle that sleeps between batches;
+* every change is logged to ``scan_rescores``, and scans newly crossing
+  into referral get a notification queued;
+* a scan the new model cannot grade gets a ``scan_rescores`` row with
+  its ``error`` and is not retried for that model version.
+
+``report`` prints the grade transition matrix and referral flips.
+
+Usage:
+    python rescore.py run --batch 16 --duty 0.25
+    python rescore.py report
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+import notifications
+import scan_queue
+import similar_cases
+from calibration import pack_probs, unpack_probs
+from image_store import ImageStore
+from patient_grading import REFERRAL_GRADE
+
+CLASSES = ["No DR", "Mild", "Moderate", "Severe", "Proliferative DR"]
+
+
+def ensure_schema(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scan_rescores (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        scan_id INTEGER NOT NULL,
+        old_version TEXT,
+        new_version TEXT,
+        old_grade INTEGER,
+        new_grade INTEGER,
+        old_confidence REAL,
+        new_confidence REAL,
+        rescored_at TEXT
+    )
+    """)
+    # Failed attempts: new_grade is NULL and error says why
+    scan_queue.ensure_column(conn, "scan_rescores", "error", "TEXT")
+    conn.commit()
+
+
+# ============================================================
+# Prioritization
+# ============================================================
+def priority(confidence, probs):
+    """Lower = re-score sooner: uncertain or near the referral boundary."""
+    confidence = np.asarray(confidence, dtype=np.float64) / 100.0
+    p_refer = probs[:, REFERRAL_GRADE:].sum(axis=1)
+    return np.minimum(confidence, 2 * np.abs(p_refer - 0.5))
+
+
+STALE = ("image_hash IS NOT NULL AND probs IS NOT NULL "
+         "AND (model_version IS NULL OR model_version != ?) "
+         "AND id NOT IN (SELECT scan_id FROM scan_rescores "
+         "WHERE new_version = ? AND error IS NOT NULL)")
+
+
+def stale_order(conn, version, chunk=10000):
+    """Ids of scans from other model versions, by priority (one pass over their probs).
+
+    Scans that already failed under ``version`` are skipped.
+    """
+    cursor = conn.execute(f"SELECT id, confidence, probs FROM scans WHERE {STALE}",
+                          (version, version))
+    ids, keys = [], []
+    while True:
+        rows = cursor.fetchmany(chunk)
+        if not rows:
+            break
+        ids.append(np.array([r[0] for r in rows], dtype=np.int64))
+        keys.append(priority([r[1] or 0 for r in rows], unpack_probs([r[2] for r in rows])))
+    if not ids:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(ids)[np.argsort(np.concatenate(keys), kind="stable")]
+
+
+def stale_scans(conn, version, ids):
+    """``(scan_id, image_hash)`` of the ``ids`` still stale, in the given order."""
+    ids = [int(i) for i in ids]
+    rows = dict(conn.execute(
+        f"SELECT id, image_hash FROM scans WHERE id IN ({','.join('?' * len(ids))}) "
+        f"AND {STALE}", (*ids, version, version)
+    ).fetchall()) if ids else {}
+    return [(i, rows[i]) for i in ids if i in rows]
+
+
+# ============================================================
+# Throttling
+# ============================================================
+def is_idle(conn, max_load=None):
+    """No live analysis queued or running, and (where known) a low 1-minute load."""
+    depth = scan_queue.queue_depth(conn)
+    if depth["pending"] or depth["running"]:
+        return False
+    if max_load is not None and hasattr(os, "getloadavg"):
+        return os.getloadavg()[0] < max_load
+    return True
+
+
+def lower_priority():
+    """Lowest CPU priority, one intra-op thread: never compete with live screening."""
+    import torch
+
+    torch.set_num_threads(1)
+    if hasattr(os, "nice"):
+        try:
+            os.nice(19)
+        except OSError:
+            pass
+
+
+# ============================================================
+# Re-scoring
+# ============================================================
+def rescore_batch(conn, engine, store, scans):
+    """Re-grade ``[(scan_id, image_hash)]`` and update them in one transaction.
+
+    Returns ``(grade changes, failures)``; failures are logged to ``scan_rescores``.
+    """
+    kind = "original" if getattr(engine, "preprocessor", None) is not None else "model"
+    paths, missing = [], {}
+    for scan_id, h in scans:
+        path = store.path(h, kind)
+        if not os.path.exists(path):
+            try:
+                store.open(h, kind).close()  # rebuild a missing derivative once
+            except OSError as e:
+                missing[scan_id] = e         # original deleted or unreadable
+                continue
+        paths.append(path)
+    # These images already passed the quality gate when first scored
+    scored = iter(engine.predict_batch(paths, qualities=[{"status": "ok"}] * len(paths))
+                  if paths else [])
+    results = [missing[scan_id] if scan_id in missing else next(scored) for scan_id, _ in scans]
+
+    now = datetime.now().isoformat(timespec="seconds")
+    changed = failed = 0
+    updated = []
+    with scan_queue.immediate(conn):
+        for (scan_id, _), result in zip(scans, results):
+            old = conn.execute("SELECT diagnosis, confidence, model_version, patient_id "
+                               "FROM scans WHERE id = ?", (scan_id,)).fetchone()
+            if old is None:
+                continue  # deleted since it was picked
+            old_grade = CLASSES.index(old[0]) if old[0] in CLASSES else None
+            if isinstance(result, Exception):
+                # Keep the old grade; stale_scans skips it until the model changes
+                conn.execute(
+                    "INSERT INTO scan_rescores (scan_id, old_version, new_version, old_grade, "
+                    "old_confidence, rescored_at, error) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (scan_id, old[2], engine.MODEL_VERSION, old_grade, old[1], now,
+                     f"{type(result).__name__}: {result}"[:500])
+                )
+                failed += 1
+                continue
+            conn.execute(
+                "UPDATE scans SET diagnosis = ?, confidence = ?, probs = ?, model_version = ? "
+                "WHERE id = ?",
+                (result["stage"], round(100 * result["confidence"], 2),
+                 pack_probs(result["probs"]), result["model_version"], scan_id)
+            )
+            conn.execute(
+                "INSERT INTO scan_rescores (scan_id, old_version, new_version, old_grade, "
+                "new_grade, old_confidence, new_confidence, rescored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (scan_id, old[2], result["model_version"], old_grade, result["value"],
+                 old[1], round(100 * result["confidence"], 2), now)
+            )
+            updated.append((scan_id, result))
+            if old_grade != result["value"]:
+                changed += 1
+            # Newly referable under the new model: alert like a fresh scan
+            if old_grade is not None and old_grade < REFERRAL_GRADE <= result["value"]:
+                notifications.enqueue_referral(conn, scan_id, old[3], result["stage"],
+                                               result["value"])
+    # New embeddings for the similar-case index
+    similar_cases.index_results([scan_id for scan_id, _ in updated], [r for _, r in updated])
+    return changed, failed
+
+
+def run(db_path=scan_queue.DB_NAME, batch_size=16, duty=0.25, max_load=None, poll=30.0,
+        once=False, engine=None):
+    """Re-score stale scans in idle time until none are left (then keep watching unless ``once``)."""
+    lower_priority()
+    if engine is None:
+        import create_dummy_classifier as engine
+    conn = scan_queue.connect(db_path)
+    ensure_schema(conn)
+    store = ImageStore()
+    done = changed = failed = 0
+    backlog, pos = np.empty(0, dtype=np.int64), 0   # prioritized once per pass, then paged
+    print(f"🔁 Re-scoring scans to model {engine.MODEL_VERSION} (duty cycle {duty:.0%})")
+    try:
+        while True:
+            if not is_idle(conn, max_load):
+                time.sleep(poll)
+                continue
+            if pos >= len(backlog):
+                backlog, pos = stale_order(conn, engine.MODEL_VERSION), 0
+                if not len(backlog):
+                    if once:
+                        break
+                    time.sleep(poll)
+                    continue
+            scans = stale_scans(conn, engine.MODEL_VERSION, backlog[pos:pos + batch_size])
+            pos += batch_size
+            if not scans:
+                continue
+            start = time.perf_counter()
+            batch_changed, batch_failed = rescore_batch(conn, engine, store, scans)
+            changed += batch_changed
+            failed += batch_failed
+            done += len(scans) - batch_failed
+            elapsed = time.perf_counter() - start
+            print(f"🔁 {done} re-scored, {changed} grade changes, {failed} failed "
+                  f"({elapsed:.1f}s batch)")
+            # Sleep so re-scoring uses at most ``duty`` of one core over time
+            time.sleep(elapsed * (1 - duty) / duty)
+    except KeyboardInterrupt:
+        print("🛑 Re-scoring paused")
+    finally:
+        conn.close()
+    return done, changed
+
+
+# ============================================================
+# Grade-change Report
+# ============================================================
+def report(db_path=scan_queue.DB_NAME, new_version=None):
+    """Print and return the old->new grade transition matrix for a model version."""
+    conn = scan_queue.connect(db_path)
+    ensure_schema(conn)
+    if new_version is None:
+        row = conn.execute("SELECT new_version FROM scan_rescores ORDER BY id DESC LIMIT 1").fetchone()
+        if row is None:
+            print("No re-scoring has run yet")
+            return None
+        new_version = row[0]
+    pairs = np.array(conn.execute(
+        "SELECT old_grade, new_grade FROM scan_rescores WHERE new_version = ? "
+        "AND old_grade IS NOT NULL AND new_grade IS NOT NULL", (new_version,)
+    ).fetchall(), dtype=np.int64).reshape(-1, 2)
+    failed = conn.execute("SELECT COUNT(DISTINCT scan_id) FROM scan_rescores "
+                          "WHERE new_version = ? AND error IS NOT NULL", (new_version,)).fetchone()[0]
+    n = len(CLASSES)
+    matrix = np.bincount(pairs[:, 0] * n + pairs[:, 1], minlength=n * n).reshape(n, n)
+
+    total = int(matrix.sum())
+    unchanged = int(np.trace(matrix))
+    up = int(matrix[:REFERRAL_GRADE, REFERRAL_GRADE:].sum())
+    down = int(matrix[REFERRAL_GRADE:, :REFERRAL_GRADE].sum())
+    print(f"📊 Model {new_version}: {total} scans re-scored, "
+          f"{total - unchanged} grade changes ({(total - unchanged) / max(total, 1):.1%})")
+    print(f"   Newly referable: {up} | no longer referable: {down} | could not re-score: {failed}")
+    print("   old \\ new  " + " ".join(f"{c[:8]:>8}" for c in CLASSES))
+    for i, c in enumerate(CLASSES):
+        print(f"   {c[:10]:<10} " + " ".join(f"{v:>8}" for v in matrix[i]))
+    conn.close()
+    return {"matrix": matrix, "total": total, "changed": total - unchanged,
+            "newly_referable": up, "no_longer_referable": down, "failed": failed}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score historical scans with the current model")
+    parser.add_argument("--db", default=scan_queue.DB_NAME)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="Re-score in idle time")
+    p_run.add_argument("--batch", type=int, default=16)
+    p_run.add_argument("--duty", type=float, default=0.25, help="max share of one core to use")
+    p_run.add_argument("--max-load", type=float, default=None, help="only run below this load avg")
+    p_run.add_argument("--once", action="store_true", help="exit when nothing is left")
+    p_report = sub.add_parser("report", help="Grade-change statistics")
+    p_report.add_argument("--version", default=None)
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run(args.db, args.batch, args.duty, args.max_load, once=args.once)
+    else:
+        report(args.db, args.version)
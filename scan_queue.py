@@ -0,0 +1,359 @@
+"""
+Durable scan job queue stored in ``retinal_ai.db``.
+
+Every analysis is a row in ``scan_jobs`` before any model runs, so a scan
+survives the app closing mid-analysis. Jobs move through
+``pending -> running -> done | failed``. A claim takes a time-limited
+lease. A worker that dies simply lets its lease expire, and the job goes
+back to ``pending``, or to ``failed`` once ``max_attempts`` is used up.
+Failed attempts are retried with exponential backoff.
+
+Claims run in ``BEGIN IMMEDIATE`` transactions on a WAL-mode database, so
+any number of worker processes (on one workstation, or several machines
+sharing the database file) can pull batches safely.
+
+Usage:
+    python scan_queue.py worker --batch 8
+    python scan_queue.py status
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import notifications
+import similar_cases
+from calibration import pack_probs
+
+DB_NAME = "retinal_ai.db"
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF = 30          # seconds before the first retry, doubled per attempt
+STATES = ("pending", "running", "done", "failed")
+
+
+# ============================================================
+# Schema + Connections
+# ============================================================
+# Columns added to scans after the original six, oldest first
+SCAN_COLUMNS = [
+    ("probs", "BLOB"),              # softmax vector, packed float16 (calibration.pack_probs)
+    ("cam_path", "TEXT"),           # cached Grad-CAM overlay (gradcam.py)
+    ("quality_status", "TEXT"),     # image-quality gate scores (quality_gate.py)
+    ("sharpness", "REAL"),
+    ("exposure", "REAL"),
+    ("fov_ratio", "REAL"),
+    ("image_hash", "TEXT"),         # SHA-256 in the content-addressed store (image_store.py)
+    ("visit_id", "TEXT"),           # links both eyes of a visit (patient_grading.py)
+    ("model_version", "TEXT"),      # checkpoint that produced the grade (rescore.py)
+]
+
+
+def ensure_column(conn, table, column, decl):
+    """Add a column to an existing table (CREATE TABLE IF NOT EXISTS won't)."""
+    if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def ensure_schema(conn):
+    """Create/migrate ``scans`` and create the queue tables; safe on any older database."""
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        eye TEXT,
+        diagnosis TEXT,
+        confidence REAL,
+        scan_date TEXT
+    )
+    """)
+    for column, decl in SCAN_COLUMNS:
+        ensure_column(conn, "scans", column, decl)
+
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS scan_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        patient_id TEXT,
+        eye TEXT,
+        image_path TEXT NOT NULL,
+        image_hash TEXT,
+        quality TEXT,
+        state TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 3,
+        lease_owner TEXT,
+        lease_expires REAL,
+        not_before REAL NOT NULL DEFAULT 0,
+        error TEXT,
+        scan_id INTEGER,
+        visit_id TEXT,
+        created_at TEXT,
+        updated_at TEXT
+    )
+    """)
+    # Databases created before paired-eye visits lack visit_id
+    ensure_column(conn, "scan_jobs", "visit_id", "TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_jobs_state "
+                 "ON scan_jobs (state, not_before, id)")
+    conn.commit()
+    notifications.ensure_schema(conn)
+
+
+def connect(db_path=DB_NAME, timeout=30.0):
+    """Autocommit connection for queue workers (transactions are explicit)."""
+    conn = sqlite3.connect(db_path, timeout=timeout, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    ensure_schema(conn)
+    return conn
+
+
+@contextmanager
+def immediate(conn):
+    """Write transaction that takes the lock up front, so claims never race."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+# ============================================================
+# Queue Operations
+# ============================================================
+def enqueue(conn, patient_id, image_path, eye=None, image_hash=None, quality=None,
+            claim_as=None, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+            visit_id=None):
+    """Add a job and return its id.
+
+    With ``claim_as`` the job is inserted already leased to that worker, so
+    the caller can process it at once without a headless worker racing for
+    it; if the caller dies, the lease expires and the job is picked up later.
+    ``visit_id`` links the two eyes of one patient visit.
+    """
+    state, attempts, expires = ("running", 1, time.time() + lease_seconds) if claim_as \
+        else ("pending", 0, None)
+    cursor = conn.execute(
+        "INSERT INTO scan_jobs (patient_id, eye, image_path, image_hash, quality, state, "
+        "attempts, max_attempts, lease_owner, lease_expires, visit_id, created_at, updated_at) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (patient_id, eye, image_path, image_hash, json.dumps(quality) if quality else None,
+         state, attempts, max_attempts, claim_as, expires, visit_id, _now(), _now())
+    )
+    conn.commit()
+    return cursor.lastrowid
+
+
+def _expire_leases(conn, now):
+    conn.execute(
+        "UPDATE scan_jobs SET state = CASE WHEN attempts >= max_attempts THEN 'failed' "
+        "ELSE 'pending' END, error = 'lease expired', lease_owner = NULL, "
+        "lease_expires = NULL, updated_at = ? "
+        "WHERE state = 'running' AND lease_expires < ?", (_now(), now)
+    )
+
+
+def claim(conn, owner, batch_size=8, lease_seconds=LEASE_SECONDS):
+    """Lease up to ``batch_size`` runnable jobs (oldest first) to ``owner``."""
+    now = time.time()
+    with immediate(conn):
+        _expire_leases(conn, now)
+        rows = conn.execute(
+            "SELECT id FROM scan_jobs WHERE state = 'pending' AND not_before <= ? "
+            "ORDER BY id LIMIT ?", (now, batch_size)
+        ).fetchall()
+        ids = [r[0] for r in rows]
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        conn.execute(
+            f"UPDATE scan_jobs SET state = 'running', attempts = attempts + 1, "
+            f"lease_owner = ?, lease_expires = ?, updated_at = ? WHERE id IN ({marks})",
+            (owner, now + lease_seconds, _now(), *ids)
+        )
+        return conn.execute(f"SELECT * FROM scan_jobs WHERE id IN ({marks}) ORDER BY id",
+                            ids).fetchall()
+
+
+def renew(conn, job_ids, owner, lease_seconds=LEASE_SECONDS):
+    """Extend leases still held by ``owner``; returns how many were extended."""
+    marks = ",".join("?" * len(job_ids))
+    return conn.execute(
+        f"UPDATE scan_jobs SET lease_expires = ? WHERE lease_owner = ? "
+        f"AND state = 'running' AND id IN ({marks})",
+        (time.time() + lease_seconds, owner, *job_ids)
+    ).rowcount
+
+
+def get_job(conn, job_id):
+    return conn.execute("SELECT * FROM scan_jobs WHERE id = ?", (job_id,)).fetchone()
+
+
+def insert_scan(conn, job, result, owner, notify_to=None):
+    """Scan row + job completion + referral alert; caller holds the transaction.
+
+    ``notify_to`` overrides the alert recipients (``[]`` queues none).
+    Returns the scan id, or None if ``owner`` lost the lease.
+    """
+    quality = result.get("quality") or (json.loads(job["quality"]) if job["quality"] else {})
+    done = conn.execute(
+        "UPDATE scan_jobs SET state = 'done', lease_owner = NULL, lease_expires = NULL, "
+        "error = NULL, updated_at = ? WHERE id = ? AND state = 'running' AND lease_owner = ?",
+        (_now(), job["id"], owner)
+    ).rowcount
+    if not done:
+        return None
+    scan_id = conn.execute(
+        "INSERT INTO scans (patient_id, eye, diagnosis, confidence, scan_date, probs, "
+        "quality_status, sharpness, exposure, fov_ratio, image_hash, visit_id, model_version) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (job["patient_id"], job["eye"], result["stage"],
+         round(100 * result["confidence"], 2), _now(), pack_probs(result["probs"]),
+         quality.get("status"), quality.get("sharpness"), quality.get("exposure"),
+         quality.get("fov_ratio"), job["image_hash"], job["visit_id"],
+         result.get("model_version"))
+    ).lastrowid
+    conn.execute("UPDATE scan_jobs SET scan_id = ? WHERE id = ?", (scan_id, job["id"]))
+    # Referral alerts go out via the outbox worker, never inline
+    notifications.enqueue_referral(conn, scan_id, job["patient_id"], result["stage"],
+                                   result["value"], to=notify_to)
+    return scan_id
+
+
+def record_result(conn, job, result, owner):
+    """Insert the scan, mark the job done and queue any referral alert in one transaction.
+
+    Returns the new scan id, or ``None`` if ``owner`` no longer holds the
+    lease (another worker took the job over; its result wins). Once committed,
+    the scan's embedding goes into the similar-case index.
+    """
+    with immediate(conn):
+        scan_id = insert_scan(conn, job, result, owner)
+    similar_cases.index_results([scan_id], [result])
+    return scan_id
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def record_results(conn, jobs, results, owner):
+    """All-or-nothing ``record_result`` for related jobs (e.g. both eyes of a visit).
+
+    Entries of ``results`` that are exceptions fail their job (ungradable
+    images permanently) in the same transaction. Returns the scan ids
+    (``None`` for failed jobs), or ``None`` if any lease was lost, in which
+    case nothing is written.
+    """
+    scan_ids = []
+    try:
+        with immediate(conn):
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    fail(conn, job, owner, result, retry=not isinstance(result, ValueError))
+                    scan_ids.append(None)
+                    continue
+                scan_id = insert_scan(conn, job, result, owner)
+                if scan_id is None:
+                    raise LeaseLost(job["id"])
+                scan_ids.append(scan_id)
+    except LeaseLost:
+        return None
+    similar_cases.index_results(scan_ids, results)
+    return scan_ids
+
+
+def fail(conn, job, owner, error, retry=True, backoff=RETRY_BACKOFF):
+    """Release a job after an error: back to pending with backoff, or failed."""
+    permanent = not retry or job["attempts"] >= job["max_attempts"]
+    conn.execute(
+        "UPDATE scan_jobs SET state = ?, error = ?, lease_owner = NULL, lease_expires = NULL, "
+        "not_before = ?, updated_at = ? WHERE id = ? AND lease_owner = ?",
+        ("failed" if permanent else "pending", str(error)[:500],
+         time.time() + backoff * 2 ** max(job["attempts"] - 1, 0), _now(), job["id"], owner)
+    )
+
+
+def queue_depth(conn):
+    """Job count per state."""
+    counts = dict(conn.execute("SELECT state, COUNT(*) FROM scan_jobs GROUP BY state"))
+    return {state: counts.get(state, 0) for state in STATES}
+
+
+# ============================================================
+# Headless Worker
+# ============================================================
+def run_worker(db_path=DB_NAME, batch_size=8, lease_seconds=LEASE_SECONDS, poll=2.0,
+               once=False, engine=None):
+    """Claim batches and score them until interrupted (or the queue is empty with ``once``)."""
+    if engine is None:
+        import create_dummy_classifier as engine
+    conn = connect(db_path)
+    owner = worker_id()
+    print(f"👷 Worker {owner} polling {db_path}")
+    try:
+        while True:
+            jobs = claim(conn, owner, batch_size, lease_seconds)
+            if not jobs:
+                if once:
+                    break
+                time.sleep(poll)
+                continue
+            start = time.perf_counter()
+            qualities = [json.loads(j["quality"]) if j["quality"] else None for j in jobs]
+            try:
+                results = engine.predict_batch([j["image_path"] for j in jobs],
+                                               qualities=qualities)
+            except Exception as e:
+                # e.g. RuntimeError / out of memory: release the batch for retry, keep polling
+                print(f"⚠️ Batch of {len(jobs)} failed: {type(e).__name__}: {e}")
+                for job in jobs:
+                    fail(conn, job, owner, e)
+                continue
+            done = 0
+            for job, result in zip(jobs, results):
+                if isinstance(result, Exception):
+                    # Ungradable or unreadable images will not improve on retry
+                    fail(conn, job, owner, result, retry=not isinstance(result, ValueError))
+                elif record_result(conn, job, result, owner) is not None:
+                    done += 1
+            print(f"✅ {done}/{len(jobs)} jobs done in {time.perf_counter() - start:.2f}s "
+                  f"| queue {queue_depth(conn)}")
+    except KeyboardInterrupt:
+        print("🛑 Worker stopped")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Durable scan job queue")
+    parser.add_argument("--db", default=DB_NAME)
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_worker = sub.add_parser("worker", help="Run a headless inference worker")
+    p_worker.add_argument("--batch", type=int, default=8)
+    p_worker.add_argument("--lease", type=float, default=LEASE_SECONDS)
+    p_worker.add_argument("--poll", type=float, default=2.0)
+    p_worker.add_argument("--once", action="store_true", help="exit when the queue is empty")
+    sub.add_parser("status", help="Show job counts per state")
+    args = parser.parse_args()
+
+    if args.command == "worker":
+        run_worker(args.db, args.batch, args.lease, args.poll, args.once)
+    else:
+        db = connect(args.db)
+        print(" | ".join(f"{k}: {v}" for k, v in queue_depth(db).items()))
@@ -1,5 +1,8 @@
 from twilio.rest import Client
 
+# Superseded by notifications.py: referral SMS now go through a batched,
+# retried outbox worker instead of one blocking send per prediction.
+
 #--------------------------------------------------------
 # change values of account_sid, auth_token, to and from - all from twilio account
 #-------------------------------------------------------
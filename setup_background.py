@@ -7,10 +7,15 @@ Place your medical professional background image in the assets folder as:
 - assets/bg_eye.png
 
 The app will automatically detect and use it.
+
+It then builds the resolution renditions the resizable app picks from
+(assets/renditions/, see ui_assets.py).
 """
 import os
 from PIL import Image
 
+from ui_assets import BACKGROUND_SIZES, RENDITIONS_DIR, rendition_path
+
 def check_background_images():
     """Check if background images exist"""
     bg_paths = [
@@ -38,6 +43,7 @@ def check_background_images():
                     if not os.path.exists(new_path):
                         img.save(new_path, 'JPEG', quality=85)
                         print(f"  -> Created optimized version: {new_path}")
+                    bg_path = new_path
                 break
             except Exception as e:
                 print(f"[ERROR] Error reading {bg_path}: {e}")
@@ -51,7 +57,22 @@ def check_background_images():
         print("  - assets/bg_eye.png")
     else:
         print("\n[OK] Background image is ready!")
+    return bg_path if found else None
+
+def build_renditions(source="assets/medical_background.jpg", name="medical_background"):
+    """Resize the background once per supported screen size"""
+    os.makedirs(RENDITIONS_DIR, exist_ok=True)
+    img = Image.open(source).convert('RGB')
+    if img.size[0] < BACKGROUND_SIZES[-1][0]:
+        print(f"[WARN] {source} is {img.size[0]}x{img.size[1]}; larger renditions are upscaled")
+    for size in BACKGROUND_SIZES:
+        path = rendition_path(name, size)
+        img.resize(size, Image.Resampling.LANCZOS).save(path, 'JPEG', quality=85, optimize=True)
+        print(f"  -> {path}")
+    print(f"[OK] {len(BACKGROUND_SIZES)} background renditions built")
 
 if __name__ == "__main__":
     os.makedirs("assets", exist_ok=True)
-    check_background_images()
+    found = check_background_images()
+    if found:
+        build_renditions(found)
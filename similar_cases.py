@@ -0,0 +1,287 @@
+"""
+Similar-case retrieval over penultimate-layer embeddings.
+
+Every scored scan contributes the 512-d output of the first
+``nn.Linear(num_ftrs, 512)`` in the classifier head. Embeddings are
+L2-normalized and appended as float16 to an on-disk matrix. Search uses
+an inverted-file (IVF) index in pure NumPy: a k-means coarse quantizer
+assigns each vector to one of ``nlist`` lists, and a query scans only
+the ``nprobe`` closest lists. New scans are assigned to their nearest
+list on insert, so the index grows without a rebuild. Until enough
+vectors exist to train the quantizer, search is exact brute force.
+
+The app, headless workers and rescoring all append to the same files
+(see ``scan_queue.record_result``): appends hold an exclusive lock file
+and first pick up rows other processes wrote. A torn append (vectors,
+ids, labels and lists at different lengths) is truncated back to the
+last complete row on load.
+
+Embeddings from different models live in different spaces, so each
+``model_version`` gets its own index under ``INDEX_DIR/<version>/``;
+after an upgrade, rescore.py fills the new one as it re-grades scans.
+"""
+import os
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:     # Windows
+    fcntl = None
+    import msvcrt
+
+INDEX_DIR = "similar_index"
+DIM = 512
+
+
+# ============================================================
+# Embedding Capture
+# ============================================================
+class EmbeddingHook:
+    """Records the output of ``model.fc[0]`` (the 512-d projection) on each forward."""
+
+    def __init__(self, model):
+        self.last = None
+        self.handle = model.fc[0].register_forward_hook(self._save)
+
+    def _save(self, module, inputs, output):
+        self.last = output.detach()
+
+    def pop(self):
+        """Mean embedding of the last forward (averages TTA views), then clear."""
+        if self.last is None:
+            return None
+        emb = self.last.float().mean(dim=0).cpu().numpy()
+        self.last = None
+        return emb
+
+
+# ============================================================
+# K-means (coarse quantizer)
+# ============================================================
+def kmeans(x, k, iters=20, seed=0):
+    """Spherical k-means on unit vectors; returns (k, D) unit centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].astype(np.float32)
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]  # re-seed empty lists
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True).clip(1e-8)
+    return centroids
+
+
+# ============================================================
+# IVF Index
+# ============================================================
+class SimilarCaseIndex:
+    """Append-only float16 embedding store with an incremental IVF index."""
+
+    def __init__(self, index_dir=INDEX_DIR, dim=DIM, nlist=1024, nprobe=8, min_train=None):
+        self.dir = index_dir
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.min_train = min_train or 40 * nlist
+        os.makedirs(index_dir, exist_ok=True)
+
+        self._paths = {name: os.path.join(index_dir, name) for name in
+                       ("vectors.f16", "ids.i64", "labels.i8", "lists.i32", "centroids.npy",
+                        "lock")}
+        self._row_bytes = {"vectors.f16": 2 * dim, "ids.i64": 8, "labels.i8": 1, "lists.i32": 4}
+        with self._locked():
+            self._load(repair=True)
+
+    # ---------------- storage ----------------
+    def _read(self, name, dtype):
+        path = self._paths[name]
+        return np.fromfile(path, dtype=dtype) if os.path.exists(path) else np.empty(0, dtype)
+
+    def _rows(self, name):
+        path = self._paths[name]
+        return os.path.getsize(path) // self._row_bytes[name] if os.path.exists(path) else 0
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive lock shared with other processes appending to this index."""
+        with open(self._paths["lock"], "a+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def _load(self, repair=False):
+        """Read the complete rows on disk; with ``repair`` (lock held) cut off torn appends."""
+        trained = os.path.exists(self._paths["centroids.npy"])
+        files = ["vectors.f16", "ids.i64", "labels.i8"] + (["lists.i32"] if trained else [])
+        n = min(self._rows(name) for name in files)
+        if repair:
+            # An interrupted append can leave the files at different lengths
+            for name in files:
+                if self._rows(name) > n:
+                    os.truncate(self._paths[name], n * self._row_bytes[name])
+        self.ids = self._read("ids.i64", np.int64)[:n]
+        self.labels = self._read("labels.i8", np.int8)[:n]
+        self._vectors = None
+        self.centroids = None
+        self._lists = None
+        if trained:
+            self.centroids = np.load(self._paths["centroids.npy"])
+            self._build_lists(self._read("lists.i32", np.int32)[:n])
+
+    def _refresh(self):
+        """Pick up rows (or a trained quantizer) written by other processes."""
+        if self._rows("ids.i64") != len(self.ids) or \
+                os.path.exists(self._paths["centroids.npy"]) != (self.centroids is not None):
+            self._load()
+
+    def _append(self, name, array):
+        with open(self._paths[name], "ab") as f:
+            f.write(np.ascontiguousarray(array).tobytes())
+
+    @property
+    def vectors(self):
+        n = len(self.ids)
+        if self._vectors is None or len(self._vectors) != n:
+            self._vectors = (np.memmap(self._paths["vectors.f16"], dtype=np.float16, mode="r",
+                                       shape=(n, self.dim)) if n else
+                             np.empty((0, self.dim), np.float16))
+        return self._vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    # ---------------- inverted lists ----------------
+    def _build_lists(self, assign):
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assign[order], np.arange(self.nlist + 1))
+        # Per-list row arrays with spare capacity, grown by doubling on insert
+        self._sizes = np.diff(bounds)
+        self._lists = []
+        for i in range(self.nlist):
+            rows = np.empty(max(16, 2 * int(self._sizes[i])), dtype=np.int64)
+            rows[:self._sizes[i]] = order[bounds[i]:bounds[i + 1]]
+            self._lists.append(rows)
+
+    def train(self, max_train_per_list=64, chunk=65536):
+        """Fit the coarse quantizer on a sample of stored vectors and assign all."""
+        n = len(self.ids)
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(n, min(n, max_train_per_list * self.nlist), replace=False))
+        self.centroids = kmeans(np.asarray(self.vectors[sample], dtype=np.float32), self.nlist)
+        assign = np.concatenate([
+            np.argmax(np.asarray(self.vectors[i:i + chunk], dtype=np.float32) @ self.centroids.T,
+                      axis=1).astype(np.int32)
+            for i in range(0, n, chunk)
+        ])
+        # Lists first: centroids.npy marks a complete, trained index
+        with open(self._paths["lists.i32"] + ".tmp", "wb") as f:
+            f.write(assign.tobytes())
+        os.replace(self._paths["lists.i32"] + ".tmp", self._paths["lists.i32"])
+        with open(self._paths["centroids.npy"] + ".tmp", "wb") as f:
+            np.save(f, self.centroids)
+        os.replace(self._paths["centroids.npy"] + ".tmp", self._paths["centroids.npy"])
+        self._build_lists(assign)
+
+    # ---------------- public API ----------------
+    def add(self, scan_ids, embeddings, labels):
+        """Append embeddings for ``scan_ids`` with their DR grades; no rebuild."""
+        with self._locked():
+            self._refresh()
+            self._add(scan_ids, embeddings, labels)
+
+    def _add(self, scan_ids, embeddings, labels):
+        x = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        x /= np.linalg.norm(x, axis=1, keepdims=True).clip(1e-8)
+        start = len(self.ids)
+
+        self._append("vectors.f16", x.astype(np.float16))
+        self._append("ids.i64", np.asarray(scan_ids, dtype=np.int64).ravel())
+        self._append("labels.i8", np.asarray(labels, dtype=np.int8).ravel())
+        self.ids = np.concatenate([self.ids, np.asarray(scan_ids, dtype=np.int64).ravel()])
+        self.labels = np.concatenate([self.labels, np.asarray(labels, dtype=np.int8).ravel()])
+
+        if self.centroids is not None:
+            assign = np.argmax(x @ self.centroids.T, axis=1).astype(np.int32)
+            self._append("lists.i32", assign)
+            for offset, lst in enumerate(assign):
+                size = self._sizes[lst]
+                if size == len(self._lists[lst]):
+                    self._lists[lst] = np.resize(self._lists[lst], 2 * size)
+                self._lists[lst][size] = start + offset
+                self._sizes[lst] = size + 1
+        elif len(self.ids) >= self.min_train:
+            self.train()
+
+    def search(self, embedding, k=5):
+        """Return up to ``k`` ``(scan_id, grade, cosine_similarity)`` tuples."""
+        self._refresh()
+        if len(self.ids) == 0:
+            return []
+        q = np.asarray(embedding, dtype=np.float32).ravel()
+        q /= max(np.linalg.norm(q), 1e-8)
+
+        if self.centroids is None:
+            candidates = np.arange(len(self.ids))
+        else:
+            probe = np.argpartition(-(self.centroids @ q), min(self.nprobe, self.nlist - 1))
+            probe = probe[:self.nprobe]
+            candidates = np.concatenate([self._lists[p][:self._sizes[p]] for p in probe])
+            if candidates.size == 0:
+                return []
+            candidates.sort()  # sequential memmap reads
+
+        sims = np.asarray(self.vectors[candidates], dtype=np.float32) @ q
+        k = min(k, len(sims))
+        top = np.argpartition(-sims, k - 1)[:k]
+        top = top[np.argsort(-sims[top])]
+        rows = candidates[top]
+        return [(int(self.ids[r]), int(self.labels[r]), float(s))
+                for r, s in zip(rows, sims[top])]
+
+
+_indexes = {}
+
+
+def default_index(version):
+    """This process's ``SimilarCaseIndex`` for ``version``'s embeddings, opened on first use."""
+    if version not in _indexes:
+        _indexes[version] = SimilarCaseIndex(os.path.join(INDEX_DIR, str(version)))
+    return _indexes[version]
+
+
+def index_results(scan_ids, results):
+    """Add stored scans with an embedding to their model version's index; returns how many.
+
+    Called once their transaction has committed; a failure here is logged and
+    never fails the scan (the embedding is only needed for retrieval).
+    """
+    rows = [(scan_id, r) for scan_id, r in zip(scan_ids, results)
+            if scan_id is not None and isinstance(r, dict) and r.get("embedding") is not None]
+    if not rows:
+        return 0
+    added = 0
+    for version in {r.get("model_version") for _, r in rows}:
+        group = [(scan_id, r) for scan_id, r in rows if r.get("model_version") == version]
+        try:
+            default_index(version).add([scan_id for scan_id, _ in group],
+                                       np.stack([r["embedding"] for _, r in group]),
+                                       [r["value"] for _, r in group])
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Could not index similar cases: {e}")
+            continue
+        added += len(group)
+    return added
@@ -11,7 +11,29 @@ try:
     stats = get_dashboard_stats()
     print(f"   [OK] Stats retrieved: {stats}")
     
-    print("3. Testing app initialization...")
+    print("3. Testing headless worker on an old-schema database...")
+    import os
+    import sqlite3
+    import tempfile
+    import model
+    import scan_queue
+    old_db = os.path.join(tempfile.mkdtemp(), "retinal_ai.db")
+    legacy = sqlite3.connect(old_db)
+    legacy.execute("CREATE TABLE scans (id INTEGER PRIMARY KEY AUTOINCREMENT, patient_id TEXT, "
+                   "eye TEXT, diagnosis TEXT, confidence REAL, scan_date TEXT)")
+    legacy.commit()
+    legacy.close()
+    queue = scan_queue.connect(old_db)
+    scan_queue.enqueue(queue, "P-OLD", os.path.join("sampleimages", "eye1.png"), eye="Right")
+    queue.close()
+    scan_queue.run_worker(old_db, once=True, engine=model)
+    queue = scan_queue.connect(old_db)
+    row = queue.execute("SELECT probs, model_version FROM scans").fetchone()
+    queue.close()
+    assert row is not None and row["probs"] and row["model_version"] == model.MODEL_VERSION
+    print("   [OK] Old scans table migrated and scored")
+
+    print("4. Testing app initialization...")
     # Don't actually start the GUI, just test initialization
     print("   [OK] App ready to start")
     
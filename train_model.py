@@ -1,12 +1,16 @@
 import os
+import json
 import random
 import torch
 from torch import nn, optim
 from torchvision import datasets, transforms, models
-from torch.utils.data import DataLoader, random_split
+from torch.utils.data import DataLoader, Subset, random_split
 from tqdm import tqdm
 from datetime import datetime
 
+from evaluation import quadratic_weighted_kappa, expected_grade, optimize_thresholds
+from preprocessing import FundusPreprocessor
+
 # ===============================================================
 # 🔧 CONFIG
 # ===============================================================
@@ -18,6 +22,8 @@ LR = 1e-4
 SEED = 42
 PATIENCE = 3            # early stopping patience
 MODEL_PATH = "classifier.pt"
+BEN_GRAHAM = True       # fundus crop + local contrast normalization (cached)
+SPLIT_FILE = "dataset/split.json"   # group-aware split from near_duplicates.py
 
 # ===============================================================
 # 🎯 REPRODUCIBILITY
@@ -57,14 +63,32 @@ val_transform = transforms.Compose([
 # ===============================================================
 # 📦 DATASET
 # ===============================================================
-full_dataset = datasets.ImageFolder(DATA_DIR, transform=train_transform)
-
-train_size = int(0.8 * len(full_dataset))
-val_size = len(full_dataset) - train_size
-
-train_dataset, val_dataset = random_split(
-    full_dataset, [train_size, val_size]
-)
+preprocessor = FundusPreprocessor(size=224)
+loader_fn = preprocessor.load if BEN_GRAHAM else datasets.folder.default_loader
+
+full_dataset = datasets.ImageFolder(DATA_DIR, transform=train_transform, loader=loader_fn)
+
+if os.path.exists(SPLIT_FILE):
+    # Near-duplicate clusters stay on one side, so val measures unseen eyes
+    with open(SPLIT_FILE) as f:
+        split = json.load(f)
+    index_of = {
+        os.path.relpath(path, DATA_DIR).replace(os.sep, "/"): i
+        for i, (path, _) in enumerate(full_dataset.samples)
+    }
+    train_dataset = Subset(full_dataset, [index_of[p] for p in split["train"] if p in index_of])
+    val_dataset = Subset(full_dataset, [index_of[p] for p in split["val"] if p in index_of])
+    train_size, val_size = len(train_dataset), len(val_dataset)
+    print(f"✂️ Using group-aware split from {SPLIT_FILE}")
+else:
+    print(f"⚠️ {SPLIT_FILE} not found – random split may leak near-duplicates "
+          f"(run near_duplicates.py)")
+    train_size = int(0.8 * len(full_dataset))
+    val_size = len(full_dataset) - train_size
+
+    train_dataset, val_dataset = random_split(
+        full_dataset, [train_size, val_size]
+    )
 
 # Override transform for validation
 val_dataset.dataset.transform = val_transform
@@ -114,6 +138,7 @@ scaler = torch.cuda.amp.GradScaler(enabled=(device.type == "cuda"))
 # 🚀 TRAINING LOOP
 # ===============================================================
 best_val_acc = 0.0
+best_val_kappa = 0.0
 epochs_no_improve = 0
 
 print("\n🚀 Training started...\n")
@@ -154,6 +179,8 @@ for epoch in range(NUM_EPOCHS):
     val_loss = 0.0
     correct = 0
     total = 0
+    val_probs = []
+    val_labels = []
 
     with torch.no_grad():
         for inputs, labels in val_loader:
@@ -166,15 +193,29 @@ for epoch in range(NUM_EPOCHS):
             correct += (preds == labels).sum().item()
             total += labels.size(0)
 
+            val_probs.append(torch.softmax(outputs, dim=1).cpu())
+            val_labels.append(labels.cpu())
+
     val_acc = 100 * correct / total
     avg_val_loss = val_loss / len(val_loader)
 
+    # Quadratic Weighted Kappa on argmax grades, then on the
+    # probability-weighted severity score with tuned cut-points
+    val_probs = torch.cat(val_probs).numpy()
+    val_labels = torch.cat(val_labels).numpy()
+    val_kappa = quadratic_weighted_kappa(val_labels, val_probs.argmax(axis=1), NUM_CLASSES)
+    thresholds, tuned_kappa = optimize_thresholds(
+        expected_grade(val_probs), val_labels, num_classes=NUM_CLASSES
+    )
+
     print(
         f"\n📘 Epoch {epoch+1}"
         f" | Train Loss: {avg_train_loss:.4f}"
         f" | Train Acc: {train_acc:.2f}%"
         f" | Val Loss: {avg_val_loss:.4f}"
         f" | Val Acc: {val_acc:.2f}%"
+        f" | Val QWK: {val_kappa:.4f}"
+        f" | Tuned QWK: {tuned_kappa:.4f}"
     )
 
     # ===============================================================
@@ -182,6 +223,7 @@ for epoch in range(NUM_EPOCHS):
     # ===============================================================
     if val_acc > best_val_acc:
         best_val_acc = val_acc
+        best_val_kappa = val_kappa
         epochs_no_improve = 0
 
         torch.save({
@@ -189,7 +231,11 @@ for epoch in range(NUM_EPOCHS):
             "optimizer_state_dict": optimizer.state_dict(),
             "num_classes": NUM_CLASSES,
             "architecture": "resnet18",
+            "preprocessing": "ben_graham" if BEN_GRAHAM else None,
             "val_accuracy": best_val_acc,
+            "val_kappa": val_kappa,
+            "thresholds": thresholds,
+            "tuned_kappa": tuned_kappa,
             "timestamp": datetime.utcnow().isoformat()
         }, MODEL_PATH)
 
@@ -202,4 +248,5 @@ for epoch in range(NUM_EPOCHS):
 
 print("\n🎯 Training complete")
 print(f"🏆 Best Validation Accuracy: {best_val_acc:.2f}%")
+print(f"📐 Validation QWK at best epoch: {best_val_kappa:.4f}")
 print(f"📦 Model saved as: {MODEL_PATH}")
@@ -131,6 +131,14 @@ for idx, img in enumerate(np.random.choice(test_imgs, 16)):
 # In[ ]:
 
 
+# Ben Graham crop + local contrast normalization, cached by content hash
+from preprocessing import FundusPreprocessor
+preprocessor = FundusPreprocessor(size=224, cache_dir="/kaggle/working/preprocess_cache")
+
+
+# In[ ]:
+
+
 # Our own custom class for datasets
 class CreateDataset(Dataset):
     def __init__(self, df_data, data_dir = '../input/', transform=None):
@@ -145,7 +153,7 @@ class CreateDataset(Dataset):
     def __getitem__(self, index):
         img_name,label = self.df[index]
         img_path = os.path.join(self.data_dir, img_name+'.png')
-        image = cv2.imread(img_path)
+        image = preprocessor.load_array(img_path)
         if self.transform is not None:
             image = self.transform(image)
         return image, label
@@ -420,6 +428,19 @@ def train_and_test(e):
 # In[ ]:
 
 
+# Optional: conv1/layer1 are frozen, so their activations never change.
+# Cache them once as fp16 (python feature_cache.py build) and train
+# layer2 onwards from the memory-mapped store instead of full images.
+USE_FEATURE_CACHE = False
+if USE_FEATURE_CACHE:
+    from feature_cache import train_from_store
+    train_from_store(model, "/kaggle/working/feature_store", epochs=5, lr=0.000001,
+                     device=device, save_path=path)
+
+
+# In[ ]:
+
+
 train_losses, valid_losses, acc = train_and_test(5)
 
 
@@ -0,0 +1,99 @@
+"""
+Test-time augmentation (TTA) for the DR grading models.
+
+Every view is deterministic, so the same image always gets the same
+prediction. All K views of a batch are stacked into a single forward pass
+and their class probabilities are averaged.
+"""
+import time
+
+import numpy as np
+import torch
+import torchvision.transforms.functional as TF
+
+from evaluation import quadratic_weighted_kappa
+
+# ============================================================
+# View Definitions (in budget priority order)
+# ============================================================
+ROTATION_DEGREES = 10
+ZOOM_FRACTION = 0.9
+
+
+def _zoom(batch):
+    h, w = batch.shape[-2:]
+    crop = TF.center_crop(batch, [int(h * ZOOM_FRACTION), int(w * ZOOM_FRACTION)])
+    return TF.resize(crop, [h, w], antialias=True)
+
+
+TTA_VIEWS = [
+    ("identity", lambda b: b),
+    ("hflip", lambda b: torch.flip(b, dims=[-1])),
+    ("vflip", lambda b: torch.flip(b, dims=[-2])),
+    ("rot180", lambda b: torch.flip(b, dims=[-2, -1])),
+    ("rot+10", lambda b: TF.rotate(b, ROTATION_DEGREES)),
+    ("rot-10", lambda b: TF.rotate(b, -ROTATION_DEGREES)),
+    ("zoom", _zoom),
+    ("zoom+hflip", lambda b: torch.flip(_zoom(b), dims=[-1])),
+]
+MAX_VIEWS = len(TTA_VIEWS)
+
+
+# ============================================================
+# Batched TTA Prediction
+# ============================================================
+def build_views(batch, n_views):
+    """Stack the first ``n_views`` views of a (B, C, H, W) batch into (K*B, C, H, W)."""
+    if not 1 <= n_views <= MAX_VIEWS:
+        raise ValueError(f"n_views must be between 1 and {MAX_VIEWS}, got {n_views}")
+    return torch.cat([fn(batch) for _, fn in TTA_VIEWS[:n_views]], dim=0)
+
+
+def predict_tta(model, batch, n_views=4, device=None):
+    """Return (B, num_classes) probabilities averaged over ``n_views`` views.
+
+    Works for models ending in ``LogSoftmax`` as well as plain logits, since
+    softmax is invariant to the per-row shift LogSoftmax applies.
+    """
+    device = device or next(model.parameters()).device
+    batch_size = batch.shape[0]
+
+    model.eval()
+    with torch.inference_mode():
+        views = build_views(batch.to(device), n_views)
+        probs = torch.softmax(model(views), dim=1)
+        return probs.view(n_views, batch_size, -1).mean(dim=0)
+
+
+# ============================================================
+# Latency / Accuracy Trade-off
+# ============================================================
+def benchmark_tta(model, loader, budgets=(1, 2, 4, MAX_VIEWS), device=None):
+    """Measure accuracy, QWK and per-image latency for each view budget.
+
+    Returns a list of dicts, one per budget, so the cheapest budget that
+    meets the accuracy target can be picked for deployment.
+    """
+    report = []
+    for n_views in budgets:
+        preds, labels = [], []
+        elapsed = 0.0
+        for inputs, targets in loader:
+            start = time.perf_counter()
+            probs = predict_tta(model, inputs, n_views, device)
+            elapsed += time.perf_counter() - start
+            preds.append(probs.argmax(dim=1).cpu().numpy())
+            labels.append(np.asarray(targets))
+
+        preds = np.concatenate(preds)
+        labels = np.concatenate(labels)
+        report.append({
+            "views": n_views,
+            "accuracy": float((preds == labels).mean()),
+            "kappa": quadratic_weighted_kappa(labels, preds),
+            "ms_per_image": 1000 * elapsed / len(labels),
+        })
+        print(f"🔁 TTA x{n_views}: acc={report[-1]['accuracy']:.4f} "
+              f"qwk={report[-1]['kappa']:.4f} "
+              f"latency={report[-1]['ms_per_image']:.1f} ms/img")
+    return report
@@ -0,0 +1,74 @@
+"""
+Pre-generated multi-resolution UI assets.
+
+``python setup_background.py`` and ``python create_logo.py`` write
+renditions of the background and logo to ``assets/renditions/`` for the
+screen sizes clinics use (1366x768 up to 4K). At runtime the app picks
+the smallest rendition that covers the window and scales it by a small
+factor, instead of scaling the full source image for every page on every
+resize.
+
+``BackgroundRenditions.photo(w, h)`` returns one shared PhotoImage per
+window size. All pages show the same image, and the last size is cached,
+so raising pages or repeated resize events to the same size cost nothing.
+"""
+import os
+
+from PIL import Image, ImageTk
+
+ASSETS_DIR = "assets"
+RENDITIONS_DIR = os.path.join(ASSETS_DIR, "renditions")
+BACKGROUND_SIZES = [(1366, 768), (1400, 800), (1600, 900), (1920, 1080),
+                    (2560, 1440), (3840, 2160)]
+LOGO_SIZES = [16, 32, 48, 64, 128, 256]
+
+
+def rendition_path(name, size, ext="jpg"):
+    """``assets/renditions/<name>_<w>x<h>.<ext>``."""
+    w, h = size
+    return os.path.join(RENDITIONS_DIR, f"{name}_{w}x{h}.{ext}")
+
+
+def available(name, sizes, ext="jpg"):
+    """The sizes of ``name`` that have been generated, smallest first."""
+    return sorted((s for s in sizes if os.path.exists(rendition_path(name, s, ext))),
+                  key=lambda s: s[0] * s[1])
+
+
+def pick(name, width, height, sizes=BACKGROUND_SIZES, source=None, ext="jpg"):
+    """Smallest generated rendition covering ``width`` x ``height`` (else the largest).
+
+    Falls back to ``source`` when no renditions have been built.
+    """
+    built = available(name, sizes, ext)
+    if not built:
+        return source
+    covering = [s for s in built if s[0] >= width and s[1] >= height]
+    return rendition_path(name, covering[0] if covering else built[-1], ext)
+
+
+class BackgroundRenditions:
+    """Window-sized background PhotoImages built from the nearest rendition."""
+
+    def __init__(self, name="medical_background",
+                 source=os.path.join(ASSETS_DIR, "medical_background.jpg")):
+        self.name = name
+        self.source = source
+        self._path = None
+        self._image = None
+        self._size = None
+        self._photo = None
+        if not available(name, BACKGROUND_SIZES):
+            print("[WARN] No background renditions; run setup_background.py for faster resizing")
+
+    def photo(self, width, height):
+        size = (max(width, 1), max(height, 1))
+        if size == self._size:
+            return self._photo
+        path = pick(self.name, *size, source=self.source)
+        if path != self._path:
+            self._image = Image.open(path).convert("RGB")
+            self._path = path
+        self._photo = ImageTk.PhotoImage(self._image.resize(size, Image.Resampling.BILINEAR))
+        self._size = size
+        return self._photo
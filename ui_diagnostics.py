@@ -0,0 +1,226 @@
+"""
+Memory diagnostics for the Tk application.
+
+``PhotoCache`` is a bounded LRU of ``ImageTk.PhotoImage`` objects for
+fundus previews and Grad-CAM overlays. Each photo is backed by a Tk image
+that lives until its last Python reference is gone, so a long clinic
+session that keeps every patient's previews grows without bound. With
+the cache, only the most recent ``maxsize`` photos (plus whatever a
+widget still shows) stay alive.
+
+``MemoryDiagnostics`` is the ``--diagnostics`` mode of blindness.py. It
+runs ``tracemalloc`` and, every ``interval_ms``, records traced memory,
+the number of Tk images and the images each page holds. Allocations are
+attributed to page classes by the innermost traceback frame inside a
+page's source. On exit it writes a report with the time series, the
+growth per page class since startup and the top growing allocation sites.
+
+Usage:
+    python blindness.py --diagnostics --diag-interval 30
+"""
+import inspect
+import time
+import tracemalloc
+from collections import OrderedDict
+from datetime import datetime
+
+from PIL import ImageTk
+
+
+# ============================================================
+# Bounded Preview Cache
+# ============================================================
+class PhotoCache:
+    """LRU of PhotoImages keyed by e.g. ``("thumb", digest)``."""
+
+    def __init__(self, maxsize=24):
+        self.maxsize = maxsize
+        self._photos = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key, load):
+        """Cached photo for ``key``, else ``ImageTk.PhotoImage(load())``."""
+        photo = self._photos.get(key)
+        if photo is not None:
+            self._photos.move_to_end(key)
+            self.hits += 1
+            return photo
+        self.misses += 1
+        photo = ImageTk.PhotoImage(load())
+        self._photos[key] = photo
+        while len(self._photos) > self.maxsize:
+            self._photos.popitem(last=False)
+            self.evictions += 1
+        return photo
+
+    def names(self):
+        return {str(p) for p in self._photos.values()}
+
+    def __len__(self):
+        return len(self._photos)
+
+
+# ============================================================
+# Diagnostics Mode
+# ============================================================
+def _image_names(obj, depth=3, seen=None):
+    """Tk image names of PhotoImages reachable from ``obj``'s attributes."""
+    seen = seen if seen is not None else set()
+    if id(obj) in seen or depth < 0:
+        return set()
+    seen.add(id(obj))
+    if isinstance(obj, ImageTk.PhotoImage):
+        return {str(obj)}
+    if isinstance(obj, dict):
+        children = obj.values()
+    elif isinstance(obj, (list, tuple, set)):
+        children = obj
+    elif hasattr(obj, "__dict__") and not inspect.isclass(obj):
+        children = [v for k, v in vars(obj).items() if k not in ("master", "app", "tk")]
+    else:
+        return set()
+    names = set()
+    for child in children:
+        names |= _image_names(child, depth - 1, seen)
+    return names
+
+
+class MemoryDiagnostics:
+    """Periodic tracemalloc + Tk image sampling of a ``RetinalAIApp``."""
+
+    def __init__(self, app, interval_ms=60000, nframes=25, cache=None):
+        self.app = app
+        self.interval_ms = interval_ms
+        self.nframes = nframes
+        self.cache = cache
+        self.samples = []
+        self.baseline = None
+        self.latest = None
+        self.started = None
+        self._sites = {}        # (filename, lineno) -> page class name or None
+        self._ranges = []
+
+    def start(self):
+        tracemalloc.start(self.nframes)
+        self.started = time.time()
+        for page in self.app.frames:
+            try:
+                lines, first = inspect.getsourcelines(page)
+            except (OSError, TypeError):
+                continue
+            self._ranges.append((inspect.getsourcefile(page), first, first + len(lines),
+                                 page.__name__))
+        self.baseline = self._snapshot()
+        self.sample()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+
+    def _page_of(self, frame):
+        key = (frame.filename, frame.lineno)
+        if key not in self._sites:
+            self._sites[key] = next((name for path, first, last, name in self._ranges
+                                     if frame.filename == path and first <= frame.lineno < last),
+                                    None)
+        return self._sites[key]
+
+    def attribute(self, snapshot):
+        """Bytes per page class (innermost page frame of each allocation)."""
+        per_page = {}
+        for stat in snapshot.statistics("traceback"):
+            owner = next((p for p in map(self._page_of, reversed(stat.traceback)) if p), None)
+            owner = owner or "(outside pages)"
+            per_page[owner] = per_page.get(owner, 0) + stat.size
+        return per_page
+
+    def page_images(self):
+        """Tk images referenced by each page (its widgets and attributes)."""
+        per_page = {}
+        for page, frame in self.app.frames.items():
+            names = _image_names(frame)
+            stack = [frame]
+            while stack:
+                widget = stack.pop()
+                stack.extend(widget.winfo_children())
+                try:
+                    if widget.cget("image"):
+                        names.add(str(widget.cget("image")))
+                except Exception:
+                    pass  # widget has no image option
+            per_page[page.__name__] = names
+        if self.cache is not None:
+            per_page["(preview cache)"] = self.cache.names()
+        return per_page
+
+    def sample(self):
+        self.record()
+        self.app.after(self.interval_ms, self.sample)
+
+    def record(self):
+        self.latest = self._snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        images = self.page_images()
+        # Tk keeps photo pixels outside Python's heap; approximate them as RGBA
+        names = self.app.tk.splitlist(self.app.tk.call("image", "names"))
+        pixels = sum(int(self.app.tk.call("image", "width", n)) *
+                     int(self.app.tk.call("image", "height", n)) for n in names)
+        self.samples.append({
+            "elapsed": time.time() - self.started,
+            "current": current,
+            "peak": peak,
+            "tk_images": len(names),
+            "tk_image_bytes": 4 * pixels,
+            "page_images": {page: len(names) for page, names in images.items()},
+            "cached": len(self.cache) if self.cache is not None else 0,
+        })
+
+    def report(self):
+        """Report text comparing the latest sample to startup."""
+        first, last = self.samples[0], self.samples[-1]
+        mb = 1024 * 1024
+        lines = [
+            f"RetinalAI memory report – {datetime.now().isoformat(timespec='seconds')}",
+            f"Session: {last['elapsed'] / 60:.1f} min, {len(self.samples)} samples",
+            f"Traced memory: {first['current'] / mb:.1f} MB -> {last['current'] / mb:.1f} MB "
+            f"(peak {last['peak'] / mb:.1f} MB)",
+            f"Tk images: {first['tk_images']} -> {last['tk_images']} "
+            f"({first['tk_image_bytes'] / mb:.1f} MB -> {last['tk_image_bytes'] / mb:.1f} MB pixels)",
+        ]
+        if self.cache is not None:
+            lines.append(f"Preview cache: {len(self.cache)}/{self.cache.maxsize} photos, "
+                         f"{self.cache.hits} hits, {self.cache.misses} misses, "
+                         f"{self.cache.evictions} evictions")
+
+        lines += ["", "Growth by page class (traced allocations since startup):"]
+        before, after = self.attribute(self.baseline), self.attribute(self.latest)
+        growth = {p: after.get(p, 0) - before.get(p, 0) for p in set(before) | set(after)}
+        for page, delta in sorted(growth.items(), key=lambda kv: -kv[1]):
+            lines.append(f"  {page:<24} {delta / 1024:>+12.1f} KiB "
+                         f"(now {after.get(page, 0) / 1024:.1f} KiB)")
+
+        lines += ["", "Tk images held per page (first -> last sample):"]
+        for page, count in last["page_images"].items():
+            lines.append(f"  {page:<24} {first['page_images'].get(page, 0):>4} -> {count}")
+
+        lines += ["", "Top growing allocation sites:"]
+        for stat in self.latest.compare_to(self.baseline, "lineno")[:15]:
+            lines.append(f"  {stat.size_diff / 1024:>+10.1f} KiB  {stat.traceback[0]}")
+
+        lines += ["", "Samples (min, traced MB, Tk images, Tk image MB, cached previews):"]
+        for s in self.samples:
+            lines.append(f"  {s['elapsed'] / 60:>7.1f} {s['current'] / mb:>9.1f} "
+                         f"{s['tk_images']:>6} {s['tk_image_bytes'] / mb:>8.1f} {s['cached']:>6}")
+        return "\n".join(lines)
+
+    def write_report(self, path=None):
+        self.record()
+        path = path or f"memory_report_{datetime.now():%Y%m%d_%H%M%S}.txt"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(self.report() + "\n")
+        tracemalloc.stop()
+        print(f"📝 Memory report written to {path}")
+        return path
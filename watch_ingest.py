@@ -0,0 +1,251 @@
+"""
+Directory-watch ingest for fundus camera export folders.
+
+Watches a folder the cameras export into and, for every new image:
+
+1. waits until the file is completely written: inotify ``IN_CLOSE_WRITE``
+   / ``IN_MOVED_TO`` on Linux, otherwise (or with ``--poll``, e.g. on
+   network shares where inotify sees no remote writes) until size and
+   mtime have been stable for ``--settle`` seconds;
+2. reads patient ID and eye from a sidecar (``<name>.json`` or
+   ``<name>.txt`` with ``key=value`` lines) or, failing that, from the
+   filename (``<patient>_<OD|OS|L|R>_...``);
+3. copies it into the content-addressed image store, runs the quality
+   gate and enqueues a ``scan_jobs`` row (see scan_queue.py); rejected
+   images are reported and skipped, not queued.
+
+Headless workers, or ``--infer`` in this process, score the queue in
+batches and write ``scans``; the dashboard shows throughput and depth.
+
+Usage:
+    python watch_ingest.py /mnt/camera_export --infer
+"""
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import re
+import select
+import struct
+import threading
+import time
+
+import quality_gate
+import scan_queue
+from image_store import ImageStore
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".bmp")
+SETTLE_SECONDS = 2.0        # polling: unchanged size/mtime for this long = write finished
+SIDECAR_GRACE = 1.0         # give a sidecar written after the image time to appear
+
+FILENAME_PATTERN = re.compile(
+    r"^(?P<patient>[A-Za-z0-9-]+)[_ ](?P<eye>OD|OS|L|R|LEFT|RIGHT)(?:[_ .-]|$)", re.IGNORECASE
+)
+EYES = {"od": "Right", "r": "Right", "right": "Right",
+        "os": "Left", "l": "Left", "left": "Left"}
+
+
+# ============================================================
+# Patient Metadata
+# ============================================================
+def read_sidecar(image_path):
+    """Metadata dict from ``<stem>.json`` or ``<stem>.txt`` next to the image, else {}."""
+    stem = os.path.splitext(image_path)[0]
+    if os.path.exists(stem + ".json"):
+        with open(stem + ".json") as f:
+            return {k.lower(): v for k, v in json.load(f).items()}
+    if os.path.exists(stem + ".txt"):
+        meta = {}
+        with open(stem + ".txt") as f:
+            for line in f:
+                key, sep, value = line.partition("=")
+                if not sep:
+                    key, sep, value = line.partition(":")
+                if sep:
+                    meta[key.strip().lower()] = value.strip()
+        return meta
+    return {}
+
+
+def patient_info(image_path):
+    """``(patient_id, eye)`` from the sidecar, else the filename; eye may be None."""
+    meta = read_sidecar(image_path)
+    patient = meta.get("patient_id") or meta.get("patientid") or meta.get("patient")
+    eye = meta.get("eye") or meta.get("laterality")
+    if not patient:
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        match = FILENAME_PATTERN.match(stem)
+        if match:
+            patient, eye = match.group("patient"), eye or match.group("eye")
+        else:
+            patient = stem.split("_")[0]
+    return str(patient), EYES.get(str(eye).lower()) if eye else None
+
+
+# ============================================================
+# Watchers
+# ============================================================
+class InotifyWatcher:
+    """Completed files in ``directory`` via Linux inotify (no extra dependency)."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(self.fd, os.fsencode(directory),
+                                    self.IN_CLOSE_WRITE | self.IN_MOVED_TO)
+        if wd < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), f"cannot watch {directory}")
+        self.directory = directory
+
+    def poll(self, timeout):
+        """Paths finished since the last call (waits up to ``timeout`` seconds)."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        buf = os.read(self.fd, 64 * 1024)
+        paths, offset = [], 0
+        while offset < len(buf):
+            _, mask, _, length = struct.unpack_from("iIII", buf, offset)
+            name = buf[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            if name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Portable fallback: a file is complete once its size and mtime stop changing."""
+
+    def __init__(self, directory, settle=SETTLE_SECONDS):
+        self.directory = directory
+        self.settle = settle
+        self._seen = {}         # path -> (size, mtime, first time seen with that stat)
+        # Like inotify, only report files that appear after the watch starts
+        self._reported = {e.path for e in os.scandir(directory) if e.is_file()}
+
+    def poll(self, timeout):
+        time.sleep(timeout)
+        now = time.monotonic()
+        paths = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or entry.path in self._reported:
+                    continue
+                st = entry.stat()
+                stat = (st.st_size, st.st_mtime_ns)
+                prev = self._seen.get(entry.path)
+                if prev is None or prev[:2] != stat:
+                    self._seen[entry.path] = (*stat, now)
+                elif now - prev[2] >= self.settle and st.st_size > 0:
+                    paths.append(entry.path)
+                    self._reported.add(entry.path)
+                    del self._seen[entry.path]
+        return paths
+
+    def close(self):
+        pass
+
+
+def make_watcher(directory, force_poll=False, settle=SETTLE_SECONDS):
+    if not force_poll and os.name == "posix":
+        try:
+            return InotifyWatcher(directory)
+        except (OSError, AttributeError, TypeError) as e:
+            print(f"[WARN] inotify unavailable ({e}); falling back to polling")
+    return PollingWatcher(directory, settle)
+
+
+# ============================================================
+# Ingest
+# ============================================================
+class Ingestor:
+    """Stores, quality-checks and enqueues each completed camera file."""
+
+    def __init__(self, db_path=scan_queue.DB_NAME, store=None):
+        self.conn = scan_queue.connect(db_path)
+        self.store = store or ImageStore()
+        self.stats = {"ingested": 0, "duplicates": 0, "rejected": 0}
+        self.rejected = set()   # digests the quality gate turned away
+
+    def ingest(self, path):
+        """Enqueue ``path``; returns the job id, or None if skipped or rejected."""
+        digest = self.store.ingest(path)
+        if digest in self.rejected or self.conn.execute(
+                "SELECT 1 FROM scan_jobs WHERE image_hash = ? "
+                "AND state != 'failed' LIMIT 1", (digest,)).fetchone():
+            self.stats["duplicates"] += 1
+            return None
+        stored = self.store.path(digest)
+        quality = quality_gate.assess(stored)
+        if quality["status"] == "reject":
+            # Ungradable: the camera operator retakes it, nothing is queued
+            self.rejected.add(digest)
+            self.stats["rejected"] += 1
+            print(f"✖ {os.path.basename(path)}: {'; '.join(quality['reasons'])}")
+            return None
+        patient_id, eye = patient_info(path)
+        job_id = scan_queue.enqueue(self.conn, patient_id, stored, eye=eye,
+                                    image_hash=digest, quality=quality)
+        self.stats["ingested"] += 1
+        return job_id
+
+
+def watch(directory, db_path=scan_queue.DB_NAME, force_poll=False, settle=SETTLE_SECONDS,
+          include_existing=False, infer=False, batch_size=8):
+    """Run the watcher until interrupted."""
+    if infer:
+        threading.Thread(target=scan_queue.run_worker, args=(db_path, batch_size),
+                         daemon=True).start()
+    ingestor = Ingestor(db_path)
+    watcher = make_watcher(directory, force_poll, settle)
+    print(f"👀 Watching {directory} ({type(watcher).__name__})")
+
+    pending = {}   # completed image -> time it completed (waiting for a late sidecar)
+    if include_existing:
+        pending.update((e.path, 0.0) for e in os.scandir(directory) if e.is_file())
+    try:
+        while True:
+            now = time.monotonic()
+            for path in watcher.poll(0.5):
+                pending[path] = now
+            for path, t in list(pending.items()):
+                if now - t < SIDECAR_GRACE:
+                    continue
+                del pending[path]
+                if not path.lower().endswith(IMAGE_EXTS) or not os.path.exists(path):
+                    continue
+                try:
+                    job_id = ingestor.ingest(path)
+                except (OSError, ValueError) as e:
+                    print(f"[WARN] Could not ingest {path}: {e}")
+                    continue
+                if job_id:
+                    print(f"📥 {os.path.basename(path)} -> job {job_id} "
+                          f"| queue {scan_queue.queue_depth(ingestor.conn)}")
+    except KeyboardInterrupt:
+        print(f"🛑 Watcher stopped | {ingestor.stats}")
+    finally:
+        watcher.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch a camera export folder and enqueue scans")
+    parser.add_argument("directory")
+    parser.add_argument("--db", default=scan_queue.DB_NAME)
+    parser.add_argument("--poll", action="store_true", help="force the polling watcher")
+    parser.add_argument("--settle", type=float, default=SETTLE_SECONDS)
+    parser.add_argument("--existing", action="store_true", help="also ingest files already present")
+    parser.add_argument("--infer", action="store_true", help="run a batch worker in this process")
+    parser.add_argument("--batch", type=int, default=8)
+    args = parser.parse_args()
+    watch(args.directory, args.db, args.poll, args.settle, args.existing, args.infer, args.batch)